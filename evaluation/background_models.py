@@ -1,6 +1,10 @@
+import os
+import shutil
+import numpy as np
 import pandas as pd
-from .mappers import mapping_utils as mu
+from .mappers import mapping_utils as mu, store_utils as su
 from .mappers.mapper import Mapper
+from .mappers.columnar_mapping import InvertedIndex
 from . import config as c
 from abc import abstractmethod
 import random
@@ -24,9 +28,12 @@ class CompleteModel(BackgroundModel):
         self.full_id_set = full_id_map[full_id_map[c.ID_TYPE_KEY[prev_id_type]] != ""][
             c.ID_TYPE_KEY[prev_id_type]].tolist()
 
-    def get_module(self, to_replace):
-        random_sample = set(random.sample(self.full_id_set, len(to_replace)))
-        return random_sample
+    def get_module(self, to_replace, rng: np.random.Generator = None):
+        # ===== all ids are picked if there are less than to replace =====
+        size = min(len(to_replace), len(self.full_id_set))
+        if rng is None:
+            return set(random.sample(self.full_id_set, size))
+        return set(rng.choice(self.full_id_set, size=size, replace=False))
 
 
 class TermPresModel(BackgroundModel):
@@ -41,21 +48,22 @@ class TermPresModel(BackgroundModel):
         self.size_mapping_to_dict(pd_size_map=self.att_len, id_col=c.ID_TYPE_KEY[prev_id_type], term_col=term,
                                   threshold=100)
 
-    def get_module(self, to_replace, term, prev_id_type):
+    def get_module(self, to_replace, term, prev_id_type, rng: np.random.Generator = None):
         random_sample = set()
-        for replace_id in to_replace:
+        ids = self.att_len[c.ID_TYPE_KEY[prev_id_type]].to_numpy()
+        for replace_id in sorted(to_replace):
             if replace_id in self.size_mapping:  # only if id is mappable to other ids
-                random_sample.add(
-                    self.att_len[self.att_len[term].isin(self.size_mapping[replace_id])][
-                        c.ID_TYPE_KEY[prev_id_type]].sample(
-                        n=1).values[0])
+                # ===== same draw as sampling one row of att_len with a size of the size mapping =====
+                candidates = self.size_index.get_entities(terms=self.size_mapping[replace_id])
+                random_sample.add(ids[candidates[(np.random if rng is None else rng).choice(
+                    len(candidates), size=1, replace=False)[0]]])
         return random_sample
 
     def atts_to_size(self, pd_map: pd.DataFrame):
         att_len = pd_map.copy()
         att_len[att_len.columns[1:]] = att_len[att_len.columns[1:]].applymap(mu.set_to_len)
         att_len['sum'] = att_len[att_len.columns[1:]].sum(axis=1)
-        self.att_len = att_len
+        self.att_len = att_len.reset_index(drop=True)
 
     def size_mapping_to_dict(self, pd_size_map: pd.DataFrame, id_col: str, term_col: str, threshold: int = 100):
         size_to_occ = pd.DataFrame(pd_size_map[term_col].value_counts()).sort_index().to_dict()[term_col]
@@ -78,30 +86,32 @@ class TermPresModel(BackgroundModel):
             for cur_id in pd_size_map[pd_size_map[term_col] == key][id_col]:
                 new_dict[cur_id] = curr_keys
         self.size_mapping = new_dict
+        # ===== ids of att_len per number of terms, so sampling does not scan att_len per replaced id =====
+        codes, sizes = pd.factorize(self.att_len[term_col])
+        self.size_index = InvertedIndex.from_codes(codes=codes, entities=np.arange(len(self.att_len)),
+                                                   terms=pd.Index(sizes, dtype=object), size=len(self.att_len))
 
 
 class NetworkModel(BackgroundModel):
 
-    def __init__(self, network_data: dict, to_replace, N):
+    def __init__(self, network_data: dict, to_replace, N, rng: np.random.Generator = None):
         self.network_type = network_data['id_type']
-        if network_data["network_file"].endswith(".sif"):
-            df = pd.read_csv(network_data["network_file"], sep="\t", header=None)
-            G = gt.Graph(directed=False)
-            v_ids = G.add_edge_list(df[[0, 2]].values, hashed=True)
-            G.vertex_properties['id'] = v_ids
-        else:
-            G = gt.load_graph(network_data["network_file"])
-            G.vertex_properties['id'] = G.vertex_properties[network_data['prop_name']]
+        self.rng = np.random.default_rng() if rng is None else rng
+        G, self.node_ids = load_network(network_file=network_data["network_file"],
+                                        prop_name=network_data.get('prop_name'))
         # Reduce to ids that are present in the network
-        to_replace_filtered = to_replace.intersection(set(G.vertex_properties['id']))
+        to_replace_filtered = to_replace.intersection(set(self.node_ids))
         # Find number of CCs for the input module
         ccs_num = self.find_num_ccs(G, to_replace_filtered)
-        # Generate random modules of matched number of connected components
-        self.generate_rand_modules(G, N, ccs_num, len(to_replace_filtered))
-        self.node_ids = {node: G.vertex_properties["id"][node] for node in range(G.num_vertices())}
+        # Pick random modules of matched number of connected components from the pre-generated ones
+        self.rand_module_nodes_list = NetworkModuleStore(network_file=network_data["network_file"]).sample(
+            size=len(to_replace_filtered), ccs_num=ccs_num, N=N, rng=self.rng)
+        if self.rand_module_nodes_list is None:
+            # Generate random modules of matched number of connected components
+            self.generate_rand_modules(G, N, ccs_num, len(to_replace_filtered))
 
     def get_module(self, index):
-        return set([self.node_ids[node] for node in self.rand_module_nodes_list[index]])
+        return set(self.node_ids[np.fromiter(self.rand_module_nodes_list[index], dtype=np.int64)])
 
     def find_num_ccs(self, G, module_nodes):
         G.set_directed(False)
@@ -130,77 +140,190 @@ class NetworkModel(BackgroundModel):
         return ccs_num
 
     def generate_rand_modules(self, G, N, ccs_num, MS):
-        random_cc_modules_list = []
-        rand_module_nodes_list = []
-        for r in range(N):
-            random_cc_module, rand_module_nodes, iterr = self._rand_module(G, ccs_num, MS)
-            if iterr <= 20:
-                random_cc_modules_list.append(random_cc_module)
-                rand_module_nodes_list.append(rand_module_nodes)
-            else:
-                random_cc_module, rand_module_nodes, iterr = self._rand_module(G, ccs_num, MS)
-                random_cc_modules_list.append(random_cc_module)
-                rand_module_nodes_list.append(rand_module_nodes)
-            if len(rand_module_nodes) == 0:
-                print("tja...")
-        self.rand_module_nodes_list = rand_module_nodes_list
-
+        self.rand_module_nodes_list = generate_rand_modules(G, N, ccs_num, MS, rng=self.rng)
 
     def _rand_module(self, G, ccs_num, MS):
-        # step 1: randomly select ccs_num number of seeds (which are not neighbors)
-        G_nodes = list(range(G.num_vertices()))
-        random_cc_module = dict()
-        initial_seeds = []
-        neighb_initial_seeds = []
-        for c in range(ccs_num):
-            added = False
-            while not added:
-                s = random.choice(G_nodes)
-
-                if s not in initial_seeds and s not in neighb_initial_seeds and len(G.get_all_neighbors(s)>0):
-                    added = True
-                    initial_seeds.append(s)
-                    neighb_initial_seeds.extend(list(G.get_all_neighbors(s)))
-                    random_cc_module[s] = []
-
-        rand_module_nodes = set()
-        rand_module_nodes.update(initial_seeds)
-        # step 2: expand the selected seeds by their neighbors enforcing the number of CCs remain the same
-        for cs in initial_seeds:
-            #print(G.get_all_neighbors(cs))
-            #print(cs)
-            rn = random.choice(G.get_all_neighbors(cs))
-            intersect = False
-            for k in random_cc_module.keys():
-                if k != cs and (len(set(G.get_all_neighbors(rn)).intersection(
-                        set(random_cc_module[k]))) > 0 or rn in G.get_all_neighbors(k)):
-                    intersect = True
-                    break
-            if not intersect:
-                random_cc_module[cs].append(rn)
-                rand_module_nodes.add(rn)
-            if len(rand_module_nodes) >= MS:
+        return rand_module(G, ccs_num, MS, rng=self.rng)
+
+
+class NetworkModuleStore:
+    """
+    Random modules of a network pre-generated for every combination of module size and number of
+    connected components, so the network background model only has to pick from them. The modules
+    of a key are saved as vertex indices in csr layout, together with a stamp of the network file
+    that invalidates the store when the network changes.
+    """
+
+    def __init__(self, network_file: str):
+        """
+        :param network_file: path to the network file the modules are generated from
+        """
+        self.network_file = network_file
+        self.path = os.path.splitext(network_file)[0] + "_modules"
+
+    def is_current(self) -> bool:
+        """
+        Check if the store was generated from the current version of the network file.
+
+        :return: true if size and modification time of the network file are unchanged since the generation
+        """
+        if not os.path.isfile(os.path.join(self.path, "source.npy")) or not os.path.isfile(self.network_file):
+            return False
+        return np.array_equal(np.load(os.path.join(self.path, "source.npy")), _get_stamp(file=self.network_file))
+
+    def sample(self, size: int, ccs_num: int, N: int, rng: np.random.Generator):
+        """
+        Pick N different pre-generated modules.
+
+        :param size: number of nodes of the input module
+        :param ccs_num: number of connected components of the input module
+        :param N: number of modules
+        :param rng: generator used for picking the modules
+        :return: list with vertex indices of every module, None if there are less than N modules for the key
+        """
+        key_path = os.path.join(self.path, str(size) + "_" + str(ccs_num))
+        if not self.is_current() or not os.path.isfile(os.path.join(key_path, "nodes.npy")):
+            return None
+        arrays = su.load_arrays(path=key_path, names=['indptr', 'nodes'])
+        if len(arrays['indptr']) - 1 < N:
+            return None
+        picks = rng.choice(len(arrays['indptr']) - 1, size=N, replace=False)
+        return [arrays['nodes'][arrays['indptr'][pick]:arrays['indptr'][pick + 1]] for pick in picks]
+
+    def generate(self, sizes=c.NETWORK_MODULE_SIZES, ccs=c.NETWORK_MODULE_CCS,
+                 runs: int = c.NUMBER_OF_RANDOM_RUNS * c.NETWORK_MODULE_POOL_FACTOR, prop_name: str = "id",
+                 rng: np.random.Generator = None):
+        """
+        Generate random modules for all combinations of sizes and numbers of connected components
+        and replace the modules generated before. The pool of a combination is larger than the number
+        of random runs, so the runs of different validations do not all pick the same modules.
+
+        :param sizes: module sizes [Default=c.NETWORK_MODULE_SIZES]
+        :param ccs: numbers of connected components, only those up to the module size are used
+        [Default=c.NETWORK_MODULE_CCS]
+        :param runs: number of modules per combination
+        [Default=c.NUMBER_OF_RANDOM_RUNS * c.NETWORK_MODULE_POOL_FACTOR]
+        :param prop_name: name of the vertex property with the ids, "id" if None [Default="id"]
+        :param rng: generator used for the modules [Default=None]
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        G, _ = load_network(network_file=self.network_file, prop_name=prop_name)
+        G.set_directed(False)
+        shutil.rmtree(self.path, ignore_errors=True)
+        for size in sizes:
+            for ccs_num in ccs:
+                if ccs_num > size:
+                    continue
+                modules = generate_rand_modules(G, runs, ccs_num, size, rng=rng)
+                su.save_arrays(arrays={
+                    'indptr': np.concatenate(([0], np.cumsum([len(module) for module in modules]))).astype(np.int64),
+                    'nodes': np.fromiter((node for module in modules for node in sorted(module)), dtype=np.int64)},
+                    path=os.path.join(self.path, str(size) + "_" + str(ccs_num)))
+        # ===== stamp last, so an interrupted generation is never taken as current =====
+        su.save_arrays(arrays={'source': _get_stamp(file=self.network_file)}, path=self.path)
+
+
+_networks = dict()
+
+
+def load_network(network_file: str, prop_name: str = "id"):
+    """
+    Load network with the vertex ids in property 'id'. Loaded networks are kept and only
+    loaded again when the file changed.
+
+    :param network_file: path to a .sif or graph file
+    :param prop_name: name of the vertex property with the ids, "id" if None, not used for .sif files
+    [Default="id"]
+    :return: graph and array with the id of every vertex index
+    """
+    prop_name = "id" if prop_name is None else prop_name
+    key, stamp = (network_file, prop_name), _get_stamp(file=network_file)
+    if key not in _networks or not np.array_equal(_networks[key][0], stamp):
+        if network_file.endswith(".sif"):
+            df = pd.read_csv(network_file, sep="\t", header=None)
+            G = gt.Graph(directed=False)
+            v_ids = G.add_edge_list(df[[0, 2]].values, hashed=True)
+            G.vertex_properties['id'] = v_ids
+        else:
+            G = gt.load_graph(network_file)
+            G.vertex_properties['id'] = G.vertex_properties[prop_name]
+        node_ids = np.array([G.vertex_properties["id"][node] for node in range(G.num_vertices())], dtype=object)
+        _networks[key] = (stamp, G, node_ids)
+    return _networks[key][1], _networks[key][2]
+
+
+def _get_stamp(file: str) -> np.ndarray:
+    return np.array([os.stat(file).st_size, os.stat(file).st_mtime_ns], dtype=np.int64)
+
+
+def generate_rand_modules(G, N, ccs_num, MS, rng: np.random.Generator):
+    random_cc_modules_list = []
+    rand_module_nodes_list = []
+    for r in range(N):
+        random_cc_module, rand_module_nodes, iterr = rand_module(G, ccs_num, MS, rng=rng)
+        if iterr <= 20:
+            random_cc_modules_list.append(random_cc_module)
+            rand_module_nodes_list.append(rand_module_nodes)
+        else:
+            random_cc_module, rand_module_nodes, iterr = rand_module(G, ccs_num, MS, rng=rng)
+            random_cc_modules_list.append(random_cc_module)
+            rand_module_nodes_list.append(rand_module_nodes)
+    return rand_module_nodes_list
+
+
+def rand_module(G, ccs_num, MS, rng: np.random.Generator):
+    # step 1: randomly select ccs_num number of seeds (which are not neighbors)
+    G_nodes = list(range(G.num_vertices()))
+    random_cc_module = dict()
+    initial_seeds = []
+    neighb_initial_seeds = []
+    for c in range(ccs_num):
+        added = False
+        while not added:
+            s = int(rng.choice(G_nodes))
+
+            if s not in initial_seeds and s not in neighb_initial_seeds and len(G.get_all_neighbors(s)>0):
+                added = True
+                initial_seeds.append(s)
+                neighb_initial_seeds.extend(list(G.get_all_neighbors(s)))
+                random_cc_module[s] = []
+
+    rand_module_nodes = set()
+    rand_module_nodes.update(initial_seeds)
+    # step 2: expand the selected seeds by their neighbors enforcing the number of CCs remain the same
+    for cs in initial_seeds:
+        rn = rng.choice(G.get_all_neighbors(cs))
+        intersect = False
+        for k in random_cc_module.keys():
+            if k != cs and (len(set(G.get_all_neighbors(rn)).intersection(
+                    set(random_cc_module[k]))) > 0 or rn in G.get_all_neighbors(k)):
+                intersect = True
                 break
-        iterr = 0
-        while len(rand_module_nodes) < MS and iterr < 20:
-            iterr += 1
-            for k in initial_seeds:
-                vv = random_cc_module[k]
-                # for k, vv in random_cc_modules.items():
-                for v in vv:
-                    rn = random.choice(G.get_all_neighbors(v))
-                    if rn not in vv:
-                        intersect = False
-                        for i in random_cc_module.keys():
-                            if i != k and (len(set(G.get_all_neighbors(rn)).intersection(
-                                    set(random_cc_module[i]))) > 0 or rn in G.get_all_neighbors(i)):
-                                intersect = True
-                                break
-                        if not intersect:
-                            random_cc_module[k].append(rn)
-                            rand_module_nodes.add(rn)
-                    if len(rand_module_nodes) >= MS:
-                        break
+        if not intersect:
+            random_cc_module[cs].append(rn)
+            rand_module_nodes.add(rn)
+        if len(rand_module_nodes) >= MS:
+            break
+    iterr = 0
+    while len(rand_module_nodes) < MS and iterr < 20:
+        iterr += 1
+        for k in initial_seeds:
+            vv = random_cc_module[k]
+            # for k, vv in random_cc_modules.items():
+            for v in vv:
+                rn = rng.choice(G.get_all_neighbors(v))
+                if rn not in vv:
+                    intersect = False
+                    for i in random_cc_module.keys():
+                        if i != k and (len(set(G.get_all_neighbors(rn)).intersection(
+                                set(random_cc_module[i]))) > 0 or rn in G.get_all_neighbors(i)):
+                            intersect = True
+                            break
+                    if not intersect:
+                        random_cc_module[k].append(rn)
+                        rand_module_nodes.add(rn)
                 if len(rand_module_nodes) >= MS:
                     break
-        return random_cc_module, rand_module_nodes, iterr
\ No newline at end of file
+            if len(rand_module_nodes) >= MS:
+                break
+    return random_cc_module, rand_module_nodes, iterr
\ No newline at end of file
@@ -6,6 +6,9 @@ from .mappers import gene_getter as gg, disease_getter as dg
 from .mappers.mapper import Mapper
 from . import score_calculator as sc
 from abc import abstractmethod
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
 
 
 class Comparator:
@@ -28,6 +31,58 @@ class Comparator:
             self.mapping = gg.get_gene_to_attributes(gene_set=id_set, id_type=id_type, mapper=self.mapper)
             self.sparse_key, self.att_key, self.att_id = 'gene_mat_ids', 'gene_atts', 'entrezgene'
 
+    def update_distance_ids(self) -> pd.Series:
+        """
+        Add ids that are new in the attribute mapping to the distance ids shared by all distance measures.
+
+        :return: new ids
+        """
+        return self.mapper.update_distance_ids(in_series=pd.Series(self.mapper.get_columnar_mapping(self.att_key).ids),
+                                               key=self.sparse_key)
+
+    def update_distances(self, new_ids: pd.Series, attribute: str):
+        """
+        Calculate distances of new ids to all ids for the given attribute and add them to the loaded distances
+        of the used distance measure and of every other distance measure with non empty distances, which are
+        loaded for this as they would not match the distance ids otherwise. All distance measures share one pass
+        over the intersections. Only ids sharing at least one value with a new id are compared, they are found
+        by the value to ids lookup of the attribute mapping.
+
+        :param new_ids: new ids
+        :param attribute: attribute to calculate the distances for
+        """
+        if len(new_ids) == 0:
+            return
+        measures = [measure for measure in ['jaccard', 'overlap'] if measure == self.distance_measure or
+                    self.mapper.get_distance_matrix(key=c.DISTANCES[attribute], distance_measure=measure).nnz > 0]
+        att_mat, _ = self.mapper.get_attribute_matrix(key=self.att_key, attribute=attribute)
+        columnar = self.mapper.get_columnar_mapping(self.att_key)
+        candidates = columnar.get_neighbours(column=attribute, rows=self.mapper.get_distance_indices(
+            in_series=new_ids, id_type=self.sparse_key))
+        comp_mats = eu.get_distance_matrices(full_att_series=None, att_mat=att_mat,
+                                             from_ids=pd.Series(columnar.ids[candidates], dtype=object),
+                                             id_to_index=self.mapper.loaded_distance_ids[self.sparse_key],
+                                             to_ids=new_ids, coefficients=measures, unique_pairs=True)
+        for measure, comp_mat in comp_mats.items():
+            self.mapper.update_distances(in_mat=comp_mat, key=c.DISTANCES[attribute], id_type=self.sparse_key,
+                                         distance_measure=measure)
+
+    def update_distance_state(self):
+        """
+        Add ids that are new in the attribute mapping to the distance ids and calculate their distances for
+        every attribute of the mapping. All of it is published to other threads at once, so they never see
+        new ids without their distances.
+        """
+        if len(self.mapper.loaded_distance_ids[self.sparse_key]) >= len(self.mapper.get_columnar_mapping(self.att_key)):
+            return  # nothing new, no need to wait for other writers
+        with self.mapper.write():
+            new_ids = self.update_distance_ids()
+            for attribute in self.mapping.columns[1:]:
+                self.update_distances(new_ids=new_ids, attribute=attribute)
+
+    def get_attributes(self) -> list:
+        return list(c.DISEASE_ATTRIBUTES_KEY if self.att_key == 'disorder_atts' else c.GENE_ATTRIBUTES_KEY)
+
     @abstractmethod
     def compare(self, threshold: float = 0.0):
         pass
@@ -40,23 +95,15 @@ class SetComparator(Comparator):
 
     def compare(self, threshold: float = 0.0):
         result, mapped = dict(), dict()
-        new_ids = self.mapper.update_distance_ids(in_series=self.mapper.loaded_mappings[self.att_key][self.att_id],
-                                                  key=self.sparse_key, distance_measure=self.distance_measure)
+        self.update_distance_state()
         for attribute in self.mapping.columns[1:]:
             subset_df = self.mapping[self.mapping[attribute].str.len() > 0]
             missing_values = len(self.mapping) - len(subset_df)
             if missing_values > 0:
                 print("Missing values for " + attribute + " :" + str(missing_values) + "/" + str(
                     len(self.id_set))) if self.verbose else None
-            if len(new_ids) > 0:
-                comp_mat = eu.get_distance_matrix(full_att_series=self.mapper.loaded_mappings[self.att_key][attribute],
-                                                  from_ids=self.mapper.loaded_mappings[self.att_key][self.att_id],
-                                                  id_to_index=self.mapper.loaded_distance_ids[self.distance_measure][self.sparse_key],
-                                                  to_ids=new_ids)
-                self.mapper.update_distances(in_mat=comp_mat, key=c.DISTANCES[attribute], id_type=self.sparse_key,
-                                             distance_measure=self.distance_measure)
             if subset_df.empty:
-                result[c.replacements[attribute]] = 0
+                result[c.replacements[attribute]] = 0.0
                 mapped[c.replacements[attribute]] = {}
             else:
                 ids = self.mapper.get_loaded_mapping_ids(in_ids=set(subset_df[subset_df.columns[0]]),
@@ -82,6 +129,92 @@ class SetComparator(Comparator):
                         attribute].to_dict()
         return result, mapped
 
+    def compare_leave_one_out(self) -> dict:
+        """
+        Compare the set without each of its ids. The pairwise similarities of the full set are summed up
+        once and the row and column contribution of each id is subtracted from this sum.
+
+        :return: dict with each id of the set as key and the result of compare without it as value
+        """
+        tar_col = c.ID_TYPE_KEY[self.id_type]
+        id_list = list(self.id_set)
+        mapped_ids = pd.Index(id_list).isin(self.mapping[tar_col])
+        results = {tar_id: dict() for tar_id in id_list}
+        self.update_distance_state()
+        for attribute in self.mapping.columns[1:]:
+            subset_df = self.mapping[self.mapping[attribute].str.len() > 0]
+            if subset_df.empty:
+                for tar_id in id_list:
+                    results[tar_id][c.replacements[attribute]] = 0.0
+                continue
+            ids = self.mapper.get_loaded_mapping_ids(in_ids=set(subset_df[subset_df.columns[0]]), id_type=self.id_type)
+            if self.att_id != tar_col:
+                ids = ids[[self.att_id, tar_col]].drop_duplicates()
+            sub_mat = self.mapper.get_loaded_distances(in_series=ids[self.att_id], id_type=self.sparse_key,
+                                                       key=c.DISTANCES[attribute],
+                                                       distance_measure=self.distance_measure).tocsr()
+            axis = (len(self.mapping) - len(ids[tar_col].unique())) + len(ids)
+            # ===== rows and columns of sub_mat belonging to each id =====
+            positions = pd.Index(id_list).get_indexer(ids[tar_col])
+            id_rows = sp.csr_matrix((np.ones(np.count_nonzero(positions >= 0)),
+                                     (positions[positions >= 0], np.flatnonzero(positions >= 0))),
+                                    shape=(len(id_list), len(ids)))
+            sums = sub_mat.sum() - self._contributions(sub_mat=sub_mat, id_rows=id_rows)
+            # ===== count of distances to decide if anything is left without the id =====
+            counts = sub_mat.count_nonzero() - self._contributions(sub_mat=(sub_mat != 0).astype(float),
+                                                                   id_rows=id_rows)
+            num_rows = np.diff(id_rows.indptr)
+            axes = np.where(num_rows > 0, axis - num_rows, np.where(mapped_ids, axis - 1, axis))
+            for tar_id, loo_sum, count, loo_axis in zip(id_list, sums, counts, axes):
+                if count == 0 or loo_axis <= 1:
+                    results[tar_id][c.replacements[attribute]] = 0.0
+                else:
+                    results[tar_id][c.replacements[attribute]] = loo_sum / ((loo_axis * (loo_axis - 1)) / 2)
+        return results
+
+    @staticmethod
+    def _contributions(sub_mat: sp.csr_matrix, id_rows: sp.csr_matrix) -> np.ndarray:
+        row_sums = np.asarray(sub_mat.sum(axis=1)).ravel()
+        col_sums = np.asarray(sub_mat.sum(axis=0)).ravel()
+        own_sums = np.asarray((id_rows @ sub_mat).multiply(id_rows).sum(axis=1)).ravel()
+        return id_rows @ row_sums + id_rows @ col_sums - own_sums
+
+    def get_indices(self, att_ids) -> np.ndarray:
+        """
+        Get the indices of the given ids inside the distance matrices.
+
+        :param att_ids: ids of the attribute mapping, e.g. entrez or mondo ids
+        :return: array with index of each id or -1 if the id has no distances
+        """
+        return self.mapper.get_distance_indices(in_series=att_ids, id_type=self.sparse_key)
+
+    def compare_batch(self, modules: np.ndarray) -> pd.DataFrame:
+        """
+        Compare many sets at once, each given as indices of the distance matrices. The pairwise
+        similarities of all sets are summed up from one sparse product of a set membership matrix
+        with the distance matrix per attribute.
+
+        :param modules: matrix with one set of distance matrix indices per row, padded with -1. Indices below -1
+        stand for set members without attributes, which only count for the size of a set
+        :return: dataframe with one row per non empty set and the values per attribute as columns
+        """
+        valid = modules >= 0
+        runs = np.repeat(np.arange(len(modules)), valid.sum(axis=1))
+        axis = count_members(modules=modules)
+        result = dict()
+        for attribute in self.get_attributes():
+            distances = self.mapper.get_distance_matrix(key=c.DISTANCES[attribute],
+                                                        distance_measure=self.distance_measure)
+            membership = sp.csr_matrix((np.ones(len(runs)), (runs, modules[valid])),
+                                       shape=(len(modules), distances.shape[0]))
+            membership.sum_duplicates()
+            membership.data[:] = 1
+            sums = np.asarray(distances.product(left=membership).multiply(membership).sum(axis=1)).ravel()
+            values = np.zeros(len(modules))
+            np.divide(sums, (axis * (axis - 1)) / 2, out=values, where=(sums != 0) & (axis > 1))
+            result[c.replacements[attribute]] = values
+        return pd.DataFrame(result)[axis > 0].reset_index(drop=True)
+
 
 class SetSetComparator(Comparator):
     """
@@ -93,8 +226,11 @@ class SetSetComparator(Comparator):
         super().__init__(mapper=mapper, verbose=verbose, distance_measure=distance_measure)
         self.enriched = enriched
         self.ref_dict = dict()
+        self.table_coefficients = dict()
+        self.table_groups = (None, None, None)
 
     def load_reference(self, ref, ref_id_type, tar_id_type):
+        self.table_coefficients = dict()
         if ref_id_type in c.SUPPORTED_DISEASE_IDS:
             id_mapping = dg.get_disease_to_attributes(disease_set=ref, id_type=ref_id_type, mapper=self.mapper)
             if not id_mapping.empty:  # Only if id mapping is not empty
@@ -122,14 +258,9 @@ class SetSetComparator(Comparator):
     def compare(self, threshold: float = 0.0):
         evaluation, mapped = dict(), dict()
         for attribute in self.ref_dict.keys():
-            if self.distance_measure == "jaccard":
-                evaluated_series = self.mapping[attribute].apply(eu.jaccard_coefficient,
-                                                                 ref_att_set=self.ref_dict[attribute])
-            else:  # == "overlap_coefficient"
-                evaluated_series = self.mapping[attribute].apply(eu.overlap_coefficient,
-                                                                 ref_att_set=self.ref_dict[attribute])
-            evaluation[c.replacements[attribute]] = str(len(evaluated_series[evaluated_series > threshold]) /
-                                                        len(evaluated_series))
+            coefficients = self.get_coefficients(att_series=self.mapping[attribute], attribute=attribute)
+            evaluation[c.replacements[attribute]] = str(np.count_nonzero(coefficients > threshold) /
+                                                        len(coefficients))
             if self.input_run:
                 save_mapping = self.mapping[self.mapping[attribute].str.len() > 0].copy()
                 save_mapping[attribute] = save_mapping[attribute].apply(lambda x: list(x))
@@ -137,6 +268,147 @@ class SetSetComparator(Comparator):
                     attribute].to_dict()
         return evaluation, mapped
 
+    def get_coefficients(self, att_series: pd.Series, attribute: str) -> np.ndarray:
+        """
+        Calculate the coefficient of every set in att_series to the reference set of the attribute.
+        The sets are encoded with the term codes of the loaded attribute mapping as sparse incidence
+        matrix, so the intersections with the reference result from one product with the indicator
+        vector of the reference codes.
+
+        :param att_series: series with sets of attribute values
+        :param attribute: attribute of the reference set
+        :return: array with coefficient per set
+        """
+        att_mat, terms = self.mapper.encode_attribute(key=self.att_key, attribute=attribute, att_series=att_series)
+        return self._calc_coefficients(att_mat=att_mat, terms=terms, attribute=attribute)
+
+    def _calc_coefficients(self, att_mat: sp.csr_matrix, terms: pd.Index, attribute: str) -> np.ndarray:
+        codes = terms.get_indexer(list(self.ref_dict[attribute]))
+        ref_vector = np.zeros(att_mat.shape[1], dtype=np.int32)
+        ref_vector[codes[codes >= 0]] = 1
+        return eu.calc_coefficients(intersections=att_mat @ ref_vector, sizes1=np.diff(att_mat.indptr),
+                                    sizes2=len(self.ref_dict[attribute]), coefficient=self.distance_measure)
+
+    def compare_leave_one_out(self, threshold: float = 0.0) -> dict:
+        """
+        Compare the set without each of its ids. The number of mapping rows matching the reference is counted
+        once and the rows of each id with their matches are subtracted from it.
+
+        :param threshold: coefficient an id needs to exceed to count as matching [Default=0.0]
+        :return: dict with each id of the set as key and the result of compare without it as value
+        """
+        tar_col = c.ID_TYPE_KEY[self.id_type]
+        id_list = list(self.id_set)
+        # ===== mapping rows of each id =====
+        positions = pd.Index(id_list).get_indexer(self.mapping[tar_col])
+        id_rows = np.bincount(positions[positions >= 0], minlength=len(id_list))
+        results = {tar_id: dict() for tar_id in id_list}
+        for attribute in self.ref_dict.keys():
+            matches = self.get_coefficients(att_series=self.mapping[attribute], attribute=attribute) > threshold
+            num_matches, size = np.count_nonzero(matches), len(matches)
+            id_matches = np.bincount(positions[positions >= 0], weights=matches[positions >= 0],
+                                     minlength=len(id_list)).astype(int)
+            for tar_id, rows, own_matches in zip(id_list, id_rows.tolist(), id_matches.tolist()):
+                if size - rows > 0:
+                    results[tar_id][c.replacements[attribute]] = str((num_matches - own_matches) / (size - rows))
+                else:  # ===== nothing left without the id =====
+                    results[tar_id][c.replacements[attribute]] = str(0.0)
+        return results
+
+    def get_table_groups(self):
+        """
+        Get the distinct ids of the loaded attribute mapping and the position of the id of each row among
+        them. An id can have several rows in the attribute mapping, which are united like in the mapping
+        of a compared set.
+
+        :return: index with the distinct ids and array with the position of the id of each row
+        """
+        columnar = self.mapper.get_columnar_mapping(self.att_key)
+        if self.table_groups[0] is not columnar:
+            groups, ids = pd.factorize(pd.Series(columnar.ids, dtype=object))
+            self.table_groups = (columnar, pd.Index(ids, dtype=object), groups)
+        return self.table_groups[1], self.table_groups[2]
+
+    def get_table_coefficients(self, attribute: str) -> np.ndarray:
+        """
+        Get the coefficients of all ids in the loaded attribute mapping to the reference set of the
+        attribute, with the values of all rows of an id united. Only ids carrying a reference value can
+        have a coefficient above 0, they are taken from the inverted index of the attribute. The
+        coefficients are calculated once per reference and loaded mapping, a changed mapping comes with
+        a new index.
+
+        :param attribute: attribute of the reference set
+        :return: array with coefficient per id of get_table_groups
+        """
+        index = self.mapper.get_inverted_index(key=self.att_key, attribute=attribute)
+        if self.table_coefficients.get(attribute, (None, None))[0] is not index:
+            ids, groups = self.get_table_groups()
+            terms, entities = index.get_term_entities(terms=self.ref_dict[attribute])
+            # ===== every reference value counts once per id, even if several rows of the id have it =====
+            num_terms = max(len(self.ref_dict[attribute]), 1)
+            pairs = np.unique(groups[entities].astype(np.int64) * num_terms + terms)
+            intersections = np.bincount(pairs // num_terms, minlength=len(ids))
+            hits = np.flatnonzero(intersections)
+            # ===== size of the united values of every id with a hit =====
+            att_mat, _ = self.mapper.get_attribute_matrix(key=self.att_key, attribute=attribute)
+            id_rows = sp.csr_matrix((np.ones(len(groups), dtype=np.int32), (groups, np.arange(len(groups)))),
+                                    shape=(len(ids), len(groups)))
+            coefficients = np.zeros(len(ids), dtype=float)
+            coefficients[hits] = eu.calc_coefficients(intersections=intersections[hits],
+                                                      sizes1=np.diff((id_rows[hits] @ att_mat).tocsr().indptr),
+                                                      sizes2=len(self.ref_dict[attribute]),
+                                                      coefficient=self.distance_measure)
+            self.table_coefficients[attribute] = (index, coefficients)
+        return self.table_coefficients[attribute][1]
+
+    def get_indices(self, att_ids) -> np.ndarray:
+        """
+        Get the indices of the given ids among the distinct ids of the loaded attribute mapping.
+
+        :param att_ids: ids of the attribute mapping, e.g. entrez or mondo ids
+        :return: array with index of each id or -1 if the id has no attributes
+        """
+        ids, _ = self.get_table_groups()
+        return ids.get_indexer(pd.Index(att_ids, dtype=object))
+
+    def compare_batch(self, modules: np.ndarray, threshold: float = 0.0) -> pd.DataFrame:
+        """
+        Compare many sets at once, each given as indices from get_indices. The number of set members
+        matching the reference results from one sparse product of a set membership matrix with the
+        indicator vector of matching ids per attribute.
+
+        :param modules: matrix with one set of indices from get_indices per row, padded with -1. Indices below -1
+        stand for set members without attributes, which only count for the size of a set
+        :param threshold: coefficient a set member needs to exceed to count as matching [Default=0.0]
+        :return: dataframe with one row per non empty set and the values per attribute as columns
+        """
+        valid = modules >= 0
+        runs = np.repeat(np.arange(len(modules)), valid.sum(axis=1))
+        membership = sp.csr_matrix((np.ones(len(runs)), (runs, modules[valid])),
+                                   shape=(len(modules), len(self.get_table_groups()[0])))
+        membership.sum_duplicates()
+        membership.data[:] = 1
+        axis = count_members(modules=modules)
+        result = dict()
+        for attribute in self.ref_dict.keys():
+            matches = membership @ (self.get_table_coefficients(attribute=attribute) > threshold).astype(float)
+            result[c.replacements[attribute]] = [str(float(match) / float(size)) for match, size in
+                                                 zip(matches[axis > 0], axis[axis > 0])]
+        return pd.DataFrame(result)
+
+
+def count_members(modules: np.ndarray) -> np.ndarray:
+    """
+    Count the distinct members of every set given as row of indices padded with -1.
+
+    :param modules: matrix with one set of indices per row, padded with -1
+    :return: array with number of members per set
+    """
+    ordered = np.sort(modules, axis=1)
+    first = np.ones(ordered.shape, dtype=bool)
+    first[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    return np.count_nonzero((ordered != -1) & first, axis=1)
+
 
 class ClusterComparator(Comparator):
     """
@@ -156,8 +428,7 @@ class ClusterComparator(Comparator):
 
     def compare(self, threshold: float = 0.0):
         result_di, result_ss, result_ss_intermediate, result_dbi, mapped = dict(), dict(), dict(), dict(), dict()
-        new_ids = self.mapper.update_distance_ids(in_series=self.mapper.loaded_mappings[self.att_key][self.att_id],
-                                                  key=self.sparse_key, distance_measure=self.distance_measure)
+        self.update_distance_state()
         for attribute in self.mapping.columns[1:]:
             subset_df = self.mapping[self.mapping[attribute].str.len() > 0]
             subset_clusters = self.clustering[self.clustering['id'].isin(subset_df[c.ID_TYPE_KEY[self.id_type]])][
@@ -167,15 +438,6 @@ class ClusterComparator(Comparator):
                 print("Missing values for " + attribute + " :" + str(missing_values) + "/" + str(
                     len(self.mapping)) + "") if self.verbose else None
 
-            if len(new_ids) > 0:
-                comp_mat = eu.get_distance_matrix(full_att_series=self.mapper.loaded_mappings[self.att_key][attribute],
-                                                  from_ids=self.mapper.loaded_mappings[self.att_key][self.att_id],
-                                                  id_to_index=self.mapper.loaded_distance_ids[self.distance_measure][
-                                                      self.sparse_key],
-                                                  to_ids=new_ids)
-                self.mapper.update_distances(in_mat=comp_mat, key=c.DISTANCES[attribute], id_type=self.sparse_key,
-                                             distance_measure=self.distance_measure)
-
             if subset_df.empty:
                 result_di[c.replacements[attribute]], result_ss[c.replacements[attribute]] = None, None
                 result_ss_intermediate[c.replacements[attribute]] = None
@@ -184,22 +446,28 @@ class ClusterComparator(Comparator):
             else:
                 ids = self.mapper.get_loaded_mapping_ids(in_ids=set(subset_df[subset_df.columns[0]]),
                                                          id_type=self.id_type)
-                distances = self.mapper.get_loaded_distances(in_series=ids[self.att_id].drop_duplicates(),
-                                                             id_type=self.sparse_key,
+                att_ids = ids[self.att_id].drop_duplicates()
+                distances = self.mapper.get_loaded_distances(in_series=att_ids, id_type=self.sparse_key,
                                                              key=c.DISTANCES[attribute],
                                                              distance_measure=self.distance_measure)
-                distances = dict(distances.todok().items())
-                inv_index_to_id = {index: value for index, value in ids[self.att_id].reset_index(drop=True).items()}
-                precalc_dist = sc.precalc_distance_dicts(ids_cluster=subset_clusters, ids_mapping=ids,
-                                                         distances=distances,
-                                                         index_to_id=inv_index_to_id,
-                                                         ids={'id_type': c.ID_TYPE_KEY[self.id_type],
-                                                              'sparse_key': self.sparse_key, 'att_id': self.att_id,
-                                                              'attribute': c.DISTANCES[attribute]})
-                ss_score = sc.silhouette_score(ids_cluster=subset_clusters, distances=precalc_dist, linkage="average")
-                di_score = sc.dunn_index(ids_cluster=subset_clusters, distances=precalc_dist, linkage="average")
-                dbi_score = sc.davies_bouldin_index(ids_cluster=subset_clusters, distances=precalc_dist,
-                                                    linkage="average")
+                # ===== assign rows of distances to clustered ids =====
+                entities = subset_clusters.drop_duplicates(subset='id', keep='last')
+                if self.att_id != c.ID_TYPE_KEY[self.id_type]:
+                    id_pairs = ids[[self.att_id, c.ID_TYPE_KEY[self.id_type]]].drop_duplicates()
+                    rows = pd.Index(att_ids).get_indexer(id_pairs[self.att_id])
+                    cols = pd.Index(entities['id']).get_indexer(id_pairs[c.ID_TYPE_KEY[self.id_type]])
+                else:
+                    rows = np.arange(len(att_ids))
+                    cols = pd.Index(entities['id']).get_indexer(att_ids)
+                rows, cols = rows[cols >= 0], cols[cols >= 0]
+                row_entities = sp.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)),
+                                             shape=(len(att_ids), len(entities)))
+                precalc_dist = sc.precalc_distance_arrays(distances=distances,
+                                                          labels=entities['cluster_index'].to_numpy(),
+                                                          row_entities=row_entities)
+                ss_score = sc.silhouette_score(distances=precalc_dist, linkage="average")
+                di_score = sc.dunn_index(distances=precalc_dist, linkage="average")
+                dbi_score = sc.davies_bouldin_index(distances=precalc_dist, linkage="average")
                 result_di[c.replacements[attribute]] = di_score
                 result_ss[c.replacements[attribute]] = ss_score[0]
                 result_ss_intermediate[c.replacements[attribute]] = ss_score[1]
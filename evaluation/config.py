@@ -11,6 +11,24 @@ MAIN_GENE_ID = 'entrezgene'
 SUPPORTED_GENE_IDS = ['entrez', 'ensembl', 'symbol', 'uniprot']
 SUPPORTED_DISEASE_IDS = ['mondo', 'omim', 'snomedct', 'umls', 'orpha', 'mesh', 'doid', 'ICD-10']
 NUMBER_OF_RANDOM_RUNS = 1000
+# module sizes and numbers of connected components with pre-generated random modules of the default networks
+NETWORK_MODULE_SIZES = range(1, 51)
+NETWORK_MODULE_CCS = range(1, 6)
+# pre-generated random modules per combination as multiple of the number of random runs
+NETWORK_MODULE_POOL_FACTOR = 5
+# bytes of distance matrices kept loaded before the least recently used are dropped, None for no limit
+DISTANCE_BUDGET = None
+# rows of the DisGeNET association files read at once during setup
+DISGENET_CHUNK_SIZE = 500000
+# seconds until cached myGene.info and myDisease.info lookups with and without hits are queried again
+LOOKUP_TTL = 30 * 24 * 60 * 60
+LOOKUP_NEGATIVE_TTL = 7 * 24 * 60 * 60
+# urls of the myGene.info and myDisease.info apis, e.g. of a local server, None for the public api
+BIOTHINGS_URLS = {'gene': None, 'disease': None}
+# ids per request, requests running at the same time and retries of a failed request for lookups
+FETCH_CHUNK_SIZE = 1000
+FETCH_WORKERS = 4
+FETCH_RETRIES = 3
 
 # =============================================================================
 # Set directories
@@ -65,6 +83,11 @@ replacements = {"disgenet.genes_related_to_disease": "related_genes",
 # Set API paths to digest data
 # ============================================================================
 DIGEST = "https://api.digest-validation.net/files?"
+# url of a json manifest with size and sha256 per downloaded file, None to download without verification
+DIGEST_MANIFEST = None
+# files downloaded at the same time and bytes written at once during setup
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
 # =============================================================================
 # Set API paths to nedrex data
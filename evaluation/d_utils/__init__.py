@@ -1,3 +1,4 @@
+from . import download_utils
 from . import eval_utils
 from . import plotting_utils
 from . import runner_utils
\ No newline at end of file
@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from .. import config as c
+
+STATE_FILE = ".downloads.json"
+
+
+def load_manifest(url: str = c.DIGEST_MANIFEST):
+    """
+    Load manifest with the expected size and sha256 of the files to download.
+
+    :param url: url of the json manifest, nothing is loaded if None [Default=c.DIGEST_MANIFEST]
+    :return: dict with file path relative to the download directory as key and dict with
+    size and sha256 as value, None if there is no manifest
+    """
+    if url is None:
+        return None
+    r = requests.get(url)
+    r.raise_for_status()
+    return json.loads(r.content)
+
+
+def download_files(downloads: dict, path: str, manifest: dict = None, workers: int = c.DOWNLOAD_WORKERS,
+                   chunk_size: int = c.DOWNLOAD_CHUNK_SIZE, current_dir: str = None):
+    """
+    Download files concurrently into a directory. Files already present and matching the
+    manifest are skipped, interrupted downloads are resumed. Files without manifest entry are
+    expected to have the size reported by the server and are always downloaded if the server
+    reports no size. A file also counts as present if it was converted after its download and
+    the outputs recorded by record_outputs still exist. Files current in current_dir, the
+    directory of the previous download, are hard linked into path instead of being downloaded.
+
+    :param downloads: dict with file path relative to path as key and url as value
+    :param path: directory to download into
+    :param manifest: dict with relative file path as key and dict with size and sha256 as value [Default=None]
+    :param workers: number of files downloaded at the same time [Default=c.DOWNLOAD_WORKERS]
+    :param chunk_size: bytes written at once [Default=c.DOWNLOAD_CHUNK_SIZE]
+    :param current_dir: directory of the previous download to take current files from [Default=None]
+    :return: list of relative file paths that were downloaded
+    """
+    manifest = dict() if manifest is None else manifest
+    state = load_state(path=path)
+    current_state = dict() if current_dir is None else load_state(path=current_dir)
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        session.mount('http://', HTTPAdapter(pool_maxsize=max(workers, 1)))
+        session.mount('https://', HTTPAdapter(pool_maxsize=max(workers, 1)))
+        pending = dict()
+        for file, url in downloads.items():
+            expected = manifest.get(file)
+            if expected is None:
+                size = get_remote_size(url=url, session=session)
+                expected = {'size': size} if size is not None else None
+            found = _find_current(file=file, expected=expected, path=path, state=state)
+            if found is not None:
+                state[file] = {'expected': expected, 'outputs': [] if found == [file] else found}
+                continue
+            if current_dir is not None:
+                found = _find_current(file=file, expected=expected, path=current_dir, state=current_state)
+                if found is not None:
+                    for name in found:
+                        link_path(source=os.path.join(current_dir, name), target=os.path.join(path, name))
+                    state[file] = {'expected': expected, 'outputs': [] if found == [file] else found}
+                    continue
+            pending[file] = url
+            state[file] = {'expected': expected, 'outputs': []}
+        futures = [pool.submit(download_file, url=url, file=os.path.join(path, file), expected=manifest.get(file),
+                               session=session, chunk_size=chunk_size) for file, url in pending.items()]
+        for future in futures:
+            future.result()
+    save_state(path=path, state=state)
+    return list(pending)
+
+
+def _find_current(file: str, expected: dict, path: str, state: dict):
+    """
+    Find the files holding the current content of a download in a directory.
+
+    :param file: path of the download relative to path
+    :param expected: dict with expected size and sha256, nothing is current if None
+    :param path: directory of the download
+    :param state: download state of the directory as loaded by load_state
+    :return: list with file itself or with the recorded outputs of its conversion, None if not current
+    """
+    if expected is None:
+        return None
+    if is_current(file=os.path.join(path, file), expected=expected):
+        return [file]
+    entry = state.get(file)
+    if entry is not None and entry['expected'] == expected and len(entry['outputs']) > 0 and \
+            all(os.path.exists(os.path.join(path, output)) for output in entry['outputs']):
+        return entry['outputs']
+    return None
+
+
+def load_state(path: str) -> dict:
+    """
+    Load the download state of a directory, recording the expected size and sha256 every file was
+    downloaded with and the files it was converted into.
+
+    :param path: directory of the downloads
+    :return: dict with relative file path as key and dict with expected and outputs as value
+    """
+    if not os.path.isfile(os.path.join(path, STATE_FILE)):
+        return dict()
+    with open(os.path.join(path, STATE_FILE)) as f:
+        return json.load(f)
+
+
+def save_state(path: str, state: dict):
+    """
+    Save the download state of a directory loaded by load_state.
+
+    :param path: directory of the downloads
+    :param state: dict with relative file path as key and dict with expected and outputs as value
+    """
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, STATE_FILE + ".tmp"), 'w') as f:
+        json.dump(state, f)
+    os.replace(os.path.join(path, STATE_FILE + ".tmp"), os.path.join(path, STATE_FILE))
+
+
+def record_outputs(path: str, outputs: dict):
+    """
+    Record the files downloaded files were converted into, so a download stays current after the
+    conversion removed it. Files without download state or with missing outputs are not recorded.
+
+    :param path: directory of the downloads
+    :param outputs: dict with relative path of the downloaded file as key and list of relative paths of its outputs
+    """
+    state = load_state(path=path)
+    for file, files in outputs.items():
+        if file in state and all(os.path.exists(os.path.join(path, output)) for output in files):
+            state[file]['outputs'] = list(files)
+    save_state(path=path, state=state)
+
+
+def link_path(source: str, target: str):
+    """
+    Hard link a file or all files of a directory to target, replacing existing files. Files that
+    cannot be linked, e.g. on another file system, are copied.
+
+    :param source: file or directory to link
+    :param target: path of the link
+    """
+    if os.path.isdir(source):
+        shutil.copytree(source, target, copy_function=link_path, dirs_exist_ok=True)
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def get_remote_size(url: str, session: requests.Session = None):
+    """
+    Get the size of a file as reported by the server in the Content-Length of a HEAD request.
+
+    :param url: url of the file
+    :param session: session to reuse connections from [Default=None]
+    :return: size in bytes, None if the server reports no size or the request failed
+    """
+    session = requests if session is None else session
+    try:
+        r = session.head(url, allow_redirects=True, headers={'Accept-Encoding': 'identity'})
+        r.raise_for_status()
+        return int(r.headers['Content-Length'])
+    except (requests.RequestException, KeyError, ValueError):
+        return None
+
+
+def download_file(url: str, file: str, expected: dict = None, session: requests.Session = None,
+                  chunk_size: int = c.DOWNLOAD_CHUNK_SIZE):
+    """
+    Stream a file to file + '.part' and rename it to file once it is complete and verified.
+    An existing .part file from an interrupted download is continued with a range request.
+
+    :param url: url of the file
+    :param file: path to save the file to
+    :param expected: dict with expected size and sha256 of the file [Default=None]
+    :param session: session to reuse connections from [Default=None]
+    :param chunk_size: bytes written at once [Default=c.DOWNLOAD_CHUNK_SIZE]
+    """
+    session = requests if session is None else session
+    part_file = file + ".part"
+    os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+    offset = os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+    headers = {'Range': 'bytes=' + str(offset) + '-'} if offset > 0 else dict()
+    with session.get(url, headers=headers, stream=True) as r:
+        if r.status_code == 416:  # range not satisfiable, start over
+            os.remove(part_file)
+            return download_file(url=url, file=file, expected=expected, session=session, chunk_size=chunk_size)
+        r.raise_for_status()
+        # ===== append to the partial file only if the server sent the requested range =====
+        with open(part_file, 'ab' if r.status_code == 206 else 'wb') as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+    if not is_current(file=part_file, expected=expected):
+        os.remove(part_file)
+        raise IOError("Downloaded file " + file + " does not match the manifest.")
+    os.replace(part_file, file)
+
+
+def is_current(file: str, expected: dict = None) -> bool:
+    """
+    Check if a file exists and matches its expected size and sha256.
+
+    :param file: path to the file
+    :param expected: dict with expected size and sha256, only existence is checked if None [Default=None]
+    :return: True if the file is current
+    """
+    if not os.path.isfile(file):
+        return False
+    if expected is None:
+        return True
+    if 'size' in expected and os.path.getsize(file) != expected['size']:
+        return False
+    if 'sha256' in expected:
+        sha256 = hashlib.sha256()
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(c.DOWNLOAD_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest() == expected['sha256']
+    return True
+
+
+def swap_directory(source: str, target: str):
+    """
+    Replace target by source at once. target becomes a symbolic link to a versioned directory next
+    to it and the link is flipped with a single rename, so readers see either all old or all new
+    files. Entries of target missing in source, like the lookup cache or generated modules, are
+    hard linked into source first. The previous version is removed after the flip, processes that
+    still have its files open or memory mapped keep reading them. Only the first swap of a target
+    that is still a plain directory moves it aside before the link takes its place.
+
+    :param source: directory with the new files, may be inside of target
+    :param target: directory to replace
+    """
+    source, target = os.path.abspath(source), os.path.abspath(target)
+    previous = os.path.realpath(target)
+    for name in os.listdir(previous):
+        entry = os.path.join(previous, name)
+        if entry != os.path.realpath(source) and not os.path.lexists(os.path.join(source, name)):
+            link_path(source=entry, target=os.path.join(source, name))
+    version = target + ".v" + str(time.time_ns())
+    os.replace(source, version)
+    os.symlink(os.path.basename(version), version + ".link")
+    if not os.path.islink(target):
+        previous = version + ".old"
+        os.rename(target, previous)
+    os.replace(version + ".link", target)
+    shutil.rmtree(previous)
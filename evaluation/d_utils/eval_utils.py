@@ -1,65 +1,273 @@
 #!/usr/bin/python3
 
+import os
+import tempfile
+import multiprocessing as mp
 import numpy as np
 import pandas as pd
 from .. import config
 import scipy.sparse as sp
 
 
-def get_distance_matrix(full_att_series: pd.Series, from_ids: pd.Series, id_to_index: dict, to_ids: pd.Series = None,
-                        coefficient='jaccard') -> sp.coo_matrix:
+def get_distance_matrix(full_att_series: pd.Series, from_ids: pd.Series, id_to_index: pd.Index,
+                        to_ids: pd.Series = None, coefficient='jaccard', block_size: int = 1000, workers: int = 1,
+                        tmp_dir: str = None, att_mat: sp.csr_matrix = None,
+                        unique_pairs: bool = False) -> sp.coo_matrix:
     """
     Calculating the distance of each element in from_ids to elements in to_ids, if provided, or each
-    element in from_ids based on coefficient.
+    element in from_ids based on coefficient. See get_distance_matrices for more info.
 
     :param full_att_series: dataframe with 2 columns (id, attribute values)
     :param from_ids: dataframe with 2 columns (id, attribute values)
-    :param id_to_index: dict with mapping of id to index inside sparse matrix
+    :param id_to_index: index with the row of each id inside sparse matrix
     :param to_ids: dataframe with 2 columns (id, attribute values)
     :param coefficient: coefficient type for the distance. Possible: jaccard or overlap [Default="jaccard"]
+    :param block_size: number of from_ids compared at once, bounds the memory usage [Default=1000]
+    :param workers: number of processes calculating blocks in parallel [Default=1]
+    :param tmp_dir: directory in which the blocks of the workers are saved temporarily [Default=None]
+    :param att_mat: incidence matrix of the attribute values, if already encoded [Default=None]
+    :param unique_pairs: drop self pairs and repeated pairs if to_ids is provided [Default=False]
     :return: distance sparse matrix
     """
+    return get_distance_matrices(full_att_series=full_att_series, from_ids=from_ids, id_to_index=id_to_index,
+                                 to_ids=to_ids, coefficients=[coefficient], block_size=block_size, workers=workers,
+                                 tmp_dir=tmp_dir, att_mat=att_mat, unique_pairs=unique_pairs)[coefficient]
 
-    def get_distance(index1: int, index2: int):
-        if coefficient == "jaccard":
-            return jaccard_coefficient(tar_att_set=full_att_series[index1], ref_att_set=full_att_series[index2])
-        else:  # coefficient == "overlap"
-            return overlap_coefficient(tar_att_set=full_att_series[index1], ref_att_set=full_att_series[index2])
 
-    row, col, data = list(), list(), list()
-    # ===== from_ids against from_ids =====
+def get_distance_matrices(full_att_series: pd.Series, from_ids: pd.Series, id_to_index: pd.Index,
+                          to_ids: pd.Series = None, coefficients=("jaccard", "overlap"), block_size: int = 1000,
+                          workers: int = 1, tmp_dir: str = None, att_mat: sp.csr_matrix = None,
+                          unique_pairs: bool = False) -> dict:
+    """
+    Calculating the distance of each element in from_ids to elements in to_ids, if provided, or each
+    element in from_ids for all given coefficients at once. The attribute sets are encoded as sparse
+    incidence matrix, so that the intersections of a block of rows with all other rows result from one
+    sparse matrix product and are shared by all coefficients, as they only differ in their denominator.
+    With more than one worker the blocks are spread over a process pool and each block is streamed to
+    disk before all blocks are merged into the final matrices.
+
+    :param full_att_series: dataframe with 2 columns (id, attribute values)
+    :param from_ids: dataframe with 2 columns (id, attribute values)
+    :param id_to_index: index with the row of each id inside sparse matrix
+    :param to_ids: dataframe with 2 columns (id, attribute values)
+    :param coefficients: coefficient types for the distances. Possible: jaccard and overlap
+    [Default=("jaccard", "overlap")]
+    :param block_size: number of from_ids compared at once, bounds the memory usage [Default=1000]
+    :param workers: number of processes calculating blocks in parallel [Default=1]
+    :param tmp_dir: directory in which the blocks of the workers are saved temporarily [Default=None]
+    :param att_mat: incidence matrix of the attribute values with one row per position of the id in id_to_index,
+    e.g. from a columnar mapping, full_att_series is not needed then [Default=None]
+    :param unique_pairs: only used if to_ids is provided. If False every pair of from_ids and to_ids with a distance
+    > 0.0 is kept, including the distance of an id to itself, and a pair of ids contained in both from_ids and to_ids
+    is kept in both directions, so their entries add up in the sparse matrix. If True self pairs are dropped and each
+    pair is kept once, e.g. to add the distances of new ids to a matrix without them [Default=False]
+    :return: dict with coefficient as key and distance sparse matrix as value
+    """
+    state = _prepare_distance_state(full_att_series=full_att_series, from_ids=from_ids, id_to_index=id_to_index,
+                                    to_ids=to_ids, att_mat=att_mat, unique_pairs=unique_pairs)
+    names = ['row', 'col'] + list(coefficients)
+    starts = range(0, len(state['from_pos']), block_size)
+    if workers > 1 and len(starts) > 1:
+        with tempfile.TemporaryDirectory(dir=tmp_dir) as block_dir:
+            with mp.Pool(processes=workers, initializer=_init_distance_worker, initargs=(state,)) as pool:
+                block_files = pool.map(_save_distance_block, [(start, start + block_size, coefficients, block_dir)
+                                                              for start in starts])
+            merged = _merge_distance_blocks(block_files=block_files, names=names)
+    else:
+        blocks = [_calc_distance_block(state=state, start=start, end=start + block_size, coefficients=coefficients)
+                  for start in starts]
+        merged = {name: np.concatenate([np.array([], dtype=float if name in coefficients else np.int64)] +
+                                       [block[name] for block in blocks]) for name in names}
+    return {coefficient: sp.coo_matrix((merged[coefficient], (merged['row'], merged['col'])),
+                                       shape=(state['att_mat'].shape[0], state['att_mat'].shape[0]))
+            for coefficient in coefficients}
+
+
+def _prepare_distance_state(full_att_series: pd.Series, from_ids: pd.Series, id_to_index: pd.Index,
+                            to_ids: pd.Series = None, att_mat: sp.csr_matrix = None,
+                            unique_pairs: bool = False) -> dict:
+    if att_mat is None:
+        att_mat, rows = get_incidence_matrix(att_series=full_att_series), full_att_series.index
+    else:
+        rows = pd.RangeIndex(att_mat.shape[0])
+    from_index = _get_index(id_to_index=id_to_index, ids=from_ids)
+    from_pos = rows.get_indexer(from_index)
     if to_ids is None:
-        from_ids = from_ids.to_numpy()
-        for id1_index in range(0, len(from_ids) - 1):
-            for id2_index in range(id1_index + 1, len(from_ids)):
-                calc_dis = get_distance(index1=id_to_index[from_ids[id1_index]],
-                                        index2=id_to_index[from_ids[id2_index]])
-                # assign to matrix
-                if calc_dis > 0.0:
-                    if id_to_index[from_ids[id1_index]] < id_to_index[from_ids[id2_index]]:
-                        row.append(id_to_index[from_ids[id1_index]])
-                        col.append(id_to_index[from_ids[id2_index]])
-                    else:
-                        row.append(id_to_index[from_ids[id2_index]])
-                        col.append(id_to_index[from_ids[id1_index]])
-                    data.append(calc_dis)
-
-    # ===== from_ids against to_ids =====
+        to_index, to_pos = from_index, from_pos
+    else:
+        to_index = _get_index(id_to_index=id_to_index, ids=to_ids)
+        to_pos = rows.get_indexer(to_index)
+    return {'att_mat': att_mat, 'att_sizes': np.diff(att_mat.indptr), 'to_mat': att_mat[to_pos].T.tocsr(),
+            'from_index': from_index, 'from_pos': from_pos, 'to_index': to_index, 'to_pos': to_pos,
+            'from_in_to': np.isin(from_index, to_index), 'to_in_from': np.isin(to_index, from_index),
+            'upper': to_ids is None, 'unique_pairs': unique_pairs}
+
+
+def _get_index(id_to_index: pd.Index, ids: pd.Series) -> np.ndarray:
+    index = id_to_index.get_indexer(pd.Index(ids, dtype=object)).astype(np.int64)
+    if (index < 0).any():
+        raise KeyError(pd.Series(ids)[index < 0].iloc[0])
+    return index
+
+
+def _calc_distance_block(state: dict, start: int, end: int, coefficients) -> dict:
+    """
+    Calculate the distances of the from_ids with position start to end against all to_ids.
+
+    :param state: prepared incidence matrices and indices from _prepare_distance_state
+    :param start: position of first from_id in block
+    :param end: position after last from_id in block
+    :param coefficients: coefficient types for the distances. Possible: jaccard and overlap
+    :return: dict with row and col array of the distances > 0.0 and a data array per coefficient
+    """
+    intersections = (state['att_mat'][state['from_pos'][start:end]] @ state['to_mat']).tocoo()
+    from_block, to_block = intersections.row + start, intersections.col
+    # ===== from_ids against from_ids: only upper triangle of pairs =====
+    hits = intersections.data > 0
+    if state['upper']:
+        hits = hits & (to_block > from_block)
+    elif state['unique_pairs']:  # ===== ids in from_ids and to_ids: no distance to themselves and each pair once =====
+        hits = hits & ~(state['from_in_to'][from_block] & state['to_in_from'][to_block] &
+                        (state['from_index'][from_block] >= state['to_index'][to_block]))
+    from_block, to_block, intersections = from_block[hits], to_block[hits], intersections.data[hits]
+    # ===== assign to matrix =====
+    index1, index2 = state['from_index'][from_block], state['to_index'][to_block]
+    block = {'row': np.minimum(index1, index2), 'col': np.maximum(index1, index2)}
+    for coefficient in coefficients:
+        block[coefficient] = calc_coefficients(intersections=intersections,
+                                               sizes1=state['att_sizes'][state['from_pos'][from_block]],
+                                               sizes2=state['att_sizes'][state['to_pos'][to_block]],
+                                               coefficient=coefficient)
+    return block
+
+
+_worker_state = dict()
+
+
+def _init_distance_worker(state: dict):
+    _worker_state.update(state)
+
+
+def _save_distance_block(args):
+    start, end, coefficients, block_dir = args
+    block_files = dict()
+    for name, values in _calc_distance_block(state=_worker_state, start=start, end=end,
+                                             coefficients=coefficients).items():
+        block_files[name] = os.path.join(block_dir, str(start) + "_" + name + ".npy")
+        np.save(block_files[name], values)
+    return block_files
+
+
+def _merge_distance_blocks(block_files: list, names: list) -> dict:
+    """
+    Merge the arrays of all blocks saved on disk into one array per name.
+
+    :param block_files: list with dict of paths to the arrays of each block
+    :param names: names of the arrays to merge
+    :return: dict with merged array per name
+    """
+    merged = dict()
+    for name in names:
+        parts = [np.load(files[name], mmap_mode='r') for files in block_files]
+        values = np.empty(sum(len(part) for part in parts), dtype=parts[0].dtype)
+        offset = 0
+        for part in parts:
+            values[offset:offset + len(part)] = part
+            offset += len(part)
+        merged[name] = values
+    return merged
+
+
+def get_distance_pairs(adjacency: sp.csr_matrix, targets: np.ndarray, distance: int, block_size: int = 500,
+                       workers: int = 1):
+    """
+    Find all pairs of target vertices with a shortest path of exactly the given length in an undirected
+    graph, e.g. to project a gene-protein network onto its genes. Starting from a block of target vertices,
+    the vertices reached first in step d are the rows of the previous frontier multiplied with the adjacency
+    matrix without the vertices already visited, so all pairs of a block result from one sparse matrix
+    product per step. With more than one worker the blocks are spread over a process pool.
+
+    :param adjacency: symmetric adjacency matrix of all vertices
+    :param targets: ascending positions of the target vertices in the adjacency matrix
+    :param distance: length of the shortest paths between the pairs
+    :param block_size: number of target vertices starting at once, bounds the memory usage [Default=500]
+    :param workers: number of processes calculating blocks in parallel [Default=1]
+    :return: arrays with the positions in targets of the first and second vertex of every pair, ordered by
+    the first and then by the second vertex, every pair is included in both directions
+    """
+    state = {'adjacency': sp.csr_matrix(adjacency, dtype=np.float32), 'targets': np.asarray(targets),
+             'distance': distance}
+    starts = range(0, len(state['targets']), block_size)
+    if workers > 1 and len(starts) > 1:
+        with mp.Pool(processes=workers, initializer=_init_distance_worker, initargs=(state,)) as pool:
+            blocks = pool.map(_get_distance_pairs_block, [(start, start + block_size) for start in starts])
     else:
-        for id1 in from_ids:
-            for id2 in to_ids:
-                calc_dis = get_distance(index1=id_to_index[id1], index2=id_to_index[id2])
-                # assign to matrix
-                if calc_dis > 0.0:
-                    if id_to_index[id1] < id_to_index[id2]:
-                        row.append(id_to_index[id1])
-                        col.append(id_to_index[id2])
-                    else:
-                        row.append(id_to_index[id2])
-                        col.append(id_to_index[id1])
-                    data.append(calc_dis)
-    return sp.coo_matrix((np.array(data), (np.array(row), np.array(col))),
-                         shape=(len(full_att_series), len(full_att_series)))
+        blocks = [_calc_distance_pairs_block(state=state, start=start, end=start + block_size) for start in starts]
+    return (np.concatenate([np.array([], dtype=np.int64)] + [block[0] for block in blocks]),
+            np.concatenate([np.array([], dtype=np.int64)] + [block[1] for block in blocks]))
+
+
+def _calc_distance_pairs_block(state: dict, start: int, end: int) -> tuple:
+    sources = state['targets'][start:end]
+    frontier = sp.csr_matrix((np.ones(len(sources), dtype=np.float32), (np.arange(len(sources)), sources)),
+                             shape=(len(sources), state['adjacency'].shape[0]))
+    visited = frontier
+    for _ in range(state['distance']):
+        frontier = frontier @ state['adjacency']
+        frontier.data[:] = 1
+        # ===== keep only vertices not reached by a shorter path =====
+        frontier = (frontier - frontier.multiply(visited)).tocsr()
+        frontier.eliminate_zeros()
+        visited = visited + frontier
+    pairs = frontier[:, state['targets']].tocsr()
+    pairs.sort_indices()
+    return np.repeat(np.arange(start, start + pairs.shape[0]), np.diff(pairs.indptr)), pairs.indices.astype(np.int64)
+
+
+def _get_distance_pairs_block(args):
+    start, end = args
+    return _calc_distance_pairs_block(state=_worker_state, start=start, end=end)
+
+
+def get_incidence_matrix(att_series: pd.Series, return_terms: bool = False):
+    """
+    Encode the attribute sets of a series as sparse incidence matrix with one row per entry of
+    the series (in series order) and one column per distinct attribute value.
+
+    :param att_series: series with sets of attribute values
+    :param return_terms: bool if the attribute values of the columns should be returned as well [Default=False]
+    :return: incidence sparse matrix and if return_terms also the attribute value of each column as index
+    """
+    exploded = att_series.reset_index(drop=True).explode()
+    exploded = exploded[exploded.notna() & (exploded != "")]
+    codes, terms = pd.factorize(exploded)
+    att_mat = sp.csr_matrix((np.ones(len(codes), dtype=np.int32), (exploded.index.to_numpy(), codes)),
+                            shape=(len(att_series), len(terms)))
+    att_mat.data[:] = 1
+    if return_terms:
+        return att_mat, pd.Index(terms)
+    return att_mat
+
+
+def calc_coefficients(intersections: np.ndarray, sizes1: np.ndarray, sizes2: np.ndarray, coefficient='jaccard'):
+    """
+    Vectorized version of jaccard_coefficient and overlap_coefficient based on precalculated
+    intersection sizes and sizes of both sets.
+
+    :param intersections: array with number of shared attribute values per pair
+    :param sizes1: array with size of the first set per pair
+    :param sizes2: array with size of the second set per pair
+    :param coefficient: coefficient type for the distance. Possible: jaccard or overlap [Default="jaccard"]
+    :return: array with coefficient per pair
+    """
+    intersections = np.asarray(intersections, dtype=float)
+    if coefficient == "jaccard":
+        denominator = sizes1 + sizes2 - intersections
+    else:  # coefficient == "overlap"
+        denominator = np.minimum(sizes1, sizes2).astype(float)
+    result = np.zeros(len(intersections), dtype=float)
+    np.divide(intersections, denominator, out=result, where=intersections > 0)
+    return result
 
 
 def create_ref_dict(mapping: pd.DataFrame, keys: set, enriched: bool = False):
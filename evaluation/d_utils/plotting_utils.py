@@ -129,7 +129,7 @@ def mappability_plot(title, in_type, mapped_df, out_dir, prefix, cluster=False,
     fig.savefig(os.path.join(out_dir, prefix + '_mappability.' + file_type), bbox_inches='tight')
 
 
-def create_extended_plots(results, mode, tar, out_dir, prefix, file_type: str = "pdf", mapper: Mapper = FileMapper()):
+def create_extended_plots(results, mode, tar, out_dir, prefix, file_type: str = "pdf", mapper: Mapper = None):
     """
     Create extended plots displaying the distribution of calculated values for each random run,
     the distribution of mapped number of terms per id from the input set and sankey plots
@@ -144,6 +144,7 @@ def create_extended_plots(results, mode, tar, out_dir, prefix, file_type: str =
     :param mapper: mapper from type Mapper defining where the mapping files lie [Default=FileMapper]
     :return:
     """
+    mapper = FileMapper() if mapper is None else mapper
     Path(out_dir).mkdir(parents=True, exist_ok=True)  # make sure output dir exists
     value_distribution_plots(results=results, out_dir=out_dir, prefix=prefix, file_type=file_type)
     term_annotation_plots(results=results, out_dir=out_dir, prefix=prefix, file_type=file_type)
@@ -194,7 +195,8 @@ def term_annotation_plots(results, out_dir, prefix, file_type: str = "pdf"):
 
 
 def sankey_plot(results, mode, out_dir, prefix, file_type: str = "pdf", tar_cluster=None, include_others=False,
-                mapper: Mapper = FileMapper()):
+                mapper: Mapper = None):
+    mapper = FileMapper() if mapper is None else mapper
     full_df = pd.DataFrame(results["input_values"]["mapped_ids"])
     for term_index, term in enumerate(full_df.columns):
         if len(full_df[[term]].dropna()) == 0:  # save empty plot
@@ -225,9 +227,15 @@ def sankey_plot(results, mode, out_dir, prefix, file_type: str = "pdf", tar_clus
                 d = d[d[term].isin(ids)]
             d[term] = d[term].astype({term: str}, errors='raise')
             if term == "related_genes":
-                rename_ids, _ = mapper.get_loaded_mapping(in_set=d[term], id_type="entrezgene", key="gene_ids")
-                rename_ids = rename_ids.explode("symbol").set_index('entrezgene')['symbol'].to_dict()
-                d[term] = d[term].map(rename_ids).fillna(d[term])
+                # ===== rows of the entrez ids from the id column index, only their last symbol is decoded =====
+                genes = mapper.get_columnar_mapping(key="gene_ids")
+                if len(genes) > 0:
+                    rows, entrez = genes.find(column="entrezgene", values=d[term].unique())
+                    indptr = np.asarray(genes.columns['symbol']['indptr'])
+                    found = indptr[rows + 1] > indptr[rows]
+                    symbols = genes.get_terms(column='symbol').to_numpy()[
+                        np.asarray(genes.columns['symbol']['indices'])[indptr[rows[found] + 1] - 1]]
+                    d[term] = d[term].map(dict(zip(entrez[found], symbols))).fillna(d[term])
             # ===== Save hierarchy =====
             hierarchy_left = d["left"].value_counts().index.tolist()
             hierarchy_right = d[term].value_counts().index.tolist()
@@ -453,7 +461,7 @@ def create_contribution_plots(result_sig, out_dir, prefix, file_type: str = "pdf
 
 
 def create_contribution_graphs(result_sig, tar_id, network_data, out_dir, prefix,
-                               file_type: str = "pdf", mapper: Mapper = FileMapper()):
+                               file_type: str = "pdf", mapper: Mapper = None):
     """
     For mode subnetwork this will recreate the subnetwork by identifying the input ids in the given network,
     or default network if network_data is None, visualize it and color it based on the significance
@@ -470,6 +478,7 @@ def create_contribution_graphs(result_sig, tar_id, network_data, out_dir, prefix
     :param mapper: mapper from type Mapper defining where the mapping files lie [Default=FileMapper]
     :return:
     """
+    mapper = FileMapper() if mapper is None else mapper
     if network_data is None:
         # ===== Load default network =====
         if tar_id in c.SUPPORTED_GENE_IDS:
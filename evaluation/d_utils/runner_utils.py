@@ -83,9 +83,19 @@ def save_parameters(script_desc: str, arguments):
         optional_args.add_argument("-p", "--plot", action='store_true', default=False,
                                    help="Set flag, if plots should be created.")
     if 's' in arguments:
-        optional_args.add_argument("-s", "--setup_type", type=str, default='api', choices=['create', 'api'],
+        optional_args.add_argument("-s", "--setup_type", type=str, default='api',
+                                   choices=['create', 'api', 'convert', 'modules'],
                                    help="Choose 'api' do load data from API (runtime: ~1min) [highly recommended], "
-                                        "or 'create' to create it from scratch (runtime: ~3h) [Default=api]")
+                                        "or 'create' to create it from scratch (runtime: ~3h), or 'convert' to "
+                                        "convert distances of a previous setup into memory mappable files, or "
+                                        "'modules' to pre-generate the random modules of the network background "
+                                        "model for the default networks [Default=api]")
+    if 'sd' in arguments:
+        optional_args.add_argument("-sd", "--seed", type=int, default=None,
+                                   help="Seed for the random runs to make the results reproducible. [Default=None]")
+    if 'w' in arguments:
+        optional_args.add_argument("-w", "--workers", type=int, default=1,
+                                   help="Number of processes used for the calculations. [Default=1]")
     if 'sc' in arguments:
         optional_args.add_argument("-s", "--significance_contribution", default=False,
                                    help="Set flag, if additionally each significance contribution of each input id "
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .. import config
+from biothings_client import get_client
+
+
+class BiothingsFetcher:
+    """
+    Fetch layer for myGene.info and myDisease.info. Queries are split into chunks which run
+    concurrently on a thread pool, all chunks and all calls share one client per client type,
+    and a failed chunk is retried on its own instead of repeating the whole query.
+    """
+
+    def __init__(self, client_factory=get_client, urls: dict = None, chunk_size: int = config.FETCH_CHUNK_SIZE,
+                 workers: int = config.FETCH_WORKERS, retries: int = config.FETCH_RETRIES, backoff: float = 1.0):
+        """
+        :param client_factory: method returning the biothings client for "gene" or "disease", it gets the url
+        as keyword argument if one is set for the client type [Default=get_client]
+        :param urls: dict with client type as key and url of the api as value, e.g. of a local server. Client
+        types without url use the public api [Default=config.BIOTHINGS_URLS]
+        :param chunk_size: number of queries per chunk [Default=config.FETCH_CHUNK_SIZE]
+        :param workers: number of chunks fetched at the same time [Default=config.FETCH_WORKERS]
+        :param retries: number of retries of a failed chunk [Default=config.FETCH_RETRIES]
+        :param backoff: seconds to wait before the first retry, doubled for every further retry [Default=1.0]
+        """
+        self.client_factory = client_factory
+        self.urls = dict(config.BIOTHINGS_URLS if urls is None else urls)
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self._clients = dict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # ===== clients and lock stay with the process, a worker process creates its own clients =====
+        state = dict(self.__dict__)
+        state['_clients'], state['_lock'] = dict(), None
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get_client(self, client_type: str):
+        """
+        Get the client of a client type, created on first use and reused afterwards.
+
+        :param client_type: type of the biothings client, either "gene" or "disease"
+        :return: biothings client
+        """
+        with self._lock:
+            if client_type not in self._clients:
+                if self.urls.get(client_type) is not None:
+                    self._clients[client_type] = self.client_factory(client_type, url=self.urls[client_type])
+                else:
+                    self._clients[client_type] = self.client_factory(client_type)
+            return self._clients[client_type]
+
+    def fetch(self, client_type: str, method: str, queries: list, **kwargs):
+        """
+        Run a method of the biothings client for all queries in chunks.
+
+        :param client_type: type of the biothings client, either "gene" or "disease"
+        :param method: name of the client method taking the list of queries as first argument
+        :param queries: queries for the method, e.g. ids
+        :param kwargs: further arguments of the method like scopes or fields
+        :return: generator yielding the queries of every chunk with the list of its hits, in order of completion
+        """
+        chunks = [queries[start:start + self.chunk_size] for start in range(0, len(queries), self.chunk_size)]
+        if len(chunks) <= 1 or self.workers <= 1:
+            for chunk in chunks:
+                yield chunk, self._fetch_chunk(client_type=client_type, method=method, chunk=chunk, kwargs=kwargs)
+            return
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(chunks))) as pool:
+            futures = {pool.submit(self._fetch_chunk, client_type, method, chunk, kwargs): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def _fetch_chunk(self, client_type: str, method: str, chunk: list, kwargs: dict) -> list:
+        for attempt in range(self.retries + 1):
+            try:
+                return getattr(self.get_client(client_type=client_type), method)(chunk, returnall=False,
+                                                                                 as_dataframe=False, **kwargs)
+            except Exception:  # connection errors, timeouts and error responses of the api
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
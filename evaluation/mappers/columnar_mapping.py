@@ -0,0 +1,493 @@
+#!/usr/bin/python3
+
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from . import store_utils as su
+
+
+class ColumnarMapping:
+    """
+    Mapping of ids to sets of values per column, saved column wise instead of as one set object per cell.
+    Every set valued column consists of a vocabulary interning its terms as int32 codes, the term codes
+    of all rows flattened into one array sorted per row and the offsets of every row inside this array
+    (csr layout). New terms are only appended to a vocabulary, so the code of a term never changes.
+    """
+
+    def __init__(self, id_column, ids: np.ndarray, columns: dict):
+        """
+        :param id_column: name of the column with the id of every row
+        :param ids: id of every row
+        :param columns: dict with column name as key and dict with indptr, indices and terms array as value
+        """
+        self.id_column = id_column
+        self.ids = ids
+        self.columns = columns
+        self._terms, self._indices = dict(), dict()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_frame(cls, mapping: pd.DataFrame):
+        """
+        Encode mapping with the id in the first column and sets, lists or strings of values
+        separated by ';' in all other columns.
+
+        :param mapping: mapping as dataframe
+        :return: columnar mapping with rows in order of the dataframe
+        """
+        if len(mapping.columns) == 0:
+            return cls(id_column=None, ids=np.array([], dtype=object), columns=dict())
+        mapping = mapping.reset_index(drop=True)
+        ids = mapping[mapping.columns[0]].fillna('').astype(str).to_numpy(dtype=object)
+        return cls(id_column=mapping.columns[0], ids=ids,
+                   columns={column: _encode_column(values=mapping[column]) for column in mapping.columns[1:]})
+
+    def concat(self, other):
+        """
+        Append the rows of another columnar mapping. Terms missing in a vocabulary are appended to it,
+        the codes of the appended rows are translated into the extended vocabulary. Inverted indices
+        already built are carried over with only the postings of the appended rows merged into them.
+
+        :param other: columnar mapping with the rows to append
+        :return: new columnar mapping with the rows of both
+        """
+        if self.id_column is None:
+            return other
+        if len(other) == 0:
+            return self
+        columns, all_terms, indices = dict(), dict(), dict()
+        for column in list(self.columns) + [column for column in other.columns if column not in self.columns]:
+            own = self.columns.get(column, _empty_column(size=len(self)))
+            new = other.columns.get(column, _empty_column(size=len(other)))
+            terms = self.get_terms(column=column) if column in self.columns else pd.Index([], dtype=object)
+            new_terms = pd.Index(new['terms'], dtype=object)
+            terms = terms.append(new_terms[terms.get_indexer(new_terms) < 0])
+            codes = _sort_rows(indptr=new['indptr'],
+                               indices=terms.get_indexer(new_terms)[new['indices']].astype(np.int32))
+            columns[column] = {'indptr': np.concatenate((own['indptr'], new['indptr'][1:] + own['indptr'][-1])),
+                               'indices': np.concatenate((own['indices'], codes)),
+                               'terms': np.asarray(terms, dtype=str)}
+            all_terms[column] = terms
+            if column in self._indices:
+                indices[column] = self._indices[column].append(
+                    codes=codes, entities=len(self) + np.repeat(np.arange(len(other)), np.diff(new['indptr'])),
+                    terms=terms, size=len(self) + len(other))
+        if self.id_column in self._indices:
+            terms = self._indices[self.id_column].terms
+            codes = terms.get_indexer(pd.Index(other.ids, dtype=object))
+            unknown_codes, unknown = pd.factorize(other.ids[codes < 0])
+            codes[codes < 0] = unknown_codes + len(terms)
+            indices[self.id_column] = self._indices[self.id_column].append(
+                codes=codes, entities=len(self) + np.arange(len(other)),
+                terms=terms.append(pd.Index(unknown, dtype=object)), size=len(self) + len(other))
+        columnar = ColumnarMapping(id_column=self.id_column, ids=np.concatenate((self.ids, other.ids)),
+                                   columns=columns)
+        columnar._terms, columnar._indices = all_terms, indices
+        return columnar
+
+    def get_terms(self, column) -> pd.Index:
+        """
+        Get the vocabulary of a column, the position of a term is its code.
+
+        :param column: name of the column
+        :return: index with the terms
+        """
+        if column not in self._terms:
+            self._terms[column] = pd.Index(self.columns[column]['terms'], dtype=object)
+        return self._terms[column]
+
+    def get_matrix(self, column):
+        """
+        Get the values of a column as sparse incidence matrix with one row per row of the mapping
+        and one column per term of the vocabulary. The arrays of the mapping are used without copy.
+
+        :param column: name of the column
+        :return: incidence sparse matrix and the term of each column as index
+        """
+        indptr, indices = self.columns[column]['indptr'], self.columns[column]['indices']
+        matrix = sp.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr),
+                               shape=(len(self), len(self.columns[column]['terms'])), copy=False)
+        matrix.has_sorted_indices = True
+        matrix.has_canonical_format = True
+        return matrix, self.get_terms(column=column)
+
+    def encode(self, column, values: pd.Series):
+        """
+        Encode sets of values with the vocabulary of a column as sparse incidence matrix in the same
+        column order as get_matrix. Values missing in the vocabulary get columns after all terms of
+        the vocabulary, so they still count for the size of their sets.
+
+        :param column: name of the column
+        :param values: series with sets, lists or strings of values separated by ';'
+        :return: incidence sparse matrix and the term of each column as index
+        """
+        rows, exploded = _explode_values(values=values.reset_index(drop=True))
+        terms = self.get_terms(column=column)
+        codes = terms.get_indexer(exploded)
+        if (codes < 0).any():
+            unknown_codes, unknown = pd.factorize(exploded[codes < 0])
+            codes[codes < 0] = unknown_codes + len(terms)
+            terms = terms.append(pd.Index(unknown, dtype=object))
+        matrix = sp.csr_matrix((np.ones(len(codes), dtype=np.int32), (rows, codes)),
+                               shape=(len(values), len(terms)))
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        return matrix, terms
+
+    def get_index(self, column):
+        """
+        Get the inverted index of a column, the id column included. The index is built once per column
+        and carried over to the mapping returned by concat.
+
+        :param column: name of the column
+        :return: inverted index with the rows of every distinct value of the column as entities
+        """
+        if column not in self._indices:
+            if column == self.id_column:
+                codes, values = pd.factorize(self.ids)
+                self._indices[column] = InvertedIndex.from_codes(codes=codes, entities=np.arange(len(self)),
+                                                                 terms=pd.Index(values, dtype=object), size=len(self))
+            else:
+                self._indices[column] = InvertedIndex.from_codes(
+                    codes=self.columns[column]['indices'],
+                    entities=np.repeat(np.arange(len(self)), np.diff(self.columns[column]['indptr'])),
+                    terms=self.get_terms(column=column), size=len(self))
+        return self._indices[column]
+
+    def get_rows(self, column, values):
+        """
+        Get the rows with each of the values in a column with one index lookup per value.
+
+        :param column: name of the column
+        :param values: values to look for
+        :return: position of the value and row of every hit
+        """
+        return self.get_index(column=column).get_term_entities(terms=values)
+
+    def get_neighbours(self, column, rows: np.ndarray) -> np.ndarray:
+        """
+        Get all rows sharing at least one value of a set valued column with any of the given rows,
+        the given rows with values included. Only the rows of the values of the given rows are visited.
+
+        :param column: name of the column
+        :param rows: rows to get the neighbours of
+        :return: sorted neighbour rows
+        """
+        row_indptr = np.asarray(self.columns[column]['indptr'])
+        rows = np.asarray(rows, dtype=np.int64)
+        codes = np.asarray(self.columns[column]['indices'])[_get_positions(starts=row_indptr[rows],
+                                                                          ends=row_indptr[rows + 1])]
+        return self.get_index(column=column).get_code_entities(codes=codes)
+
+    def find(self, column, values):
+        """
+        Find all rows with any of the values in a column.
+
+        :param column: name of the column
+        :param values: values to look for
+        :return: row of every hit and the found value of every hit, in row order
+        """
+        values = pd.Index(list(values), dtype=object).unique()
+        positions, rows = self.get_rows(column=column, values=values)
+        order = np.lexsort((positions, rows))
+        return rows[order], values.to_numpy()[positions[order]]
+
+    def explode(self, column) -> pd.DataFrame:
+        """
+        Get the id column with one row per value of a column, rows without value keep an empty string.
+
+        :param column: name of the column
+        :return: dataframe with the id column and the exploded column
+        """
+        if column == self.id_column:
+            return pd.DataFrame({self.id_column: self.ids})
+        indptr = self.columns[column]['indptr']
+        sizes = np.diff(indptr)
+        rows = np.repeat(np.arange(len(self)), np.maximum(sizes, 1))
+        values = np.full(len(rows), "", dtype=object)
+        values[np.repeat(sizes > 0, np.maximum(sizes, 1))] = \
+            self.get_terms(column=column).to_numpy()[self.columns[column]['indices']]
+        return pd.DataFrame({self.id_column: self.ids[rows], column: values}, index=rows)
+
+    def to_frame(self, rows=None, sep: str = None) -> pd.DataFrame:
+        """
+        Decode rows into a mapping with one set of values per cell.
+
+        :param rows: positions of the rows to decode, all if None [Default=None]
+        :param sep: if given the values are joined to one string with sep instead of a set [Default=None]
+        :return: mapping as dataframe with the row positions as index
+        """
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows, dtype=np.int64)
+        if self.id_column is None:
+            return pd.DataFrame()
+        frame = {self.id_column: self.ids[rows]}
+        for column, arrays in self.columns.items():
+            starts, ends = arrays['indptr'][rows], arrays['indptr'][rows + 1]
+            positions = _get_positions(starts=starts, ends=ends)
+            values = np.split(self.get_terms(column=column).to_numpy()[arrays['indices'][positions]],
+                              np.cumsum(ends - starts)[:-1]) if len(rows) > 0 else []
+            frame[column] = [sep.join(value) for value in values] if sep is not None else \
+                [set(value) for value in values]
+        return pd.DataFrame(frame, index=rows)
+
+    def save(self, path: str, source_file: str = None):
+        """
+        Save columnar mapping as directory of .npy files with one sub directory per column, which
+        also holds the inverted index of the column. The size and modification time of the source
+        file are saved last, so an interrupted save is never taken as current.
+
+        :param path: directory of the columnar mapping
+        :param source_file: file the mapping was loaded from [Default=None]
+        """
+        if os.path.isfile(os.path.join(path, "source.npy")):
+            os.remove(os.path.join(path, "source.npy"))
+        su.save_arrays(arrays={'ids': np.asarray(self.ids, dtype=str),
+                               'columns': np.array([self.id_column] + list(self.columns), dtype=str)}, path=path)
+        for column, arrays in self.columns.items():
+            su.save_arrays(arrays=arrays, path=os.path.join(path, column))
+            self.get_index(column=column).save(path=os.path.join(path, column, "index"))
+        if source_file is not None:
+            su.save_arrays(arrays={'source': _get_stamp(file=source_file)}, path=path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """
+        Load columnar mapping saved by save, together with the saved inverted indices.
+
+        :param path: directory of the columnar mapping
+        :param mmap: bool if the term codes, entities and offsets should be opened read-only memory mapped
+        [Default=True]
+        :return: columnar mapping
+        """
+        names = su.load_arrays(path=path, names=['columns'], mmap=False)['columns'].tolist()
+        ids = su.load_arrays(path=path, names=['ids'], mmap=False)['ids'].astype(object)
+        columns = dict()
+        for column in names[1:]:
+            columns[column] = su.load_arrays(path=os.path.join(path, column), names=['indptr', 'indices'], mmap=mmap)
+            columns[column]['terms'] = su.load_arrays(path=os.path.join(path, column), names=['terms'],
+                                                      mmap=False)['terms']
+        columnar = cls(id_column=names[0], ids=ids, columns=columns)
+        for column in names[1:]:
+            if InvertedIndex.is_saved(path=os.path.join(path, column, "index")):
+                columnar._indices[column] = InvertedIndex.load(path=os.path.join(path, column, "index"),
+                                                               terms=columnar.get_terms(column=column),
+                                                               size=len(columnar), mmap=mmap)
+        return columnar
+
+    @staticmethod
+    def is_current(path: str, source_file: str) -> bool:
+        """
+        Check if the columnar mapping in path was saved from the current version of the source file.
+
+        :param path: directory of the columnar mapping
+        :param source_file: file the mapping is loaded from
+        :return: true if size and modification time of the source file are unchanged since the save
+        """
+        if not os.path.isfile(os.path.join(path, "source.npy")) or not os.path.isfile(source_file):
+            return False
+        return np.array_equal(np.load(os.path.join(path, "source.npy")), _get_stamp(file=source_file))
+
+
+class InvertedIndex:
+    """
+    Entities carrying each term of a column as term x entity matrix in csr layout: the entities of all
+    terms flattened into one array sorted per term and the offsets of every term inside this array. The
+    entities are row positions of the mapping and the rows of the index follow the vocabulary, so the
+    code of a term is its row.
+    """
+
+    def __init__(self, terms: pd.Index, indptr: np.ndarray, entities: np.ndarray, size: int):
+        """
+        :param terms: term of every row of the index
+        :param indptr: offsets of the entities of every term
+        :param entities: entities of all terms, sorted per term
+        :param size: number of entities
+        """
+        self.terms = terms
+        self.indptr = indptr
+        self.entities = entities
+        self.size = size
+
+    def __len__(self):
+        return len(self.terms)
+
+    @classmethod
+    def from_codes(cls, codes: np.ndarray, entities: np.ndarray, terms: pd.Index, size: int):
+        """
+        Build the index from the term code of every pair of entity and term.
+
+        :param codes: term code of every pair
+        :param entities: entity of every pair, ascending
+        :param terms: term of every code
+        :param size: number of entities
+        :return: inverted index
+        """
+        codes = np.asarray(codes)
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(terms))))).astype(np.int64)
+        return cls(terms=terms, indptr=indptr, entities=entities[np.argsort(codes, kind='stable')], size=size)
+
+    def append(self, codes: np.ndarray, entities: np.ndarray, terms: pd.Index, size: int):
+        """
+        Add pairs of entity and term for entities after all entities of the index. Only the new pairs
+        are sorted, the entities of every term are moved to their new offsets.
+
+        :param codes: term code of every new pair
+        :param entities: entity of every new pair, ascending and greater than all entities of the index
+        :param terms: term of every code, starting with the terms of the index
+        :param size: number of entities
+        :return: new inverted index
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        old_counts = np.zeros(len(terms), dtype=np.int64)
+        old_counts[:len(self)] = self.get_counts()
+        new_counts = np.bincount(codes, minlength=len(terms))
+        indptr = np.concatenate(([0], np.cumsum(old_counts + new_counts))).astype(np.int64)
+        merged = np.empty(indptr[-1], dtype=np.int64)
+        # ===== old entities keep their order within a term, the new ones follow them =====
+        old_codes = np.repeat(np.arange(len(self)), old_counts[:len(self)])
+        merged[indptr[old_codes] + np.arange(len(old_codes)) - self.indptr[old_codes]] = self.entities
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        new_starts = np.concatenate(([0], np.cumsum(new_counts)))
+        merged[indptr[sorted_codes] + old_counts[sorted_codes] + np.arange(len(codes)) - new_starts[sorted_codes]] = \
+            np.asarray(entities)[order]
+        return InvertedIndex(terms=terms, indptr=indptr, entities=merged, size=size)
+
+    def get_codes(self, terms) -> np.ndarray:
+        """
+        Get the codes of terms.
+
+        :param terms: terms to look up
+        :return: array with the code of every term or -1 if the term is unknown
+        """
+        return self.terms.get_indexer(pd.Index(list(terms), dtype=object))
+
+    def get_term_entities(self, terms):
+        """
+        Get the entities of each of the terms.
+
+        :param terms: terms to look for
+        :return: position of the term and entity of every hit
+        """
+        codes = self.get_codes(terms=terms)
+        found = np.flatnonzero(codes >= 0)
+        starts, ends = self.indptr[codes[found]], self.indptr[codes[found] + 1]
+        return np.repeat(found, ends - starts), self.entities[_get_positions(starts=starts, ends=ends)]
+
+    def get_entities(self, terms) -> np.ndarray:
+        """
+        Get the entities carrying any of the terms.
+
+        :param terms: terms to look for
+        :return: sorted entities
+        """
+        codes = self.get_codes(terms=terms)
+        return self.get_code_entities(codes=codes[codes >= 0])
+
+    def get_code_entities(self, codes: np.ndarray) -> np.ndarray:
+        """
+        Get the entities carrying any of the terms given by their codes.
+
+        :param codes: codes of the terms
+        :return: sorted entities
+        """
+        codes = np.unique(codes)
+        return np.unique(self.entities[_get_positions(starts=self.indptr[codes], ends=self.indptr[codes + 1])])
+
+    def get_counts(self) -> np.ndarray:
+        """
+        Get the number of entities of every term.
+
+        :return: array with the number of entities per code
+        """
+        return np.diff(self.indptr)
+
+    def get_matrix(self) -> sp.csr_matrix:
+        """
+        Get the index as sparse term x entity matrix, the arrays of the index are used without copy.
+
+        :return: sparse matrix with one row per term and one column per entity
+        """
+        matrix = sp.csr_matrix((np.ones(len(self.entities), dtype=np.int32), self.entities, self.indptr),
+                               shape=(len(self), self.size), copy=False)
+        matrix.has_sorted_indices = True
+        matrix.has_canonical_format = True
+        return matrix
+
+    def save(self, path: str):
+        """
+        Save the offsets and entities as .npy files, the terms are saved with their column.
+
+        :param path: directory of the index
+        """
+        su.save_arrays(arrays={'indptr': self.indptr, 'entities': np.asarray(self.entities, dtype=np.int64)},
+                       path=path)
+
+    @staticmethod
+    def is_saved(path: str) -> bool:
+        return all(os.path.isfile(os.path.join(path, name + ".npy")) for name in ['indptr', 'entities'])
+
+    @classmethod
+    def load(cls, path: str, terms: pd.Index, size: int, mmap: bool = True):
+        """
+        Load index saved by save.
+
+        :param path: directory of the index
+        :param terms: terms of the column of the index
+        :param size: number of entities
+        :param mmap: bool if the arrays should be opened read-only memory mapped [Default=True]
+        :return: inverted index
+        """
+        arrays = su.load_arrays(path=path, names=['indptr', 'entities'], mmap=mmap)
+        return cls(terms=terms, indptr=arrays['indptr'], entities=arrays['entities'], size=size)
+
+
+def _get_stamp(file: str) -> np.ndarray:
+    return np.array([os.stat(file).st_size, os.stat(file).st_mtime_ns], dtype=np.int64)
+
+
+def _empty_column(size: int) -> dict:
+    return {'indptr': np.zeros(size + 1, dtype=np.int64), 'indices': np.array([], dtype=np.int32),
+            'terms': np.array([], dtype=str)}
+
+
+def _get_positions(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    # ===== concatenated ranges from every start to its end =====
+    return np.repeat(ends - np.cumsum(ends - starts), ends - starts) + np.arange((ends - starts).sum())
+
+
+def _sort_rows(indptr: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    return indices[np.lexsort((indices, rows))]
+
+
+def _explode_values(values: pd.Series):
+    """
+    Explode a column of sets, lists or strings of values separated by ';' into one value per entry.
+
+    :param values: column with default index
+    :return: row of every value and the values
+    """
+    exploded = values.explode()
+    exploded = exploded[exploded.notna()].astype(str).str.split(';').explode()
+    exploded = exploded[exploded != ""]
+    return exploded.index.to_numpy(dtype=np.int64), exploded.to_numpy(dtype=object)
+
+
+def _encode_column(values: pd.Series) -> dict:
+    """
+    Encode a column of sets, lists or strings of values separated by ';' into term codes per row.
+
+    :param values: column with default index
+    :return: dict with indptr, indices and terms array
+    """
+    rows, exploded = _explode_values(values=values)
+    codes, terms = pd.factorize(exploded, sort=True)
+    num_terms = max(len(terms), 1)
+    # ===== sort codes per row and drop duplicates within a row =====
+    rows, indices = np.divmod(np.unique(rows * num_terms + codes), num_terms)
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=len(values))))).astype(np.int64)
+    return {'indptr': indptr, 'indices': indices.astype(np.int32), 'terms': np.asarray(terms, dtype=str)}
@@ -3,8 +3,8 @@
 import pandas as pd
 from .. import config
 from . import mapping_utils as mu
-from biothings_client import get_client
 from .mapper import Mapper
+from .lookup_cache import LookupCache
 
 
 def get_disease_to_attributes(disease_set, id_type, mapper: Mapper):
@@ -30,31 +30,47 @@ def get_disease_to_attributes(disease_set, id_type, mapper: Mapper):
     missing_hits = ['MONDO:' + x for x in missing_hits]
     # ===== Get att for missing values =====
     if len(missing_hits) > 0:
-        mapping = get_attributes_from_database(missing=missing_hits)
-        if not mapping.empty:
-            mapping = mapping.fillna('').groupby(id_type, as_index=False).agg(
-                {x: mu.combine_rows_to_set for x in config.DISEASE_ATTRIBUTES_KEY})
-            # ===== Add results from missing values =====
-            mapper.update_mappings(in_df=mapping, key='disorder_atts')
-            hit_mapping = pd.concat([hit_mapping, mapping]) if not hit_mapping.empty else mapping
+        # ===== Add the results of every chunk as soon as it was fetched =====
+        for mapping in mapper.lookup_cache.iter_query(client_type="disease", method="getdiseases", queries=missing_hits,
+                                                      fields=','.join(config.DISEASE_ATTRIBUTES_KEY), species='human'):
+            mapping = transform_database_results(mapping=mapping)
+            if not mapping.empty:
+                mapping = mapping.fillna('').groupby(id_type, as_index=False).agg(
+                    {x: mu.combine_rows_to_set for x in config.DISEASE_ATTRIBUTES_KEY})
+                # ===== Add results from missing values =====
+                mapper.update_mappings(in_df=mapping, key='disorder_atts')
+                hit_mapping = pd.concat([hit_mapping, mapping]) if not hit_mapping.empty else mapping
     # ===== Map back to previous ids =====
     hit_mapping = mu.map_to_prev_id(main_id_type="mondo", id_type=id_type,
                                     id_mapping=disorder_mapping, att_mapping=hit_mapping)
     return hit_mapping
 
 
-def get_attributes_from_database(missing: list, attributes: list = config.DISEASE_ATTRIBUTES_KEY.keys()):
+def get_attributes_from_database(missing: list, attributes: list = config.DISEASE_ATTRIBUTES_KEY.keys(),
+                                 lookup_cache: LookupCache = None):
     """
     Get mapping from myDisease.info.
 
     :param missing: list of missing values that should be mapped
     :param attributes: attributes that should be mapped to the missing values
+    :param lookup_cache: cache of previous lookups, nothing is cached if None [Default=None]
     :return: retrieved mapping as dataframe
     """
-    md = get_client("disease")
-    mapping = md.getdiseases(missing, fields=','.join(attributes),
-                             species='human', returnall=False, as_dataframe=True, df_index=False)
-    mapping.rename(columns={'query': 'mondo'}, inplace=True)
+    lookup_cache = LookupCache() if lookup_cache is None else lookup_cache
+    mapping = lookup_cache.query(client_type="disease", method="getdiseases", queries=missing,
+                                 fields=','.join(attributes), species='human')
+    return transform_database_results(mapping=mapping, attributes=attributes)
+
+
+def transform_database_results(mapping: pd.DataFrame, attributes: list = config.DISEASE_ATTRIBUTES_KEY.keys()):
+    """
+    Transform the hits from myDisease.info into a mapping with one set per attribute.
+
+    :param mapping: hits as dataframe
+    :param attributes: attributes that were mapped
+    :return: transformed mapping as dataframe
+    """
+    mapping = mapping.rename(columns={'query': 'mondo'})
     if 'notfound' in mapping:
         mapping = mapping[mapping['notfound'] != True]
     if not mapping.empty:
@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+
+import numpy as np
+import scipy.sparse as sp
+
+
+class DistanceMatrix:
+    """
+    Distance matrix split into an immutable base matrix, as loaded or memory mapped from disk, and a delta
+    matrix with the distances appended since. Appending only merges the new distances into the delta, the
+    base is never rebuilt. Both are kept at the same shape and queried together, compact merges the delta
+    into a new base.
+    """
+
+    def __init__(self, base: sp.csr_matrix, delta: sp.csr_matrix = None):
+        """
+        :param base: base distance matrix
+        :param delta: distances appended to the base, of the same shape [Default=None]
+        """
+        self.base = base
+        self.delta = delta
+
+    @property
+    def shape(self) -> tuple:
+        return self.base.shape
+
+    @property
+    def nnz(self) -> int:
+        return self.base.nnz + (self.delta.nnz if self.delta is not None else 0)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for matrix in self._parts() for array in [matrix.data, matrix.indices, matrix.indptr])
+
+    def _parts(self) -> list:
+        return [self.base] if self.delta is None else [self.base, self.delta]
+
+    def append(self, in_mat: sp.spmatrix, size: int):
+        """
+        Add distances, e.g. of new ids, and grow the matrix to the given number of ids.
+
+        :param in_mat: distances to add
+        :param size: number of ids of the grown matrix
+        :return: new distance matrix with the distances of both
+        """
+        size = max(size, self.shape[0])
+        in_mat = in_mat.tocoo()
+        delta = sp.csr_matrix((in_mat.data, (in_mat.row, in_mat.col)), shape=(size, size))
+        if self.delta is not None:
+            delta = _pad(matrix=self.delta, size=size) + delta
+        return DistanceMatrix(base=_pad(matrix=self.base, size=size), delta=delta)
+
+    def select(self, rows: np.ndarray, cols: np.ndarray) -> sp.csr_matrix:
+        """
+        Get the distances between the given rows and columns.
+
+        :param rows: row indices
+        :param cols: column indices
+        :return: sparse matrix with one row per row index and one column per column index
+        """
+        result = self.base[rows, :][:, cols]
+        if self.delta is not None:
+            result = result + self.delta[rows, :][:, cols]
+        return result.tocsr()
+
+    def product(self, left: sp.spmatrix) -> sp.csr_matrix:
+        """
+        Multiply a sparse matrix from the left with the distances.
+
+        :param left: matrix with one column per id
+        :return: left @ distances
+        """
+        result = left @ self.base
+        if self.delta is not None:
+            result = result + left @ self.delta
+        return sp.csr_matrix(result)
+
+    def compact(self):
+        """
+        Merge the delta into the base.
+
+        :return: distance matrix without delta
+        """
+        if self.delta is None:
+            return self
+        return DistanceMatrix(base=self.tocsr())
+
+    def tocsr(self) -> sp.csr_matrix:
+        if self.delta is None:
+            return self.base
+        return (self.base + self.delta).tocsr()
+
+    def tocoo(self) -> sp.coo_matrix:
+        return self.tocsr().tocoo()
+
+
+def _pad(matrix: sp.csr_matrix, size: int) -> sp.csr_matrix:
+    """
+    Grow a square csr matrix with empty rows and columns without copying its data and indices.
+    """
+    if matrix.shape[0] >= size:
+        return matrix
+    indptr = np.concatenate((matrix.indptr, np.full(size - matrix.shape[0], matrix.indptr[-1],
+                                                    dtype=matrix.indptr.dtype)))
+    padded = sp.csr_matrix((matrix.data, matrix.indices, indptr), shape=(size, size), copy=False)
+    padded.has_sorted_indices = matrix.has_sorted_indices
+    return padded
@@ -4,7 +4,6 @@ import pandas as pd
 from .. import config
 from . import mapping_utils as mu
 from .mapper import Mapper
-from biothings_client import get_client
 import gseapy
 
 
@@ -25,9 +24,9 @@ def get_gene_mapping(gene_set: set, id_type: str, mapper: Mapper):
                                                           key='gene_ids')
     # ===== Get mapping for missing values =====
     if len(missing_hits) > 0:
-        mg = get_client("gene")
-        mapping = mg.querymany(missing_hits, scopes=config.ID_TYPE_KEY[id_type], fields=','.join(config.GENE_IDS),
-                               species='human', returnall=False, as_dataframe=True, df_index=False)
+        mapping = mapper.lookup_cache.query(client_type="gene", method="querymany", queries=missing_hits,
+                                            scopes=config.ID_TYPE_KEY[id_type], fields=','.join(config.GENE_IDS),
+                                            species='human')
         if 'notfound' in mapping:
             mapping = mapping[mapping['notfound'] != True]
         # ===== Only when missing values found a mapping =====
@@ -77,24 +76,24 @@ def get_gene_to_attributes(gene_set: set, id_type: str, mapper: Mapper):
                                                           key='gene_atts')
     # ===== Get mapping for missing values =====
     if len(missing_hits) > 0:
-        mg = get_client("gene")
-        mapping = mg.querymany(missing_hits, scopes=','.join(config.GENE_IDS),
-                               fields=','.join(config.GENE_ATTRIBUTES),
-                               species='human', returnall=False, as_dataframe=True, df_index=False)
-        mapping.rename(columns={'query': 'entrezgene'}, inplace=True)
-        if 'notfound' in mapping:
-            mapping = mapping[mapping['notfound'] != True]
-        if not mapping.empty:
-            for attribute in config.GENE_ATTRIBUTES_KEY:
-                mapping = mu.preprocess_results(mapping=mapping, multicol=attribute,
-                                                singlecol=attribute + '.' + config.GENE_ATTRIBUTES_KEY[attribute],
-                                                key=config.GENE_ATTRIBUTES_KEY[attribute])
-            drop_cols = ['_id', '_score', 'notfound'] if 'notfound' in mapping.columns else ['_id', '_score']
-            mapping = mapping.drop(columns=drop_cols)
-            mapping[mapping.columns[1:]] = mapping[mapping.columns[1:]].fillna('').applymap(mu.combine_rows_to_set)
-            # ===== Add results from missing values =====
-            mapper.update_mappings(in_df=mapping, key='gene_atts')
-            hit_mapping = pd.concat([hit_mapping, mapping])
+        # ===== Add the results of every chunk as soon as it was fetched =====
+        for mapping in mapper.lookup_cache.iter_query(client_type="gene", method="querymany", queries=missing_hits,
+                                                      scopes=','.join(config.GENE_IDS),
+                                                      fields=','.join(config.GENE_ATTRIBUTES), species='human'):
+            mapping.rename(columns={'query': 'entrezgene'}, inplace=True)
+            if 'notfound' in mapping:
+                mapping = mapping[mapping['notfound'] != True]
+            if not mapping.empty:
+                for attribute in config.GENE_ATTRIBUTES_KEY:
+                    mapping = mu.preprocess_results(mapping=mapping, multicol=attribute,
+                                                    singlecol=attribute + '.' + config.GENE_ATTRIBUTES_KEY[attribute],
+                                                    key=config.GENE_ATTRIBUTES_KEY[attribute])
+                drop_cols = ['_id', '_score', 'notfound'] if 'notfound' in mapping.columns else ['_id', '_score']
+                mapping = mapping.drop(columns=drop_cols)
+                mapping[mapping.columns[1:]] = mapping[mapping.columns[1:]].fillna('').applymap(mu.combine_rows_to_set)
+                # ===== Add results from missing values =====
+                mapper.update_mappings(in_df=mapping, key='gene_atts')
+                hit_mapping = pd.concat([hit_mapping, mapping])
     # ===== work with not unique values =====
     hit_mapping = mu.map_to_prev_id(main_id_type="entrezgene", id_type=config.ID_TYPE_KEY[id_type],
                                     id_mapping=gene_mapping, att_mapping=hit_mapping)
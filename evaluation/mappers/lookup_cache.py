@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+
+import json
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+from .. import config
+from .biothings_fetcher import BiothingsFetcher
+
+
+class LookupCache:
+    """
+    Persistent cache of myGene.info and myDisease.info lookups in a SQLite file. The hits of every
+    query are saved per request, ids without hits are saved as well, so unknown ids are not queried
+    again on every run. Entries expire after their time to live and are queried again then.
+    """
+
+    def __init__(self, file: str = None, ttl: float = config.LOOKUP_TTL,
+                 negative_ttl: float = config.LOOKUP_NEGATIVE_TTL, fetcher: BiothingsFetcher = None):
+        """
+        :param file: path to the SQLite file, without file nothing is cached [Default=None]
+        :param ttl: seconds until a query with hits is queried again [Default=config.LOOKUP_TTL]
+        :param negative_ttl: seconds until a query without hits is queried again [Default=config.LOOKUP_NEGATIVE_TTL]
+        :param fetcher: fetcher running the lookups missing in the cache [Default=BiothingsFetcher()]
+        """
+        self.file = file
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.fetcher = BiothingsFetcher() if fetcher is None else fetcher
+
+    def query(self, client_type: str, method: str, queries, **kwargs) -> pd.DataFrame:
+        """
+        Run a method of the biothings client, e.g. querymany or getdiseases, only for the queries
+        without valid cache entry and combine the result with the cached hits.
+
+        :param client_type: type of the biothings client, either "gene" or "disease"
+        :param method: name of the client method taking the list of queries as first argument
+        :param queries: queries for the method, e.g. ids
+        :param kwargs: further arguments of the method like scopes or fields, part of the cache key
+        :return: hits of all queries as dataframe like as_dataframe=True with df_index=False would return,
+        in order of the queries
+        """
+        hits = pd.concat(list(self.iter_query(client_type=client_type, method=method, queries=queries, **kwargs)),
+                         ignore_index=True)
+        if 'query' not in hits:
+            return hits
+        # ===== chunks arrive in order of completion, restore the order of the queries =====
+        order = pd.Index(list(dict.fromkeys(str(query) for query in queries)), dtype=object).get_indexer(
+            hits['query'].astype(str))
+        return hits.iloc[np.argsort(order, kind='stable')].reset_index(drop=True)
+
+    def iter_query(self, client_type: str, method: str, queries, **kwargs):
+        """
+        Like query, but yield the cached hits first and then the hits of every fetched chunk as soon
+        as it arrived, so they can be processed while the remaining chunks are still fetched.
+
+        :param client_type: type of the biothings client, either "gene" or "disease"
+        :param method: name of the client method taking the list of queries as first argument
+        :param queries: queries for the method, e.g. ids
+        :param kwargs: further arguments of the method like scopes or fields, part of the cache key
+        :return: generator of dataframes with the hits of a part of the queries, at least one
+        """
+        queries = list(dict.fromkeys(str(query) for query in queries))
+        request = json.dumps({'client': client_type, 'method': method, **kwargs}, sort_keys=True)
+        hits = self._get_cached(request=request, queries=queries)
+        missing = [query for query in queries if query not in hits]
+        if len(hits) > 0 or len(missing) == 0:
+            yield _to_dataframe(queries=[query for query in queries if query in hits], hits=hits)
+        for chunk, results in self.fetcher.fetch(client_type=client_type, method=method, queries=missing, **kwargs):
+            fetched = {query: [] for query in chunk}
+            for hit in results:
+                if not hit.get('notfound', False):
+                    fetched.setdefault(str(hit['query']), []).append(hit)
+            self._set_cached(request=request, hits=fetched)
+            yield _to_dataframe(queries=chunk, hits=fetched)
+
+    @contextmanager
+    def _connect(self):
+        # ===== one connection per call, so the cache can be used from any thread or process =====
+        connection = sqlite3.connect(self.file, timeout=30)
+        try:
+            with connection:  # commits on success
+                connection.execute("CREATE TABLE IF NOT EXISTS lookups (request TEXT, query TEXT, hits TEXT, "
+                                   "found INTEGER, time REAL, PRIMARY KEY (request, query))")
+                yield connection
+        finally:
+            connection.close()
+
+    def _get_cached(self, request: str, queries: list) -> dict:
+        """
+        Get the valid cache entries of the queries.
+
+        :param request: key of the client method and its arguments
+        :param queries: queries to look up
+        :return: dict with query as key and list of its hits as value, empty for cached queries without hits
+        """
+        if self.file is None or len(queries) == 0:
+            return dict()
+        now, cached = time.time(), dict()
+        try:
+            with self._connect() as connection:
+                for start in range(0, len(queries), 500):  # stay below the maximum number of sql variables
+                    chunk = queries[start:start + 500]
+                    rows = connection.execute("SELECT query, hits, found, time FROM lookups WHERE request = ? AND "
+                                              "query IN (" + ",".join("?" * len(chunk)) + ")", [request] + chunk)
+                    for query, hits, found, saved in rows:
+                        if now - saved < (self.ttl if found else self.negative_ttl):
+                            cached[query] = json.loads(hits)
+        except sqlite3.Error:  # cache not usable, query everything
+            return dict()
+        return cached
+
+    def _set_cached(self, request: str, hits: dict):
+        if self.file is None or len(hits) == 0:
+            return
+        now = time.time()
+        try:
+            with self._connect() as connection:
+                connection.executemany("INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?, ?)",
+                                       [(request, query, json.dumps(query_hits), int(len(query_hits) > 0), now)
+                                        for query, query_hits in hits.items()])
+        except sqlite3.Error:
+            pass
+
+    def clear(self, expired_only: bool = True):
+        """
+        Remove entries from the cache.
+
+        :param expired_only: bool if only entries past their time to live should be removed [Default=True]
+        """
+        if self.file is None:
+            return
+        with self._connect() as connection:
+            if expired_only:
+                now = time.time()
+                connection.execute("DELETE FROM lookups WHERE (found = 1 AND time < ?) OR (found = 0 AND time < ?)",
+                                   (now - self.ttl, now - self.negative_ttl))
+            else:
+                connection.execute("DELETE FROM lookups")
+
+
+def _to_dataframe(queries: list, hits: dict) -> pd.DataFrame:
+    return pd.json_normalize([hit for query in queries for hit in hits[query]] +
+                             [{'query': query, 'notfound': True} for query in queries if len(hits[query]) == 0])
@@ -5,39 +5,297 @@ import numpy as np
 from pathlib import Path
 from abc import abstractmethod
 from .. import config
-from . import mapping_utils as mu
+from . import mapping_utils as mu, store_utils as su
+from .columnar_mapping import ColumnarMapping, InvertedIndex
+from .distance_matrix import DistanceMatrix
+from .lookup_cache import LookupCache
 import scipy.sparse as sp
 import pickle
 import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from types import MappingProxyType
+
+
+MAPPING_KEYS = ['gene_ids', 'gene_atts', 'disorder_ids', 'disorder_atts']
+ATTRIBUTE_KEYS = ['gene_atts', 'disorder_atts']
+DISTANCE_KEYS = ['go_BP', 'go_CC', 'go_MF', 'pathway_kegg', 'related_genes', 'related_variants', 'related_pathways']
+
+
+class MappingCache(dict):
+    """
+    Loaded mappings as dataframe per key. Mappings loaded as columnar mapping are only decoded
+    into dataframes with one set per cell when they are accessed as dataframe. The cache is
+    read-only, changed mappings are set on a copy by replace. The lazy decode and encode of a
+    mapping run under a lock of the cache, so every mapping is converted once per snapshot.
+    """
+
+    def __init__(self, keys, frames: dict = None, columnar: dict = None):
+        super().__init__(frames if frames is not None else {key: pd.DataFrame() for key in keys})
+        self.columnar = columnar if columnar is not None else {key: None for key in keys}
+        self._lock = threading.RLock()
+
+    def __getitem__(self, key) -> pd.DataFrame:
+        mapping = super().__getitem__(key)
+        if mapping is None:
+            with self._lock:
+                mapping = super().__getitem__(key)
+                if mapping is None:  # not decoded by another thread while waiting
+                    mapping = self.columnar[key].to_frame().reset_index(drop=True)
+                    super().__setitem__(key, mapping)
+        return mapping
+
+    def __setitem__(self, key, mapping):
+        raise TypeError("Loaded mappings are read-only, use Mapper.update_mappings or Mapper.set_loaded_mapping.")
+
+    def get_columnar(self, key) -> ColumnarMapping:
+        if self.columnar[key] is None:
+            with self._lock:
+                if self.columnar[key] is None:  # not encoded by another thread while waiting
+                    self.columnar[key] = ColumnarMapping.from_frame(self[key])
+        return self.columnar[key]
+
+    def replace(self, key, mapping: pd.DataFrame = None, columnar: ColumnarMapping = None):
+        """
+        Copy the cache with one mapping replaced, either by a dataframe or by a columnar mapping.
 
+        :param key: name of the mapping
+        :param mapping: new mapping as dataframe [Default=None]
+        :param columnar: new mapping as columnar mapping [Default=None]
+        :return: new cache sharing all other mappings
+        """
+        frames, columns = {name: dict.__getitem__(self, name) for name in self}, dict(self.columnar)
+        frames[key], columns[key] = (None, columnar) if columnar is not None else (mapping, None)
+        return MappingCache(keys=list(self), frames=frames, columnar=columns)
+
+    def __reduce__(self):
+        # ===== pickled for worker processes without the lock, as read-only cache it cannot be filled item-wise =====
+        return MappingCache, (list(self), {name: dict.__getitem__(self, name) for name in self}, dict(self.columnar))
+
+
+class MapperState:
+    """
+    Snapshot of the loaded mappings, distance ids and distance matrices. A snapshot is never changed,
+    every write creates a new one sharing all unchanged entries, so any number of threads can read a
+    snapshot without locking. Distance matrices are kept as DistanceMatrix, the ones not loaded yet are None.
+    """
+
+    def __init__(self, mappings: MappingCache, distance_ids: dict, distances: dict):
+        self.mappings = mappings
+        # ===== row index of every id inside the distance matrices, shared by all distance measures =====
+        self.distance_ids = MappingProxyType(dict(distance_ids))
+        self.distances = MappingProxyType({distance_measure: MappingProxyType(dict(matrices))
+                                           for distance_measure, matrices in distances.items()})
+
+    def __reduce__(self):
+        distances = {distance_measure: dict(matrices) for distance_measure, matrices in self.distances.items()}
+        return MapperState, (self.mappings, dict(self.distance_ids), distances)
+
+    @classmethod
+    def empty(cls):
+        return cls(mappings=MappingCache(keys=MAPPING_KEYS),
+                   distance_ids={'gene_mat_ids': pd.Index([], dtype=object),
+                                 'disease_mat_ids': pd.Index([], dtype=object)},
+                   distances={distance_measure: {key: None for key in DISTANCE_KEYS}
+                              for distance_measure in ['jaccard', 'overlap']})
+
+    def replace(self, mappings: MappingCache = None, distance_ids: dict = None, distances: dict = None):
+        """
+        Create a new snapshot with the given entries replaced.
 
-class Mapper:
-    loaded_mappings = {'gene_ids': pd.DataFrame(), 'gene_atts': pd.DataFrame(), 'disorder_ids': pd.DataFrame(),
-                       'disorder_atts': pd.DataFrame()}
-
-    loaded_distance_ids = {'jaccard': {'gene_mat_ids': dict(), 'disease_mat_ids': dict()},
-                           'overlap': {'gene_mat_ids': dict(), 'disease_mat_ids': dict()}}
-    loaded_distances = {
-        'jaccard': {'go_BP': sp.csr_matrix([0]), 'go_CC': sp.csr_matrix([0]), 'go_MF': sp.csr_matrix([0]),
-                    'pathway_kegg': sp.csr_matrix([0]), 'related_genes': sp.csr_matrix([0]),
-                    'related_variants': sp.csr_matrix([0]), 'related_pathways': sp.csr_matrix([0])},
-        'overlap': {'go_BP': sp.csr_matrix([0]), 'go_CC': sp.csr_matrix([0]), 'go_MF': sp.csr_matrix([0]),
-                    'pathway_kegg': sp.csr_matrix([0]), 'related_genes': sp.csr_matrix([0]),
-                    'related_variants': sp.csr_matrix([0]), 'related_pathways': sp.csr_matrix([0])}}
+        :param mappings: new loaded mappings [Default=None]
+        :param distance_ids: dict with the new distance ids by key [Default=None]
+        :param distances: dict with the new distance matrices by key by distance measure [Default=None]
+        :return: new snapshot
+        """
+        matrices = {distance_measure: dict(self.distances[distance_measure]) for distance_measure in self.distances}
+        for distance_measure, changed in (distances or dict()).items():
+            matrices[distance_measure].update(changed)
+        return MapperState(mappings=self.mappings if mappings is None else mappings,
+                           distance_ids={**self.distance_ids, **(distance_ids or dict())}, distances=matrices)
 
-    changed_mappings = set()
 
-    load: bool = True
+class Mapper:
 
-    def __init__(self, preload: bool = False):
+    def __init__(self, preload: bool = False, distance_budget: int = config.DISTANCE_BUDGET,
+                 lookup_cache: LookupCache = None):
+        """
+        :param preload: bool if the mappings and distance ids should be loaded once up front instead of
+        per request, distance matrices are always loaded on their first use [Default=False]
+        :param distance_budget: bytes the loaded distance matrices may use before the least recently used
+        ones are dropped again, None for no limit [Default=config.DISTANCE_BUDGET]
+        :param lookup_cache: cache of myGene.info and myDisease.info lookups for ids missing in the mappings,
+        a new LookupCache with the default settings if None [Default=None]
+        """
+        self.changed_mappings = set()
+        self.lookup_cache = LookupCache() if lookup_cache is None else lookup_cache
+        self.load = True
+        self._state = MapperState.empty()
+        # ===== copy-on-write overlay of the thread currently writing =====
+        self._lock = threading.RLock()
+        self._overlay, self._writer = None, None
+        # ===== loaded distance matrices by (distance measure, key) in order of use with their size =====
+        self.distance_budget = distance_budget
+        self._distance_usage = OrderedDict()
+        self._usage_lock = threading.Lock()
         if preload:
             self.load_mappings()
             self.load_distances(set_type="entrez", distance_measure="jaccard")
             self.load_distances(set_type="mondo", distance_measure="jaccard")
-            self.load_distances(set_type="entrez", distance_measure="overlap")
-            self.load_distances(set_type="mondo", distance_measure="overlap")
             self.load = False
 
+    def __getstate__(self):
+        """
+        Pickle the current snapshot without locks, e.g. for worker processes started by spawn or forkserver.
+        """
+        state = dict(self.__dict__)
+        state['_state'] = self.state
+        for name in ['_lock', '_usage_lock', '_overlay', '_writer']:
+            state.pop(name)
+        state['_distance_usage'] = OrderedDict(self._distance_usage)
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._lock, self._usage_lock = threading.RLock(), threading.Lock()
+        self._overlay, self._writer = None, None
+
+    @property
+    def state(self) -> MapperState:
+        """
+        Current snapshot, the thread inside write sees its own overlay instead.
+        """
+        if self._writer == threading.get_ident():
+            return self._overlay
+        return self._state
+
+    @property
+    def loaded_mappings(self) -> MappingCache:
+        return self.state.mappings
+
+    @property
+    def loaded_distance_ids(self) -> MappingProxyType:
+        return self.state.distance_ids
+
+    @property
+    def loaded_distances(self) -> MappingProxyType:
+        return self.state.distances
+
+    @contextmanager
+    def write(self):
+        """
+        Collect all writes inside the context in a copy-on-write overlay of the current snapshot, which
+        only the writing thread sees, and publish them together as new snapshot when the context is left.
+        Writers wait for each other, readers never wait and keep the snapshot they started with. Writes
+        of a context left by an exception are discarded.
+        """
+        with self._lock:
+            if self._writer == threading.get_ident():  # nested inside a write of the same thread
+                yield
+                return
+            self._overlay, self._writer = self._state, threading.get_ident()
+            try:
+                yield
+                self._state = self._overlay
+            finally:
+                self._overlay, self._writer = None, None
+
+    def _update_state(self, **changes):
+        with self.write():
+            self._overlay = self._overlay.replace(**changes)
+
+    def set_loaded_mapping(self, key: str, mapping: pd.DataFrame = None, columnar: ColumnarMapping = None):
+        """
+        Set a loaded mapping without marking it as changed, either as dataframe or as columnar mapping.
+
+        :param key: name of the mapping
+        :param mapping: mapping as dataframe [Default=None]
+        :param columnar: mapping as columnar mapping [Default=None]
+        """
+        with self.write():
+            self._update_state(mappings=self.loaded_mappings.replace(key=key, mapping=mapping, columnar=columnar))
+
+    def set_loaded_distance_ids(self, key: str, index: pd.Index):
+        """
+        Set loaded distance ids without marking them as changed.
+
+        :param key: name of the distance ids, either gene_mat_ids or disease_mat_ids
+        :param index: index with the row of each id inside the distance matrices
+        """
+        self._update_state(distance_ids={key: index})
+
+    def set_loaded_distances(self, key: str, distance_measure: str, matrix):
+        """
+        Set a loaded distance matrix without marking it as changed. Least recently used matrices
+        are dropped if the distance budget is exceeded afterwards.
+
+        :param key: name of the distance matrix
+        :param distance_measure: distance measure of the matrix
+        :param matrix: distance matrix as sparse matrix or DistanceMatrix, None to drop it
+        """
+        if matrix is not None and not isinstance(matrix, DistanceMatrix):
+            matrix = DistanceMatrix(base=matrix.tocsr())
+        with self.write():
+            self._update_state(distances={distance_measure: {key: matrix}})
+            with self._usage_lock:
+                self._distance_usage.pop((distance_measure, key), None)
+                if matrix is not None:
+                    self._distance_usage[(distance_measure, key)] = matrix.nbytes
+            self._evict_distances(keep=(distance_measure, key))
+
+    def _evict_distances(self, keep: tuple):
+        if self.distance_budget is None:
+            return
+        with self._usage_lock:
+            candidates = [loaded for loaded in self._distance_usage if loaded != keep and
+                          loaded[0] + "_" + loaded[1] not in self.changed_mappings]  # changed ones are not on disk
+            evicted, used = [], sum(self._distance_usage.values())
+            for loaded in candidates:
+                if used <= self.distance_budget:
+                    break
+                used -= self._distance_usage.pop(loaded)
+                evicted.append(loaded)
+        if evicted:
+            distances = dict()
+            for distance_measure, key in evicted:
+                distances.setdefault(distance_measure, dict())[key] = None
+            self._update_state(distances=distances)
+
+    def get_distance_matrix(self, key: str, distance_measure: str) -> DistanceMatrix:
+        """
+        Get a distance matrix, which is loaded on its first use.
+
+        :param key: name of the distance matrix
+        :param distance_measure: distance measure of the matrix
+        :return: distance matrix
+        """
+        matrix = self.state.distances[distance_measure][key]
+        if matrix is None:
+            with self.write():
+                if self.state.distances[distance_measure][key] is None:  # not loaded by another thread meanwhile
+                    self.set_loaded_distances(key=key, distance_measure=distance_measure,
+                                              matrix=self.load_distance_matrix(key=key,
+                                                                               distance_measure=distance_measure))
+                matrix = self.state.distances[distance_measure][key]
+        self._touch_distances(key=key, distance_measure=distance_measure)
+        return matrix
+
+    def _touch_distances(self, key: str, distance_measure: str):
+        with self._usage_lock:
+            if (distance_measure, key) in self._distance_usage:
+                self._distance_usage.move_to_end((distance_measure, key))
+
+    def load_distance_matrix(self, key: str, distance_measure: str) -> sp.csr_matrix:
+        """
+        Load a single distance matrix from where the mapper keeps them.
+
+        :param key: name of the distance matrix
+        :param distance_measure: distance measure of the matrix
+        :return: distance matrix, empty if there is none
+        """
+        return sp.csr_matrix([0])
+
     @abstractmethod
     def load_mappings(self):
         pass
@@ -51,21 +309,82 @@ class Mapper:
         pass
 
     def get_loaded_mapping(self, in_set, id_type: str, key: str):
-        if not self.loaded_mappings[key].empty:
-            current_mapping = self.loaded_mappings[key].copy()
+        current_mapping = self.get_columnar_mapping(key=key)
+        if len(current_mapping) > 0:
+            # ===== look up rows in the exploded lookup of the id type, only decode the rows with a hit =====
+            rows, hits = current_mapping.find(column=id_type, values=in_set)
+            hit_mapping = current_mapping.to_frame(rows=rows)
             if id_type not in ['entrezgene', 'mondo']:
-                current_mapping = current_mapping.explode(id_type)
-            hit_mapping = current_mapping.loc[current_mapping[id_type].isin(in_set)]
+                hit_mapping[id_type] = hits
             if not hit_mapping.empty:
                 return hit_mapping, set(in_set) - set(hit_mapping[id_type])
         return pd.DataFrame(), in_set
 
+    def get_columnar_mapping(self, key: str) -> ColumnarMapping:
+        """
+        Get a loaded mapping with the values of every column as term codes per row instead of sets.
+
+        :param key: name of the mapping
+        :return: columnar mapping
+        """
+        return self.loaded_mappings.get_columnar(key)
+
+    def get_attribute_matrix(self, key: str, attribute: str):
+        """
+        Get the values of an attribute of a loaded mapping as sparse incidence matrix with one row
+        per row of the mapping.
+
+        :param key: name of the attribute mapping
+        :param attribute: attribute to get the values of
+        :return: incidence sparse matrix and the attribute value of each column as index
+        """
+        return self.get_columnar_mapping(key=key).get_matrix(column=attribute)
+
+    def get_inverted_index(self, key: str, attribute: str) -> InvertedIndex:
+        """
+        Get the inverted index of an attribute of a loaded mapping with the rows of the mapping
+        carrying each attribute value as entities.
+
+        :param key: name of the mapping
+        :param attribute: attribute or id column to get the index of
+        :return: inverted index
+        """
+        return self.get_columnar_mapping(key=key).get_index(column=attribute)
+
+    def encode_attribute(self, key: str, attribute: str, att_series: pd.Series):
+        """
+        Encode sets of attribute values with the term codes of a loaded mapping, so they share
+        the columns of the incidence matrix from get_attribute_matrix.
+
+        :param key: name of the attribute mapping
+        :param attribute: attribute of the values
+        :param att_series: series with sets of attribute values
+        :return: incidence sparse matrix and the attribute value of each column as index
+        """
+        return self.get_columnar_mapping(key=key).encode(column=attribute, values=att_series)
+
     def update_mappings(self, in_df: pd.DataFrame(), key: str):
-        self.changed_mappings.add(key)
-        if not self.loaded_mappings[key].empty:
-            self.loaded_mappings[key] = pd.concat([self.loaded_mappings[key], in_df], ignore_index=True)
-        else:
-            self.loaded_mappings[key] = in_df
+        """
+        Append rows to a loaded mapping and mark it as changed. Attribute mappings keep one row per id, as
+        their rows are the rows of the distance matrices: rows of ids that are already loaded, e.g. fetched
+        by another thread at the same time, and repeated ids are dropped, the first row of an id is kept.
+
+        :param in_df: rows to append with the id in the first column
+        :param key: name of the mapping
+        """
+        with self.write():
+            if key in ATTRIBUTE_KEYS and not in_df.empty:
+                in_ids = in_df[in_df.columns[0]].fillna('').astype(str)
+                loaded_ids = pd.Index(self.get_columnar_mapping(key=key).ids, dtype=object)
+                in_df = in_df[~in_ids.duplicated().to_numpy() & ~in_ids.isin(loaded_ids).to_numpy()]
+                if in_df.empty:
+                    return
+            self.changed_mappings.add(key)
+            if len(self.get_columnar_mapping(key=key)) > 0:
+                self.set_loaded_mapping(key=key, columnar=self.get_columnar_mapping(key=key).concat(
+                    ColumnarMapping.from_frame(in_df)))
+            else:
+                self.set_loaded_mapping(key=key, mapping=in_df)
 
     def get_loaded_mapping_ids(self, in_ids, id_type: str) -> pd.DataFrame:
         if id_type in config.SUPPORTED_GENE_IDS:
@@ -75,56 +394,82 @@ class Mapper:
             mapping, _ = self.get_loaded_mapping(in_set=in_ids, id_type=config.ID_TYPE_KEY[id_type], key="disorder_ids")
             return mapping
 
-    def update_distance_ids(self, in_series: pd.Series, key: str, distance_measure: str) -> pd.Series:
-        self.changed_mappings.add(distance_measure + "_" + key)
-        if self.loaded_distance_ids[distance_measure][key]:  # is not empty
-            if len(self.loaded_distance_ids[distance_measure][key].keys()) < len(in_series):
-                new_ids = in_series[len(self.loaded_distance_ids[distance_measure][key].keys()):]
-                for index, value in enumerate(iterable=new_ids,
-                                              start=len(self.loaded_distance_ids[distance_measure][key].keys())):
-                    self.loaded_distance_ids[distance_measure][key][value] = index
-                return new_ids
+    def update_distance_ids(self, in_series: pd.Series, key: str) -> pd.Series:
+        with self.write():
+            self.changed_mappings.add(key)
+            if len(self.loaded_distance_ids[key]) > 0:  # is not empty
+                if len(self.loaded_distance_ids[key]) < len(in_series):
+                    new_ids = in_series[len(self.loaded_distance_ids[key]):]
+                    self.set_loaded_distance_ids(key=key, index=self.loaded_distance_ids[key].append(
+                        pd.Index(new_ids, dtype=object)))
+                    return new_ids
+                else:
+                    return pd.Series([],dtype=pd.StringDtype())
             else:
-                return pd.Series([],dtype=pd.StringDtype())
-        else:
-            for index, value in enumerate(iterable=in_series, start=0):
-                self.loaded_distance_ids[distance_measure][key][value] = index
-            return in_series
+                self.set_loaded_distance_ids(key=key, index=pd.Index(in_series, dtype=object))
+                return in_series
+
+    def get_distance_indices(self, in_series: pd.Series, id_type: str) -> np.ndarray:
+        """
+        Get the row indices of the given ids inside the distance matrices.
+
+        :param in_series: ids to look up
+        :param id_type: key of the distance ids, either gene_mat_ids or disease_mat_ids
+        :return: array with row index of each id or -1 if the id has no distances
+        """
+        return _get_first_indexer(index=self.loaded_distance_ids[id_type], values=in_series)
 
     def get_loaded_distances(self, in_series: pd.Series, id_type: str, key: str, distance_measure: str,
                              to_series: pd.Series = None) -> sp.csr_matrix:
-        if self.loaded_distance_ids[distance_measure][id_type]:  # is not empty
-            indices = list()
-            for element in in_series:
-                indices.append(self.loaded_distance_ids[distance_measure][id_type][element])
+        state = self.state  # ids and matrix from the same snapshot
+        if len(state.distance_ids[id_type]) > 0:  # is not empty
+            indices = _get_first_indexer(index=state.distance_ids[id_type], values=in_series)
             if to_series is not None:
-                to_indices = list()
-                for element in to_series:
-                    to_indices.append(self.loaded_distance_ids[distance_measure][id_type][element])
-                return self.loaded_distances[distance_measure][key][indices, :][:, to_indices]
+                to_indices = _get_first_indexer(index=state.distance_ids[id_type], values=to_series)
+                self._check_distance_indices(in_series=to_series, indices=to_indices)
+                self._check_distance_indices(in_series=in_series, indices=indices)
+                return self._get_snapshot_distances(state, key, distance_measure).select(rows=indices,
+                                                                                         cols=to_indices)
             else:
-                return self.loaded_distances[distance_measure][key][indices, :][:, indices]
+                self._check_distance_indices(in_series=in_series, indices=indices)
+                return self._get_snapshot_distances(state, key, distance_measure).select(rows=indices, cols=indices)
         else:
             return sp.csr_matrix([0])
 
+    def _get_snapshot_distances(self, state: MapperState, key: str, distance_measure: str) -> DistanceMatrix:
+        if state.distances[distance_measure][key] is None:  # loaded after the snapshot was taken
+            return self.get_distance_matrix(key=key, distance_measure=distance_measure)
+        self._touch_distances(key=key, distance_measure=distance_measure)
+        return state.distances[distance_measure][key]
+
+    @staticmethod
+    def _check_distance_indices(in_series: pd.Series, indices: np.ndarray):
+        if (indices < 0).any():
+            raise KeyError(pd.Series(in_series)[indices < 0].iloc[0])
+
     def update_distances(self, in_mat: sp.coo_matrix, id_type: str, key: str, distance_measure: str):
-        self.changed_mappings.add(distance_measure + "_" + key)
-        if self.loaded_distances[distance_measure][key].nnz > 0:
-            old_mat = self.loaded_distances[distance_measure][key].tocoo()
-            row = np.concatenate((old_mat.row, in_mat.row), axis=None)
-            col = np.concatenate((old_mat.col, in_mat.col), axis=None)
-            data = np.concatenate((old_mat.data, in_mat.data), axis=None)
-            self.loaded_distances[distance_measure][key] = sp.csr_matrix((data, (row, col)), shape=(
-                len(self.loaded_distance_ids[distance_measure][id_type].keys()),
-                len(self.loaded_distance_ids[distance_measure][id_type].keys())))
-        else:
-            self.loaded_distances[distance_measure][key] = in_mat.tocsr()
+        with self.write():
+            self.changed_mappings.add(distance_measure + "_" + key)
+            # ===== only the delta of the matrix grows, its base stays as loaded until compacted =====
+            self.set_loaded_distances(key=key, distance_measure=distance_measure, matrix=self.get_distance_matrix(
+                key=key, distance_measure=distance_measure).append(in_mat=in_mat,
+                                                                   size=len(self.loaded_distance_ids[id_type])))
+
+    def compact_distances(self):
+        """
+        Merge the distances appended to the loaded distance matrices into their base matrices.
+        Queries are answered from base and delta until then, so this can also run in the background.
+        """
+        for distance_measure, matrices in self.loaded_distances.items():
+            for key, matrix in matrices.items():
+                if matrix is not None and matrix.delta is not None:
+                    compacted = matrix.compact()  # merged outside the lock, readers keep using the old matrix
+                    with self.write():
+                        if self.loaded_distances[distance_measure][key] is matrix:  # no distances added meanwhile
+                            self.set_loaded_distances(key=key, distance_measure=distance_measure, matrix=compacted)
 
     def get_full_set(self, id_type: str, mapping_name: str) -> pd.DataFrame:
-        current_mapping = self.loaded_mappings[mapping_name]
-        if id_type not in ['entrezgene', 'mondo']:
-            current_mapping = current_mapping.explode(id_type).fillna("")
-        return current_mapping
+        return self.get_columnar_mapping(key=mapping_name).explode(column=id_type)
 
     @abstractmethod
     def save_mappings(self):
@@ -143,8 +488,7 @@ class Mapper:
         pass
 
     def drop_mappings(self):
-        self.loaded_mappings = {'gene_ids': pd.DataFrame(), 'gene_atts': pd.DataFrame(), 'disorder_ids': pd.DataFrame(),
-                                'disorder_atts': pd.DataFrame()}
+        self._update_state(mappings=MappingCache(keys=MAPPING_KEYS))
 
 
 class FileMapper(Mapper):
@@ -162,17 +506,36 @@ class FileMapper(Mapper):
                   'related_variants': 'disease_dist_rel_variants.npz',
                   'related_pathways': 'disease_dist_rel_pathways.npz'}
 
-    def __init__(self, preload: bool = False, files_dir=config.FILES_DIR):
+    def __init__(self, preload: bool = False, files_dir=config.FILES_DIR,
+                 distance_budget: int = config.DISTANCE_BUDGET, lookup_cache: LookupCache = None):
         self.files_dir = files_dir
-        super().__init__(preload=preload)
+        super().__init__(preload=preload, distance_budget=distance_budget, lookup_cache=LookupCache(
+            file=os.path.join(files_dir, "lookup_cache.sqlite")) if lookup_cache is None else lookup_cache)
+
+    def __getstate__(self):
+        """
+        Pickle the current snapshot without the distance matrices saved unchanged in the files directory,
+        they are memory mapped again on their first use instead of being copied into the pickle.
+        """
+        state = super().__getstate__()
+        saved = {distance_measure: {key: None for key, matrix in matrices.items() if matrix is not None and
+                                    distance_measure + "_" + key not in self.changed_mappings}
+                 for distance_measure, matrices in state['_state'].distances.items()}
+        state['_state'] = state['_state'].replace(distances=saved)
+        state['_distance_usage'] = OrderedDict((loaded, size) for loaded, size in state['_distance_usage'].items()
+                                               if loaded[1] not in saved[loaded[0]])
+        return state
 
     def load_mappings(self):
         if self.load:
             for mapping_key in ['gene_atts', 'disorder_atts', 'gene_ids', 'disorder_ids']:
+                if ColumnarMapping.is_current(path=self.get_columnar_path(key=mapping_key),
+                                              source_file=os.path.join(self.files_dir, self.file_names[mapping_key])):
+                    self.set_loaded_mapping(key=mapping_key, columnar=ColumnarMapping.load(
+                        path=self.get_columnar_path(key=mapping_key)))
+                    continue
                 self.load_file(key=mapping_key, in_type='mapping')
-                self.loaded_mappings[mapping_key][self.loaded_mappings[mapping_key].columns[1:]] = \
-                    self.loaded_mappings[mapping_key][self.loaded_mappings[mapping_key].columns[1:]].fillna(
-                        '').applymap(mu.string_to_set)
+                self.save_columnar_mapping(key=mapping_key)
 
     def _load_file_mapping(self, file, sep, mapping_name):
         """
@@ -188,72 +551,171 @@ class FileMapper(Mapper):
         if mapping_name == "disorder_ids":
             icd_unstack = mu.split_and_expand_column(data=mapping, split_string=",", column_name="ICD-10")
             mapping = pd.concat([icd_unstack, mapping[mapping['ICD-10'] != '']])
+        mapping[mapping.columns[1:]] = mapping[mapping.columns[1:]].fillna('').applymap(mu.string_to_set)
         # ===== Save mapping to local dictionary =====
-        self.loaded_mappings[mapping_name] = mapping
+        self.set_loaded_mapping(key=mapping_name, mapping=mapping)
 
     def load_distances(self, set_type: str, distance_measure: str):
+        # ===== distance matrices themselves are loaded on their first use by get_distance_matrix =====
         if self.load:
             if set_type in config.SUPPORTED_GENE_IDS:
-                self.load_file(key='gene_mat_ids', in_type='gene_id', distance_measure=distance_measure)
-                for distance_key in ['go_BP', 'go_CC', 'go_MF', 'pathway_kegg']:
-                    self.load_file(key=distance_key, in_type='distance', distance_measure=distance_measure)
+                self.load_file(key='gene_mat_ids', in_type='distance_id', distance_measure=distance_measure)
             else:  # if set_type in config.SUPPORTED_DISEASE_IDS
                 self.load_file(key='disease_mat_ids', in_type='distance_id', distance_measure=distance_measure)
-                for distance_key in ['related_genes', 'related_variants', 'related_pathways']:
-                    self.load_file(key=distance_key, in_type='distance', distance_measure=distance_measure)
+
+    def load_distance_matrix(self, key: str, distance_measure: str) -> sp.csr_matrix:
+        if su.is_sparse_store(self.get_store_path(key=key, distance_measure=distance_measure)):
+            return su.load_sparse(self.get_store_path(key=key, distance_measure=distance_measure))
+        if Path(os.path.join(self.files_dir, distance_measure, self.file_names[key])).is_file():  # not yet converted
+            return sp.load_npz(os.path.join(self.files_dir, distance_measure, self.file_names[key])).tocsr()
+        return super().load_distance_matrix(key=key, distance_measure=distance_measure)
 
     def load_file(self, key: str, in_type: str, distance_measure: str = None):
         if in_type == "mapping":
             self._load_file_mapping(file=os.path.join(self.files_dir, self.file_names[key]), sep=",", mapping_name=key)
         elif in_type == "distance":
-            self.loaded_distances[distance_measure][key] = sp.load_npz(
-                os.path.join(self.files_dir, distance_measure, self.file_names[key])).tocsr()
-        else:  # in_type == "distance_id"
-            with open(os.path.join(self.files_dir, distance_measure, self.file_names[key]), 'rb') as f:
-                self.loaded_distance_ids[distance_measure][key] = pickle.load(f)
+            self.set_loaded_distances(key=key, distance_measure=distance_measure,
+                                      matrix=self.load_distance_matrix(key=key, distance_measure=distance_measure))
+        else:  # in_type == "distance_id", shared by all distance measures
+            if len(self.loaded_distance_ids[key]) > 0:  # already loaded
+                return
+            if Path(self.get_index_path(key=key)).is_file():
+                self.set_loaded_distance_ids(key=key, index=su.load_index(file=self.get_index_path(key=key)))
+            else:  # not yet converted
+                self.set_loaded_distance_ids(key=key, index=self._load_pickled_index(
+                    file=os.path.join(self.files_dir, distance_measure, self.file_names[key])))
+
+    @staticmethod
+    def _load_pickled_index(file) -> pd.Index:
+        with open(file, 'rb') as f:
+            id_to_index = pickle.load(f)
+        ids = np.empty(len(id_to_index), dtype=object)
+        ids[list(id_to_index.values())] = list(id_to_index.keys())
+        return pd.Index(ids, dtype=object)
 
     def save_mappings(self):
-        for mapping_key in ['gene_ids', 'disorder_ids']:
-            if not self.loaded_mappings[mapping_key].empty and mapping_key in self.changed_mappings:
-                self.save_file(in_object=self.loaded_mappings[mapping_key], key=mapping_key, in_type='mapping')
-        for mapping_key in ['gene_atts', 'disorder_atts']:
-            if not self.loaded_mappings[mapping_key].empty and mapping_key in self.changed_mappings:
-                df = self.loaded_mappings[mapping_key]
-                df[df.columns[1:]] = df[df.columns[1:]].fillna('').applymap(mu.set_to_string)
-                self.save_file(in_object=df, key=mapping_key, in_type='mapping')
+        for mapping_key in ['gene_ids', 'disorder_ids', 'gene_atts', 'disorder_atts']:
+            if len(self.get_columnar_mapping(key=mapping_key)) > 0 and mapping_key in self.changed_mappings:
+                self.save_file(in_object=self.get_columnar_mapping(key=mapping_key).to_frame(sep=';'),
+                               key=mapping_key, in_type='mapping')
+                self.save_columnar_mapping(key=mapping_key)
+
+    def save_columnar_mapping(self, key: str):
+        """
+        Save a loaded mapping as columnar mapping next to its file, so the next load does not need to
+        parse the file. Saving is skipped if the files directory is not writable.
+
+        :param key: name of the mapping
+        """
+        try:
+            self.get_columnar_mapping(key=key).save(path=self.get_columnar_path(key=key),
+                                                    source_file=os.path.join(self.files_dir, self.file_names[key]))
+        except OSError:
+            pass
 
     def save_distances(self):
+        self.compact_distances()
+        for distance_id_key in ['gene_mat_ids', 'disease_mat_ids']:
+            if distance_id_key in self.changed_mappings:
+                self.save_file(in_object=self.loaded_distance_ids[distance_id_key], key=distance_id_key,
+                               in_type='distance_id')
         for distance_measure in ['jaccard', 'overlap']:
-            os.system("mkdir -p " + os.path.join(self.files_dir, distance_measure))
-            for distance_id_key in ['gene_mat_ids', 'disease_mat_ids']:
-                if distance_measure + "_" + distance_id_key in self.changed_mappings:
-                    self.save_file(in_object=self.loaded_distance_ids[distance_measure][distance_id_key],
-                                   key=distance_id_key, distance_measure=distance_measure,
-                                   in_type='distance_id')
             for distance_key in ['go_BP', 'go_CC', 'go_MF', 'pathway_kegg', 'related_genes', 'related_variants',
                                  'related_pathways']:
                 if distance_measure + "_" + distance_key in self.changed_mappings:
-                    self.save_file(in_object=self.loaded_distances[distance_measure][distance_key], key=distance_key,
-                                   in_type='distance', distance_measure=distance_measure)
+                    self.save_file(in_object=self.get_distance_matrix(key=distance_key,
+                                                                      distance_measure=distance_measure).tocsr(),
+                                   key=distance_key, in_type='distance', distance_measure=distance_measure)
 
     def save_file(self, in_object, key: str, in_type: str, distance_measure: str = None):
         if in_type == "mapping":
-            if not self.loaded_mappings[key].empty:
+            if len(self.get_columnar_mapping(key=key)) > 0:
                 in_object.to_csv(os.path.join(self.files_dir, self.file_names[key]), index=False)
         elif in_type == "distance":
-            if self.loaded_distances[distance_measure][key].nnz > 0:
-                sp.save_npz(os.path.join(self.files_dir, distance_measure, self.file_names[key]), in_object.tocoo())
+            if in_object.nnz > 0:
+                su.save_sparse(matrix=in_object, path=self.get_store_path(key=key, distance_measure=distance_measure))
+                if os.path.isfile(os.path.join(self.files_dir, distance_measure, self.file_names[key])):
+                    os.remove(os.path.join(self.files_dir, distance_measure, self.file_names[key]))
         else:  # in_type == "distance_id"
-            if self.loaded_distance_ids[distance_measure][key]:
-                with open(os.path.join(self.files_dir, distance_measure, self.file_names[key]), 'wb+') as f:
-                    pickle.dump(in_object, f)
+            if len(self.loaded_distance_ids[key]) > 0:
+                su.save_index(index=in_object, file=self.get_index_path(key=key))
 
     def check_for_setup_sources(self):
         for key in ['gene_atts', 'disorder_atts', 'gene_ids', 'disorder_ids']:
             if not Path(os.path.join(self.files_dir, self.file_names[key])).is_file():
                 raise Exception(self.file_names[key] + "does not exist. Please run setup.")
         for distance_measure in ['jaccard', 'overlap']:
-            for key in ['gene_mat_ids', 'disease_mat_ids', 'go_BP', 'go_CC', 'go_MF', 'pathway_kegg',
-                        'related_genes', 'related_variants', 'related_pathways']:
-                if not Path(os.path.join(self.files_dir, distance_measure, self.file_names[key])).is_file():
+            for key in ['gene_mat_ids', 'disease_mat_ids']:
+                if not Path(os.path.join(self.files_dir, distance_measure, self.file_names[key])).is_file() and \
+                        not Path(self.get_index_path(key=key)).is_file():
                     raise Exception(self.file_names[key] + "does not exist. Please run setup.")
+            for key in ['go_BP', 'go_CC', 'go_MF', 'pathway_kegg', 'related_genes', 'related_variants',
+                        'related_pathways']:
+                if not Path(os.path.join(self.files_dir, distance_measure, self.file_names[key])).is_file() and \
+                        not su.is_sparse_store(self.get_store_path(key=key, distance_measure=distance_measure)):
+                    raise Exception(self.file_names[key] + "does not exist. Please run setup.")
+
+    def get_columnar_path(self, key: str) -> str:
+        """
+        Get the directory of the columnar mapping saved next to a mapping file.
+
+        :param key: name of the mapping
+        :return: path to the directory
+        """
+        return os.path.join(self.files_dir, "columnar", os.path.splitext(self.file_names[key])[0])
+
+    def get_store_path(self, key: str, distance_measure: str) -> str:
+        """
+        Get the directory of the memory mappable store of a distance matrix.
+
+        :param key: name of the distance matrix
+        :param distance_measure: distance measure of the matrix
+        :return: path to the directory
+        """
+        return os.path.join(self.files_dir, distance_measure, os.path.splitext(self.file_names[key])[0])
+
+    def get_index_path(self, key: str) -> str:
+        """
+        Get the file of the row index of the distance matrices shared by all distance measures.
+
+        :param key: name of the distance ids, either gene_mat_ids or disease_mat_ids
+        :return: path to the file
+        """
+        return os.path.join(self.files_dir, os.path.splitext(self.file_names[key])[0] + ".npy")
+
+    def convert_distances(self):
+        """
+        Convert all distance matrices saved as .npz into memory mappable stores and
+        the pickled distance ids into one index per id type.
+        """
+        for key in ['gene_mat_ids', 'disease_mat_ids']:
+            pickle_files = [os.path.join(self.files_dir, distance_measure, self.file_names[key])
+                            for distance_measure in ['jaccard', 'overlap']]
+            pickle_files = [file for file in pickle_files if Path(file).is_file()]
+            if pickle_files:
+                su.save_index(index=self._load_pickled_index(file=pickle_files[0]), file=self.get_index_path(key=key))
+                for file in pickle_files:
+                    os.remove(file)
+        for distance_measure in ['jaccard', 'overlap']:
+            for key in ['go_BP', 'go_CC', 'go_MF', 'pathway_kegg', 'related_genes', 'related_variants',
+                        'related_pathways']:
+                npz_file = os.path.join(self.files_dir, distance_measure, self.file_names[key])
+                if Path(npz_file).is_file():
+                    su.convert_npz(npz_file=npz_file, path=self.get_store_path(key=key,
+                                                                               distance_measure=distance_measure))
+
+
+def _get_first_indexer(index: pd.Index, values) -> np.ndarray:
+    """
+    Get the position of every value in the index, of its first occurrence if the value is repeated.
+
+    :param index: index to look up the values in
+    :param values: values to look up
+    :return: array with position of each value or -1 if the value is missing
+    """
+    values = pd.Index(values, dtype=object)
+    if index.is_unique:
+        return index.get_indexer(values)
+    first = np.flatnonzero(~index.duplicated())
+    positions = index[first].get_indexer(values)
+    return np.where(positions >= 0, first[positions], -1)
@@ -2,7 +2,9 @@
 
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 from .. import config as c
+from .columnar_mapping import ColumnarMapping
 
 
 def preprocess_results(mapping: pd.DataFrame, multicol: str, singlecol: str, key: str):
@@ -117,7 +119,9 @@ def set_to_len(x: set):
 
 def map_to_prev_id(main_id_type: str, id_type: str, id_mapping: pd.DataFrame, att_mapping: pd.DataFrame):
     """
-    Map attribute mapping back to original id.
+    Map attribute mapping back to original id. The attribute mapping is first restricted to the main ids
+    of the id mapping, then the attribute values of all main ids of an original id are united with one
+    sparse product of the original id to attribute row assignment and the attribute term codes.
 
     :param main_id_type: main id type, here mondo for diseases or entrez for genes
     :param id_type: target id type of user input
@@ -125,36 +129,77 @@ def map_to_prev_id(main_id_type: str, id_type: str, id_mapping: pd.DataFrame, at
     :param att_mapping: full attribute mapping from terms to main id
     :return: return attribute mapping mapped to target id type
     """
-    if id_type not in ['entrezgene', 'mondo']:
-        id_mapping = id_mapping.explode(id_type)
-    attributes = c.DISEASE_ATTRIBUTES_KEY if main_id_type == "mondo" else c.GENE_ATTRIBUTES_KEY
-    columns = [main_id_type, id_type] if id_type != main_id_type else [main_id_type]
-    mapping_subset = id_mapping[columns].drop_duplicates()
-    hit_mapping = pd.merge(mapping_subset, att_mapping, on=[main_id_type], how='outer')
-    hit_mapping = hit_mapping.drop(columns=[main_id_type]) if id_type != main_id_type else hit_mapping
-    hit_mapping = hit_mapping.fillna('')
-    hit_mapping = hit_mapping[hit_mapping[id_type] != ""]
-    for col in attributes: # if attribute in cell is "" , it will be replaced with an empty set
-        hit_mapping[col] = hit_mapping[col].apply(lambda x: set() if x == "" else x)
-    hit_mapping = hit_mapping.groupby(id_type, as_index=False).agg(
-        {x: combine_rows_to_set for x in attributes})
-    return hit_mapping
-
-
-def transform_disgenet_mapping(mapping: pd.DataFrame, file: str, col_old, col_new):
+    attributes = list(c.DISEASE_ATTRIBUTES_KEY if main_id_type == "mondo" else c.GENE_ATTRIBUTES_KEY)
+    att_ids = att_mapping[main_id_type] if main_id_type in att_mapping else pd.Series([], dtype=object)
+    # ===== pairs of original id and main id =====
+    if id_type != main_id_type:
+        pairs = id_mapping[[main_id_type, id_type]].explode(id_type).drop_duplicates()
+        pairs = pairs[pairs[id_type].notna() & (pairs[id_type] != "")]
+        ids, main_ids = pairs[id_type].to_numpy(dtype=object), pairs[main_id_type].to_numpy(dtype=object)
+    else:  # outer merge keeps main ids of the attribute mapping as well
+        ids = pd.concat([id_mapping[main_id_type], att_ids]).dropna()
+        ids = main_ids = ids[ids != ""].unique().astype(object)
+    # ===== restrict attribute mapping to the main ids =====
+    att_mapping = att_mapping[att_ids.isin(main_ids)] if len(att_ids) > 0 else pd.DataFrame({main_id_type: []})
+    columnar = ColumnarMapping.from_frame(att_mapping[[main_id_type] + [x for x in attributes if x in att_mapping]])
+    group_codes, group_ids = pd.factorize(ids, sort=True)
+    # ===== assign the attribute rows of every main id to its original ids =====
+    pair_positions, rows = columnar.get_rows(column=main_id_type, values=pd.Index(main_ids, dtype=object).astype(str))
+    assignment = sp.csr_matrix((np.ones(len(rows), dtype=np.int32), (group_codes[pair_positions], rows)),
+                               shape=(len(group_ids), len(columnar)))
+    columns = dict()
+    for attribute in attributes:
+        if attribute in columnar.columns:
+            att_mat, terms = columnar.get_matrix(column=attribute)
+            united = (assignment @ att_mat).tocsr()
+            united.sort_indices()
+            columns[attribute] = {'indptr': united.indptr, 'indices': united.indices, 'terms': terms.to_numpy()}
+        else:
+            columns[attribute] = {'indptr': np.zeros(len(group_ids) + 1, dtype=np.int64),
+                                  'indices': np.array([], dtype=np.int32), 'terms': np.array([], dtype=object)}
+    return ColumnarMapping(id_column=id_type, ids=np.asarray(group_ids, dtype=object),
+                           columns=columns).to_frame().reset_index(drop=True)
+
+
+def transform_disgenet_mapping(mapping: pd.DataFrame, file: str, col_old, col_new,
+                               chunksize: int = c.DISGENET_CHUNK_SIZE):
     """
     Transform mapping from disgenet database to create one combined dataframe of attributes to mondo id.
+    The file is read in chunks, rows of disease ids without mondo id are dropped right away and the
+    attribute values of every chunk are only kept as integer codes per mondo id.
 
     :param mapping: disease id mapping from disgenet
     :param file: path to file with disease mapping from disgenet
     :param col_old: attribute column name in raw disgenet file
     :param col_new: desired new column name for col_old
+    :param chunksize: number of rows read at once, the whole file if None [Default=c.DISGENET_CHUNK_SIZE]
     :return: combined dataframe
     """
-    disease_mapping = pd.read_csv(file, compression='gzip', sep='\t', dtype=str)
-    df = pd.merge(mapping[['diseaseId', 'mondo']], disease_mapping[['diseaseId', col_old]],
-                  on="diseaseId", how="left")
-    df = df.rename(columns={col_old: col_new})
-    df[col_new] = df[col_new].str.strip()
-    df = df[['mondo', col_new]].fillna('').groupby(['mondo'], as_index=False).agg(combine_rowsets_series_to_set)
-    return df
+    mapping = mapping[['diseaseId', 'mondo']].dropna().drop_duplicates()
+    mondo_codes, mondo_ids = pd.factorize(mapping['mondo'], sort=True)
+    disease_to_mondo = pd.Series(mondo_codes, index=mapping['diseaseId'].to_numpy())
+    vocabulary, pairs = dict(), []
+    reader = pd.read_csv(file, compression='gzip', sep='\t', dtype=str, usecols=['diseaseId', col_old],
+                         chunksize=chunksize)
+    for chunk in ([reader] if chunksize is None else reader):
+        # ===== keep only rows of mapped disease ids and split the values =====
+        chunk = chunk[chunk['diseaseId'].isin(disease_to_mondo.index)].dropna()
+        values = chunk[col_old].str.strip().str.split(';')
+        chunk = pd.DataFrame({'diseaseId': chunk['diseaseId'], col_old: values}).explode(col_old)
+        chunk = chunk[chunk[col_old].notna() & (chunk[col_old] != '')]
+        if chunk.empty:
+            continue
+        # ===== encode values, new values are appended to the vocabulary =====
+        codes = chunk[col_old].map(vocabulary)
+        new_values = pd.unique(chunk[col_old][codes.isna()])
+        vocabulary.update(zip(new_values, range(len(vocabulary), len(vocabulary) + len(new_values))))
+        codes = chunk[col_old].map(vocabulary).to_numpy(dtype=np.int64)
+        chunk = pd.DataFrame({'diseaseId': chunk['diseaseId'].to_numpy(), 'code': codes}).merge(
+            disease_to_mondo.rename('mondo_code'), left_on='diseaseId', right_index=True)
+        pairs.append(np.unique(chunk['mondo_code'].to_numpy(dtype=np.int64) << 32 | chunk['code'].to_numpy()))
+    pairs = np.unique(np.concatenate(pairs)) if len(pairs) > 0 else np.array([], dtype=np.int64)
+    indptr = np.searchsorted(pairs >> 32, np.arange(len(mondo_ids) + 1))
+    columnar = ColumnarMapping(id_column='mondo', ids=np.asarray(mondo_ids, dtype=object), columns={
+        col_new: {'indptr': indptr, 'indices': (pairs & 0xFFFFFFFF).astype(np.int32),
+                  'terms': np.array(list(vocabulary), dtype=object)}})
+    return columnar.to_frame().reset_index(drop=True)
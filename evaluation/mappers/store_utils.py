@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+SPARSE_ARRAYS = ['indptr', 'indices', 'data', 'shape']
+
+
+def is_sparse_store(path: str) -> bool:
+    """
+    Check if path is a directory with all arrays of a sparse matrix saved by save_sparse.
+
+    :param path: directory of the sparse matrix
+    :return: true if all arrays exist
+    """
+    return all(os.path.isfile(os.path.join(path, name + ".npy")) for name in SPARSE_ARRAYS)
+
+
+def save_arrays(arrays: dict, path: str):
+    """
+    Save arrays as raw .npy files into a directory. Every array is written to a temporary
+    file first and then moved into place, so processes still having the previous files
+    memory mapped are not affected.
+
+    :param arrays: dict with file name as key and array as value
+    :param path: directory of the arrays
+    """
+    os.makedirs(path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + ".tmp.npy"), array)
+    for name in arrays:
+        os.replace(os.path.join(path, name + ".tmp.npy"), os.path.join(path, name + ".npy"))
+
+
+def load_arrays(path: str, names, mmap: bool = True) -> dict:
+    """
+    Load arrays saved by save_arrays.
+
+    :param path: directory of the arrays
+    :param names: file names of the arrays
+    :param mmap: bool if the arrays should be opened read-only memory mapped [Default=True]
+    :return: dict with file name as key and array as value
+    """
+    return {name: np.load(os.path.join(path, name + ".npy"), mmap_mode='r' if mmap else None) for name in names}
+
+
+def save_sparse(matrix: sp.spmatrix, path: str):
+    """
+    Save sparse matrix as directory with one raw .npy file per array of its csr format.
+
+    :param matrix: sparse matrix to save
+    :param path: directory of the sparse matrix
+    """
+    matrix = matrix.tocsr()
+    matrix.sum_duplicates()
+    save_arrays(arrays={'indptr': matrix.indptr, 'indices': matrix.indices, 'data': matrix.data,
+                        'shape': np.array(matrix.shape, dtype=np.int64)}, path=path)
+
+
+def load_sparse(path: str, mmap: bool = True) -> sp.csr_matrix:
+    """
+    Load sparse matrix saved by save_sparse. With mmap the arrays are opened read-only
+    memory mapped, so all processes on a host share the pages of the file system cache.
+
+    :param path: directory of the sparse matrix
+    :param mmap: bool if the arrays should be memory mapped instead of read into memory [Default=True]
+    :return: sparse matrix in csr format
+    """
+    arrays = load_arrays(path=path, names=SPARSE_ARRAYS, mmap=mmap)
+    indptr, indices, data = arrays['indptr'], arrays['indices'], arrays['data']
+    shape = tuple(int(x) for x in arrays['shape'])
+    matrix = sp.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+    # ===== saved in canonical format, read-only arrays must not be sorted in place =====
+    matrix.has_sorted_indices = True
+    matrix.has_canonical_format = True
+    return matrix
+
+
+def convert_npz(npz_file: str, path: str, remove: bool = True):
+    """
+    Convert sparse matrix saved with scipy.sparse.save_npz into the format of save_sparse.
+
+    :param npz_file: path to the .npz file
+    :param path: directory of the sparse matrix
+    :param remove: bool if the .npz file should be removed after conversion [Default=True]
+    """
+    save_sparse(matrix=sp.load_npz(npz_file), path=path)
+    if remove:
+        os.remove(npz_file)
+
+
+def save_index(index: pd.Index, file: str):
+    """
+    Save index of ids as .npy file of fixed width strings, so it can be loaded without pickle.
+
+    :param index: index with ids in order of their rows
+    :param file: path to the .npy file
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+    np.save(file + ".tmp.npy", index.to_numpy(dtype=str))
+    os.replace(file + ".tmp.npy", file)
+
+
+def load_index(file: str) -> pd.Index:
+    """
+    Load index of ids saved by save_index.
+
+    :param file: path to the .npy file
+    :return: index with ids in order of their rows
+    """
+    return pd.Index(np.load(file), dtype=object)
@@ -1,74 +1,71 @@
 #!/usr/bin/python3
 
+import numpy as np
 import pandas as pd
-from collections import defaultdict
+import scipy.sparse as sp
 
 
-def precalc_distance_dicts(ids_cluster: pd.DataFrame, ids_mapping: pd.DataFrame, distances: dict, index_to_id: dict,
-                           ids: dict):
+def precalc_distance_arrays(distances: sp.csr_matrix, labels: np.ndarray, row_entities: sp.csr_matrix = None):
     """
     Precalculate intra and inter distances based on pairwise distances calculated beforehand.
 
-    :param ids_cluster: mapping of ids to corresponding cluster
-    :param ids_mapping: mapping of different id types to original id type
-    :param distances: all pairwise distances previously calculated
-    :param index_to_id: dictionary with mapping of distance matrix indices to ids
-    :param ids: dictionary with mapping of keys to mapping information in mapper
-    :return: 4 dictionaries consisting of entity intra, entity inter, overall intra and overall inter distances
+    :param distances: all pairwise distances previously calculated as upper triangle sparse matrix
+    :param labels: cluster index of every entity
+    :param row_entities: sparse matrix assigning every row of distances to its entities, if the rows
+    are not the entities themselves [Default=None]
+    :return: dictionary with cluster information and arrays for entity intra, entity inter, overall intra and
+    overall inter distances, each consisting of max, sum, min and count
     """
-    # ===== create empty default dicts =====
-    entity_intra = defaultdict(lambda: {'max': None, 'sum': 0, 'min': None, 'count': 0})
-    entity_inter = defaultdict(lambda: defaultdict(lambda: {'max': None, 'sum': 0, 'min': None, 'count': 0}))
-    intra = defaultdict(lambda: {'max': None, 'sum': 0, 'min': None, 'count': 0})
-    inter = defaultdict(lambda: defaultdict(lambda: {'max': None, 'sum': 0, 'min': None, 'count': 0}))
-    # ===== map ids to cluster =====
-    id_to_cluster = ids_cluster.set_index('id').to_dict()['cluster_index']
-    # ===== map att ids to ids =====
-    if ids['att_id'] != ids['id_type']:
-        att_id_to_id = \
-            ids_mapping[[ids['att_id'], ids['id_type']]].groupby(ids['att_id']).agg(lambda g: set(g)).to_dict()[
-                ids['id_type']]
-    else:
-        att_id_to_id = None
-
-    # ===== method to add values =====
-    def add_value(destination, distance):
-        dist = 1 - distance
-        if destination['max'] is None or destination['max'] < dist:
-            destination['max'] = dist
-        if destination['min'] is None or destination['min'] > dist:
-            destination['min'] = dist
-        destination['sum'] = destination['sum'] + dist
-        destination['count'] = destination['count'] + 1
-        return destination
-
-    # ===== assign distances > 0.0  to dicts =====
-    for index1, index2 in distances:
-        att_id1 = index_to_id[index1]
-        att_id2 = index_to_id[index2]
-        att_id_to_id1 = att_id_to_id[att_id1] if att_id_to_id is not None else {att_id1}
-        att_id_to_id2 = att_id_to_id[att_id2] if att_id_to_id is not None else {att_id2}
-        for id1 in att_id_to_id1:
-            for id2 in att_id_to_id2:
-                id1_cluster = id_to_cluster[id1]
-                id2_cluster = id_to_cluster[id2]
-                if id1_cluster == id2_cluster:
-                    entity_intra[id1] = add_value(destination=entity_intra[id1], distance=distances[(index1, index2)])
-                    entity_intra[id2] = add_value(destination=entity_intra[id2], distance=distances[(index1, index2)])
-                    intra[id1_cluster] = add_value(destination=intra[id1_cluster], distance=distances[(index1, index2)])
-                else:
-                    entity_inter[id1][id2_cluster] = add_value(destination=entity_inter[id1][id2_cluster],
-                                                               distance=distances[(index1, index2)])
-                    entity_inter[id2][id1_cluster] = add_value(destination=entity_inter[id2][id1_cluster],
-                                                               distance=distances[(index1, index2)])
-                    inter[id1_cluster][id2_cluster] = add_value(destination=inter[id1_cluster][id2_cluster],
-                                                                distance=distances[(index1, index2)])
-                    inter[id2_cluster][id1_cluster] = add_value(destination=inter[id2_cluster][id1_cluster],
-                                                                distance=distances[(index1, index2)])
-    return {'entity_intra': entity_intra, 'entity_inter': entity_inter, 'intra': intra, 'inter': inter}
-
-
-def calc_linkage(value_dict: dict, size: int, linkage="average"):
+    clusters, labels = np.unique(np.asarray(labels), return_inverse=True)
+    num_entities, num_clusters = len(labels), len(clusters)
+    # ===== map rows of distances to entities =====
+    distances = distances.tocoo()
+    if row_entities is None:
+        row_entities = sp.identity(distances.shape[0], dtype=np.int8, format='csr')
+    row_entities = row_entities.tocsr()
+    pair1, entity1 = _expand_rows(rows=distances.row, row_entities=row_entities)
+    pair2, entity2 = _expand_rows(rows=distances.col[pair1], row_entities=row_entities)
+    entity1, pair = entity1[pair2], pair1[pair2]
+    dist = 1 - distances.data[pair]
+    cluster1, cluster2 = labels[entity1], labels[entity2]
+    same = cluster1 == cluster2
+    # ===== assign distances > 0.0 to arrays =====
+    entity_intra = _aggregate(keys=np.concatenate((entity1[same], entity2[same])),
+                              values=np.concatenate((dist[same], dist[same])), size=num_entities)
+    intra = _aggregate(keys=cluster1[same], values=dist[same], size=num_clusters)
+    inter_keys = np.concatenate((entity1[~same] * num_clusters + cluster2[~same],
+                                 entity2[~same] * num_clusters + cluster1[~same]))
+    unique_keys, inter_keys = np.unique(inter_keys, return_inverse=True)
+    entity_inter = _aggregate(keys=inter_keys, values=np.concatenate((dist[~same], dist[~same])),
+                              size=len(unique_keys))
+    entity_inter['entity'], entity_inter['cluster'] = unique_keys // num_clusters, unique_keys % num_clusters
+    inter = _aggregate(keys=np.concatenate((cluster1[~same] * num_clusters + cluster2[~same],
+                                            cluster2[~same] * num_clusters + cluster1[~same])),
+                       values=np.concatenate((dist[~same], dist[~same])), size=num_clusters * num_clusters)
+    inter = {key: value.reshape(num_clusters, num_clusters) for key, value in inter.items()}
+    # ===== clusters ordered by size as done by value_counts =====
+    order = pd.Series(labels).value_counts().index.to_numpy()
+    return {'labels': labels, 'clusters': clusters, 'sizes': np.bincount(labels, minlength=num_clusters),
+            'order': order, 'entity_intra': entity_intra, 'entity_inter': entity_inter, 'intra': intra,
+            'inter': inter}
+
+
+def _expand_rows(rows: np.ndarray, row_entities: sp.csr_matrix):
+    counts = np.diff(row_entities.indptr)[rows]
+    position = np.repeat(np.arange(len(rows)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return position, row_entities.indices[row_entities.indptr[rows][position] + offsets]
+
+
+def _aggregate(keys: np.ndarray, values: np.ndarray, size: int) -> dict:
+    maximum, minimum = np.full(size, -np.inf), np.full(size, np.inf)
+    np.maximum.at(maximum, keys, values)
+    np.minimum.at(minimum, keys, values)
+    return {'max': maximum, 'sum': np.bincount(keys, weights=values, minlength=size), 'min': minimum,
+            'count': np.bincount(keys, minlength=size)}
+
+
+def calc_linkage(value_dict: dict, size, linkage="average"):
     """
     Calculate desired linkage based on precalculated values.
 
@@ -87,127 +84,98 @@ def calc_linkage(value_dict: dict, size: int, linkage="average"):
         return None
 
 
-def silhouette_score(ids_cluster: pd.DataFrame, distances: dict, linkage="average"):
+def _select(value_dict: dict, index) -> dict:
+    return {key: value_dict[key][index] for key in ['max', 'sum', 'min', 'count']}
+
+
+def silhouette_score(distances: dict, linkage="average"):
     """
     Calculate the silhouette score for the given cluster.
 
-    :param ids_cluster: mapping of ids to corresponding cluster
-    :param distances: all pairwise distances previously calculated
+    :param distances: precalculated distances from precalc_distance_arrays
     :param linkage: linkage type for intra and inter distance [Default="average"]
     :return: sillhouette score for the whole clustering and for each cluster separately
     """
-    cluster_sizes = ids_cluster['cluster_index'].value_counts().to_dict()
-    # ===== map ids to cluster =====
-    id_to_cluster = ids_cluster.set_index('id').to_dict()['cluster_index']
-    # ===== calculate score =====
-    s_score = 0
-    intra_s_scores = dict()
-    for entity in set(distances['entity_intra'].keys()).union(set(distances['entity_inter'].keys())):
-        current_cluster = id_to_cluster[entity]
-        # ===== calc intra distance =====
-        if entity in distances['entity_intra']:
-            entity_intra = calc_linkage(value_dict=distances['entity_intra'][entity],
-                                        size=cluster_sizes[current_cluster], linkage=linkage)
-        else:
-            entity_intra = 1
-        # ===== calc min inter distance =====
-        min_entity_inter = None
-        if entity in distances['entity_inter'] and len(distances['entity_inter'][entity]) < (len(cluster_sizes) - 1):
-            for cluster in distances['entity_inter'][entity]:
-                distance = calc_linkage(value_dict=distances['entity_inter'][entity][cluster],
-                                        size=cluster_sizes[cluster], linkage=linkage)
-                if min_entity_inter is None or min_entity_inter > distance:
-                    min_entity_inter = distance
-        if min_entity_inter is None:
-            min_entity_inter = 1
-
-        if cluster_sizes[current_cluster] > 1 and max(min_entity_inter, entity_intra) > 0.0:
-            score = ((min_entity_inter - entity_intra) / max(min_entity_inter, entity_intra))
-        else:
-            score = 0.0
-        # ===== save score for every cluster separately =====
-        if current_cluster not in intra_s_scores:
-            intra_s_scores[current_cluster] = 0
-        intra_s_scores[current_cluster] += score
-        # ===== save for total score =====
-        s_score += score
-    for cluster in cluster_sizes:
-        if cluster in intra_s_scores:
-            intra_s_scores[cluster] = intra_s_scores[cluster] / cluster_sizes[cluster]
-        else:
-            intra_s_scores[cluster] = 0
-    return s_score / len(ids_cluster['id']), intra_s_scores
-
-
-def dunn_index(ids_cluster: pd.DataFrame, distances: dict, linkage="average") -> float:
+    labels, sizes = distances['labels'], distances['sizes']
+    entity_sizes = sizes[labels]
+    # ===== calc intra distance =====
+    has_intra = distances['entity_intra']['count'] > 0
+    entity_intra = np.where(has_intra, calc_linkage(value_dict=distances['entity_intra'], size=entity_sizes,
+                                                    linkage=linkage), 1.0)
+    # ===== calc min inter distance =====
+    inter = distances['entity_inter']
+    inter_distances = calc_linkage(value_dict=inter, size=sizes[inter['cluster']], linkage=linkage)
+    num_inter = np.bincount(inter['entity'], minlength=len(labels))
+    min_entity_inter = np.full(len(labels), np.inf)
+    np.minimum.at(min_entity_inter, inter['entity'], inter_distances)
+    min_entity_inter = np.where((num_inter > 0) & (num_inter < len(sizes) - 1), min_entity_inter, 1.0)
+    # ===== calc score for entities with any distance =====
+    max_distance = np.maximum(min_entity_inter, entity_intra)
+    valid = (has_intra | (num_inter > 0)) & (entity_sizes > 1) & (max_distance > 0.0)
+    scores = np.zeros(len(labels))
+    scores[valid] = (min_entity_inter[valid] - entity_intra[valid]) / max_distance[valid]
+    # ===== save score for every cluster separately =====
+    intra_s_scores = np.bincount(labels, weights=scores, minlength=len(sizes)) / sizes
+    return float(scores.sum() / len(labels)), {int(cluster): float(score) for cluster, score in
+                                                zip(distances['clusters'], intra_s_scores)}
+
+
+def dunn_index(distances: dict, linkage="average") -> float:
     """
     Calculate the dunn index for the given cluster.
 
-    :param ids_cluster: mapping of ids to corresponding cluster
-    :param distances: all pairwise distances previously calculated
+    :param distances: precalculated distances from precalc_distance_arrays
     :param linkage: linkage type for intra and inter distance [Default="average"]
     :return: dunn index score as float
     """
     max_intra_dist = 0
     min_inter_dist = None
-
-    # ===== count cluster size =====
-    cluster_to_size = ids_cluster['cluster_index'].value_counts().to_dict()
-    for cluster in cluster_to_size:
+    sizes = distances['sizes']
+    for cluster in distances['order']:
         # ===== calc intra distance =====
-        if cluster in distances['intra']:
-            distance = calc_linkage(value_dict=distances['intra'][cluster],
-                                    size=(cluster_to_size[cluster] * cluster_to_size[cluster]) / 2, linkage=linkage)
+        if distances['intra']['count'][cluster] > 0:
+            distance = calc_linkage(value_dict=_select(distances['intra'], cluster),
+                                    size=(sizes[cluster] * sizes[cluster]) / 2, linkage=linkage)
         else:  # if no distances saved for intra cluster: all pairwise have distance 1
             distance = 1
-        if max_intra_dist is None or max_intra_dist < distance:
+        if max_intra_dist < distance:
             max_intra_dist = distance
         # ===== calc min inter distance =====
-        if cluster in distances['inter']:
-            # ===== distance to at least one cluster == 1 -> not in dict =====
-            if len(distances['inter'][cluster]) < (len(cluster_to_size) - 1):
+        to_clusters = np.flatnonzero(distances['inter']['count'][cluster] > 0)
+        if len(to_clusters) > 0:
+            # ===== distance to at least one cluster == 1 -> not saved =====
+            if len(to_clusters) < (len(sizes) - 1):
                 min_inter_dist = 1
             # ===== calc distance to all clusters =====
-            for to_cluster in distances['inter'][cluster]:
-                distance = calc_linkage(value_dict=distances['inter'][cluster][to_cluster],
-                                        size=cluster_to_size[cluster] * cluster_to_size[to_cluster], linkage=linkage)
-                if min_inter_dist is None or min_inter_dist > distance:
-                    min_inter_dist = distance
+            distance = calc_linkage(value_dict=_select(distances['inter'], (cluster, to_clusters)),
+                                    size=sizes[cluster] * sizes[to_clusters], linkage=linkage).min()
+            if min_inter_dist is None or min_inter_dist > distance:
+                min_inter_dist = distance
     if max_intra_dist == 0 or min_inter_dist is None:
         return 0.0
-    return min_inter_dist / max_intra_dist
+    return float(min_inter_dist / max_intra_dist)
 
 
-def davies_bouldin_index(ids_cluster: pd.DataFrame, distances: dict, linkage="average") -> float:
+def davies_bouldin_index(distances: dict, linkage="average") -> float:
     """
     Calculate the davies bouldin index for the given cluster.
 
-    :param ids_cluster: mapping of ids to corresponding cluster
-    :param distances: all pairwise distances previously calculated
+    :param distances: precalculated distances from precalc_distance_arrays
     :param linkage: linkage type for intra and inter distance [Default="average"]
     :return: davies bouldin index score as float
     """
-    max_values = 0
-    # ===== count cluster size =====
-    cluster_to_size = ids_cluster['cluster_index'].value_counts().to_dict()
-    for cluster_i in cluster_to_size:
-        cur_max = 0
-        for cluster_j in cluster_to_size:
-            if cluster_i != cluster_j:
-                # ===== calc intra distances =====
-                distance_i = calc_linkage(value_dict=distances['intra'][cluster_i],
-                                          size=(cluster_to_size[cluster_i] * cluster_to_size[cluster_i]) / 2,
-                                          linkage=linkage) if cluster_i in distances['intra'] else 1
-                distance_j = calc_linkage(value_dict=distances['intra'][cluster_j],
-                                          size=(cluster_to_size[cluster_j] * cluster_to_size[cluster_j]) / 2,
-                                          linkage=linkage) if cluster_j in distances['intra'] else 1
-                # ===== calc inter distance =====
-                distance_ij = calc_linkage(value_dict=distances['inter'][cluster_i][cluster_j],
-                                           size=cluster_to_size[cluster_i] * cluster_to_size[cluster_j],
-                                           linkage=linkage)
-                # ===== calc (q(ci)*q(cj))/p(ci,cj) =====
-                value = (distance_i * distance_j) / distance_ij if distance_ij != 0 else 0
-                if value > cur_max:
-                    cur_max = value
-        max_values = max_values + cur_max
-    return max_values / len(cluster_to_size)
+    sizes = distances['sizes']
+    # ===== calc intra distances =====
+    intra_distances = np.where(distances['intra']['count'] > 0,
+                               calc_linkage(value_dict=distances['intra'], size=(sizes * sizes) / 2,
+                                            linkage=linkage), 1.0)
+    # ===== calc inter distances, clusters without saved distances have distance 1 =====
+    inter_distances = np.where(distances['inter']['count'] > 0,
+                               calc_linkage(value_dict=distances['inter'], size=np.outer(sizes, sizes),
+                                            linkage=linkage), 1.0)
+    # ===== calc (q(ci)*q(cj))/p(ci,cj) =====
+    values = np.zeros(inter_distances.shape)
+    np.divide(np.outer(intra_distances, intra_distances), inter_distances, out=values, where=inter_distances != 0)
+    np.fill_diagonal(values, 0)
+    max_values = np.maximum(values.max(axis=1), 0)
+    return float(max_values.sum() / len(sizes))
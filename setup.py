@@ -1,61 +1,74 @@
 #!/usr/bin/python3
 
 import os
+import numpy as np
 import pandas as pd
-import requests
 import scipy.sparse as sp
-from evaluation.d_utils import runner_utils as ru, eval_utils as eu
-from evaluation import config as c
-from evaluation.mappers import mapping_transformer as mt, gene_getter as gm, mapping_utils as mu
+import requests
+from evaluation.d_utils import runner_utils as ru, eval_utils as eu, download_utils as du
+from evaluation import config as c, background_models as bm
+from evaluation.mappers import mapping_transformer as mt, gene_getter as gm, mapping_utils as mu, store_utils as su
 from evaluation.mappers import disease_getter as dm
 from evaluation.mappers.mapper import Mapper, FileMapper
+from evaluation.mappers.columnar_mapping import ColumnarMapping
 # only in full biodigest
 import graph_tool as gt
 import graph_tool.topology as gtt
 
 
-def load_files(mapper: Mapper):
+def load_files(mapper: Mapper, current_dir: str = None):
     """
     Run setup to load all needed files from api.
 
     :param mapper: object of type Mapper defining where and how to save the generated data
+    :param current_dir: directory of the previous setup, files still current there are linked instead of
+    downloaded [Default=None]
     """
     ru.print_current_usage('Starting Setup ...')
 
+    manifest = du.load_manifest()
+
     ru.print_current_usage('Get id and attribute mappings ...')
-    for file_id in mapper.loaded_mappings:
-        r = requests.get(c.DIGEST+"name="+mapper.file_names[file_id])
-        with open(os.path.join(mapper.files_dir, mapper.file_names[file_id]), 'wb') as f:
-            f.write(r.content)
+    du.download_files(downloads={mapper.file_names[file_id]: c.DIGEST + "name=" + mapper.file_names[file_id]
+                                 for file_id in mapper.loaded_mappings}, path=mapper.files_dir, manifest=manifest,
+                      current_dir=current_dir)
 
     ru.print_current_usage('Get distance mappings ...')
+    # ===== the distance ids are shared by all distance measures and only downloaded once =====
+    du.download_files(downloads={os.path.join("jaccard", mapper.file_names[file_id]):
+                                 c.DIGEST + "name=" + mapper.file_names[file_id] + "&measure=jaccard"
+                                 for file_id in mapper.loaded_distance_ids}, path=mapper.files_dir,
+                      manifest=manifest, current_dir=current_dir)
     for distance_measure in ["jaccard", "overlap"]:
         ru.print_current_usage('Get distance mappings for '+distance_measure+' ...')
-        os.system("mkdir -p " + os.path.join(mapper.files_dir, distance_measure, ""))
-        for file_id in mapper.loaded_distance_ids[distance_measure]:
-            r = requests.get(c.DIGEST + "name=" + mapper.file_names[file_id] + "&measure="+distance_measure)
-            with open(os.path.join(mapper.files_dir, distance_measure, mapper.file_names[file_id]), 'wb') as f:
-                f.write(r.content)
-
-        for file_id in mapper.loaded_distances[distance_measure]:
-            r = requests.get(c.DIGEST + "name=" + mapper.file_names[file_id] + "&measure=" + distance_measure)
-            with open(os.path.join(mapper.files_dir, distance_measure, mapper.file_names[file_id]), 'wb') as f:
-                f.write(r.content)
+        du.download_files(downloads={os.path.join(distance_measure, mapper.file_names[file_id]):
+                                     c.DIGEST + "name=" + mapper.file_names[file_id] + "&measure=" + distance_measure
+                                     for file_id in mapper.loaded_distances[distance_measure]},
+                          path=mapper.files_dir, manifest=manifest, current_dir=current_dir)
+    mapper.convert_distances()
+    # ===== converted files stay current for the next setup although the downloads are removed =====
+    du.record_outputs(path=mapper.files_dir, outputs={
+        **{os.path.join("jaccard", mapper.file_names[file_id]):
+           [os.path.relpath(mapper.get_index_path(key=file_id), mapper.files_dir)]
+           for file_id in mapper.loaded_distance_ids},
+        **{os.path.join(distance_measure, mapper.file_names[file_id]):
+           [os.path.relpath(mapper.get_store_path(key=file_id, distance_measure=distance_measure), mapper.files_dir)]
+           for distance_measure in ["jaccard", "overlap"] for file_id in mapper.loaded_distances[distance_measure]}})
 
     ru.print_current_usage('Get default networks ...')
-    for network in ["ggi_graph.graphml", "ddi_graph.graphml"]:
-        r = requests.get(c.DIGEST + "name=" + network)
-        with open(os.path.join(mapper.files_dir, network), 'wb') as f:
-            f.write(r.content)
+    du.download_files(downloads={network: c.DIGEST + "name=" + network
+                                 for network in ["ggi_graph.graphml", "ddi_graph.graphml"]},
+                      path=mapper.files_dir, manifest=manifest, current_dir=current_dir)
 
     ru.print_current_usage('Finished Setup ...')
 
 
-def create_files(mapper: Mapper):
+def create_files(mapper: Mapper, workers: int = 1):
     """
     Run setup to generate all files from scratch and gather data from databases.
 
     :param mapper: object of type Mapper defining where and how to save the generated data
+    :param workers: number of processes used for precalculating the pairwise distances [Default=1]
     """
     ru.print_current_usage('Starting Setup ...')
 
@@ -118,7 +131,7 @@ def create_files(mapper: Mapper):
     omim_to_pathway.rename(columns={'pathway': 'ctd.pathway_related_to_disease'}, inplace=True)
     mapping = dm.get_attributes_from_database(
         missing=['MONDO:' + x for x in set(disease_att_mapping.mondo) - set(omim_to_pathway.mondo)],
-        attributes=['ctd.pathway_related_to_disease'])
+        attributes=['ctd.pathway_related_to_disease'], lookup_cache=mapper.lookup_cache)
     mapping = pd.concat([omim_to_pathway, mapping])
     disease_att_mapping = pd.merge(disease_att_mapping, mapping[['mondo', 'ctd.pathway_related_to_disease']],
                                    on="mondo", how="left")
@@ -134,35 +147,38 @@ def create_files(mapper: Mapper):
     # ===== Calculate pairwise comparisons =====
     ru.print_current_usage('Precalculate pairwise distances ...')
 
-    for distance_measure in ["jaccard", "overlap"]:
-        os.system("mkdir -p " + os.path.join(mapper.files_dir, distance_measure, ""))
-        ru.print_current_usage('Precalculate pairwise distances for genes [' + distance_measure + '] ...')
-        mapper.update_distance_ids(in_series=gene_att_mapping[c.ID_TYPE_KEY['entrez']], key='gene_mat_ids',
-                                   distance_measure=distance_measure)
-        for attribute in gene_att_mapping.columns[1:]:
-            ru.print_current_usage('Precalculate pairwise distances for ' + attribute)
-            subset_df = gene_att_mapping[gene_att_mapping[attribute].str.len() > 0]
-            comp_mat = eu.get_distance_matrix(full_att_series=gene_att_mapping[attribute],
-                                              from_ids=subset_df[c.ID_TYPE_KEY['entrez']],
-                                              coefficient=distance_measure,
-                                              id_to_index=mapper.loaded_distance_ids[distance_measure][
-                                                  'gene_mat_ids'])
-            sp.save_npz(os.path.join(mapper.files_dir, distance_measure, mapper.file_names[c.DISTANCES[attribute]]),
-                        comp_mat)
-
-        ru.print_current_usage('Precalculate pairwise distances for diseases [' + distance_measure + '] ...')
-        mapper.update_distance_ids(in_series=disease_att_mapping['mondo'], key='disease_mat_ids',
-                                   distance_measure=distance_measure)
-        for attribute in disease_att_mapping.columns[1:]:
-            ru.print_current_usage('Precalculate pairwise distances for ' + attribute)
-            subset_df = disease_att_mapping[disease_att_mapping[attribute].str.len() > 0]
-            comp_mat = eu.get_distance_matrix(full_att_series=disease_att_mapping[attribute],
-                                              from_ids=subset_df['mondo'],
-                                              coefficient=distance_measure,
-                                              id_to_index=mapper.loaded_distance_ids[distance_measure][
-                                                  'disease_mat_ids'])
-            sp.save_npz(os.path.join(mapper.files_dir, distance_measure, mapper.file_names[c.DISTANCES[attribute]]),
-                        comp_mat)
+    mapper.update_distance_ids(in_series=gene_att_mapping[c.ID_TYPE_KEY['entrez']], key='gene_mat_ids')
+    mapper.update_distance_ids(in_series=disease_att_mapping['mondo'], key='disease_mat_ids')
+
+    ru.print_current_usage('Precalculate pairwise distances for genes ...')
+    columnar = ColumnarMapping.from_frame(gene_att_mapping)
+    for attribute in gene_att_mapping.columns[1:]:
+        ru.print_current_usage('Precalculate pairwise distances for ' + attribute)
+        subset_df = gene_att_mapping[gene_att_mapping[attribute].str.len() > 0]
+        att_mat, _ = columnar.get_matrix(column=attribute)
+        comp_mats = eu.get_distance_matrices(full_att_series=gene_att_mapping[attribute], att_mat=att_mat,
+                                             from_ids=subset_df[c.ID_TYPE_KEY['entrez']],
+                                             coefficients=["jaccard", "overlap"],
+                                             id_to_index=mapper.loaded_distance_ids['gene_mat_ids'],
+                                             workers=workers, tmp_dir=mapper.files_dir)
+        for distance_measure, comp_mat in comp_mats.items():
+            su.save_sparse(matrix=comp_mat, path=mapper.get_store_path(key=c.DISTANCES[attribute],
+                                                                       distance_measure=distance_measure))
+
+    ru.print_current_usage('Precalculate pairwise distances for diseases ...')
+    columnar = ColumnarMapping.from_frame(disease_att_mapping)
+    for attribute in disease_att_mapping.columns[1:]:
+        ru.print_current_usage('Precalculate pairwise distances for ' + attribute)
+        subset_df = disease_att_mapping[disease_att_mapping[attribute].str.len() > 0]
+        att_mat, _ = columnar.get_matrix(column=attribute)
+        comp_mats = eu.get_distance_matrices(full_att_series=disease_att_mapping[attribute], att_mat=att_mat,
+                                             from_ids=subset_df['mondo'],
+                                             coefficients=["jaccard", "overlap"],
+                                             id_to_index=mapper.loaded_distance_ids['disease_mat_ids'],
+                                             workers=workers, tmp_dir=mapper.files_dir)
+        for distance_measure, comp_mat in comp_mats.items():
+            su.save_sparse(matrix=comp_mat, path=mapper.get_store_path(key=c.DISTANCES[attribute],
+                                                                       distance_measure=distance_measure))
 
     mapper.save_distances()
 
@@ -174,33 +190,30 @@ def create_files(mapper: Mapper):
         open(os.path.join(mapper.files_dir, graph_id.json() + ".graphml"), "wb").write(response.content)
         graph = gt.load_graph(os.path.join(mapper.files_dir, graph_id.json() + ".graphml"))
 
-        vertices = list()
-        for v in graph.iter_vertices():
-            if graph.vp['primaryDomainId'][v].startswith(id_type):
-                vertices.append(graph.vertex(v))
-
-        edges = list()
-        for v in vertices:
-            res = gtt.shortest_distance(graph, source=graph.vertex(v), max_dist=edges_num, target=vertices, directed=False)
-            for index in range(len(res)):
-                if res[index] == edges_num:
-                    edges.append([graph.vp['primaryDomainId'][v],
-                                  graph.vp['primaryDomainId'][vertices[index]]])
-
-        edges = pd.DataFrame(edges, columns=["from", "to"])
-        edges["from"] = edges["from"].str[len(id_type)+1:]
-        edges["to"] = edges["to"].str[len(id_type)+1:]
+        # ===== pairs of id_type vertices with shortest path of edges_num edges, from a sparse projection =====
+        ids = np.array([graph.vp['primaryDomainId'][v] for v in graph.iter_vertices()], dtype=object)
+        targets = np.flatnonzero([vertex_id.startswith(id_type) for vertex_id in ids])
+        graph_edges = graph.get_edges()[:, :2].astype(np.int64)
+        adjacency = sp.csr_matrix((np.ones(2 * len(graph_edges), dtype=np.float32),
+                                   (np.concatenate((graph_edges[:, 0], graph_edges[:, 1])),
+                                    np.concatenate((graph_edges[:, 1], graph_edges[:, 0])))),
+                                  shape=(len(ids), len(ids)))
+        from_pos, to_pos = eu.get_distance_pairs(adjacency=adjacency, targets=targets, distance=edges_num,
+                                                 workers=workers)
+        names = pd.Series(ids[targets], dtype=object).str[len(id_type)+1:].to_numpy()
+        edges = pd.DataFrame({"from": names[from_pos], "to": names[to_pos]})
 
         G = gt.Graph(directed=False)
         v_ids = G.add_edge_list(edges[["from", "to"]].values, hashed=True)
         G.vertex_properties['id'] = v_ids
         gt.generation.remove_parallel_edges(G)
-        v_ids_set = set(v_ids)
-        for v in vertices:
-            cur_v = graph.vp['primaryDomainId'][v][len(id_type)+1:]
-            if cur_v not in v_ids_set:
-                new_v = G.add_vertex()
-                G.vertex_properties['id'][new_v] = cur_v
+        v_ids_set = set(v_ids[v] for v in G.vertices())
+        missing = [cur_v for cur_v in names if cur_v not in v_ids_set]
+        offset = G.num_vertices()
+        if len(missing) > 0:
+            G.add_vertex(len(missing))
+        for index, cur_v in enumerate(missing):
+            G.vertex_properties['id'][offset + index] = cur_v
 
         G.save(os.path.join(mapper.files_dir, file_name), fmt="graphml")
         os.system("rm " + os.path.join(mapper.files_dir, graph_id.json() + ".graphml"))
@@ -211,18 +224,39 @@ def create_files(mapper: Mapper):
     ru.print_current_usage('Finished Setup ...')
 
 
-def main(setup_type: str, replace: bool=True, path:str=c.FILES_DIR):
-    os.system("mkdir -p " + os.path.join(path, "tmp", ""))
+def generate_network_modules(path: str):
+    """
+    Pre-generate the random modules of the network background model for the default networks.
+
+    :param path: directory of the default networks
+    """
+    for network in ["ggi_graph.graphml", "ddi_graph.graphml"]:
+        ru.print_current_usage('Generate random modules for ' + network + ' ...')
+        bm.NetworkModuleStore(network_file=os.path.join(path, network)).generate()
+
+
+def main(setup_type: str, replace: bool=True, path:str=c.FILES_DIR, workers: int = 1):
+    if setup_type == "convert":
+        FileMapper(files_dir=path).convert_distances()
+        return
+    if setup_type == "modules":
+        generate_network_modules(path=path)
+        return
+    os.makedirs(os.path.join(path, "tmp"), exist_ok=True)
     if setup_type == "create":
-        create_files(mapper=FileMapper(files_dir=os.path.join(path, "tmp", "")))
+        create_files(mapper=FileMapper(files_dir=os.path.join(path, "tmp", "")), workers=workers)
     elif setup_type == "api":
-        load_files(mapper=FileMapper(files_dir=os.path.join(path, "tmp", "")))
+        load_files(mapper=FileMapper(files_dir=os.path.join(path, "tmp", "")), current_dir=path)
     if replace:
-        os.system("cp -r " + os.path.join(path, "tmp", "") + "* " + path)
-        os.system("rm -rf " + os.path.join(path, "tmp", ""))
+        du.swap_directory(source=os.path.join(path, "tmp"), target=path)
+    # ===== columnar mappings with their inverted indices, so requests only memory map them =====
+    ru.print_current_usage('Build columnar mappings and inverted indices ...')
+    FileMapper(files_dir=path if replace else os.path.join(path, "tmp", "")).load_mappings()
+    if setup_type == "create":
+        generate_network_modules(path=path if replace else os.path.join(path, "tmp", ""))
 
 
 if __name__ == "__main__":
     desc = "     Run setup to create/load precalculated files."
-    args = ru.save_parameters(script_desc=desc, arguments=('s'))
-    main(setup_type=args.setup_type)
+    args = ru.save_parameters(script_desc=desc, arguments=('s', 'w'))
+    main(setup_type=args.setup_type, workers=args.workers)
@@ -1,12 +1,13 @@
 #!/usr/bin/python3
 
 import os
+import multiprocessing as mp
+import threading
 import numpy as np
 import pandas as pd
 from evaluation.d_utils import runner_utils as ru, eval_utils as eu, plotting_utils as pu
 from evaluation.mappers.mapper import Mapper, FileMapper
 from evaluation import config, comparator as comp, background_models as bm
-import random
 import json
 import time
 from pathlib import Path
@@ -15,9 +16,9 @@ from typing import Union, Callable
 
 def single_validation(tar: Union[pd.DataFrame, set], tar_id: str, mode: str, distance: str = "jaccard",
                       ref: set = None, ref_id: str = None, enriched: bool = False,
-                      mapper: Mapper = FileMapper(), runs: int = config.NUMBER_OF_RANDOM_RUNS,
+                      mapper: Mapper = None, runs: int = config.NUMBER_OF_RANDOM_RUNS,
                       background_model: str = "complete", replace=100, verbose: bool = False,
-                      network_data: dict = None,
+                      network_data: dict = None, seed: int = None, workers: int = 1,
                       progress: Callable[[float, str], None] = None):
     """
     Single validation of a set, cluster a id versus set and set versus set.
@@ -37,8 +38,11 @@ def single_validation(tar: Union[pd.DataFrame, set], tar_id: str, mode: str, dis
     :param network_data: dict consisting of {"network_file": path to network file,
     "prop_name": name of vertex property with ids if network file of type graphml or gt,
     "id_type": id type of network ids}
+    :param seed: seed for the random runs to make the results reproducible [Default=None]
+    :param workers: number of processes running the random runs in parallel [Default=1]
     :param progress: method that will get a float [0,1] and message indicating the current progress
     """
+    mapper = FileMapper() if mapper is None else mapper
     ru.start_time = time.time()
     ru.print_current_usage('Check for proper setup ...') if verbose else None
     mapper.check_for_setup_sources()
@@ -51,26 +55,8 @@ def single_validation(tar: Union[pd.DataFrame, set], tar_id: str, mode: str, dis
         ru.print_current_usage('Load mappings for input into cache ...') if verbose else None
         mapper.load_mappings()
     if mode in ["set", "set-set", "subnetwork", "subnetwork-set"]:
-        error_mappings = []
-        if mode in ["set-set", "subnetwork-set"]:
-            comparator = comp.SetSetComparator(mapper=mapper, enriched=enriched, verbose=verbose,
-                                               distance_measure=distance)
-            comparator.load_reference(ref=ref, ref_id_type=ref_id, tar_id_type=tar_id)
-            if not comparator.ref_dict:
-                error_mappings.append("reference")
-        else:  # mode == "set"
-            comparator = comp.SetComparator(mapper=mapper, verbose=verbose, distance_measure=distance)
-            if mapper.load:
-                ru.print_current_usage('Load distances for input into cache ...') if verbose else None
-                progress(0.05, "Load distances...") if progress is not None else None
-                mapper.load_distances(set_type=tar_id, distance_measure=distance)
-        comparator.load_target(id_set=tar, id_type=tar_id)
-        # ===== Check if mappings possible =====
-        if comparator.mapping.empty:
-            error_mappings.append("target set")
-        if len(error_mappings) > 0:
-            raise Exception('No mapping found for ' + ' and '.join(error_mappings) +
-                            '. Please check if ID type is correct.')
+        comparator = load_set_comparator(tar=tar, tar_id=tar_id, mode=mode, distance=distance, ref=ref, ref_id=ref_id,
+                                         enriched=enriched, mapper=mapper, verbose=verbose, progress=progress)
         # ===== Get validation values of input =====
         ru.print_current_usage('Validation of input ...') if verbose else None
         progress(0.1, "Validation of input...") if progress is not None else None
@@ -82,7 +68,8 @@ def single_validation(tar: Union[pd.DataFrame, set], tar_id: str, mode: str, dis
         comparator.input_run = False
         comp_values = get_random_runs_values(comparator=comparator, mode=mode, mapper=mapper, tar_id=tar_id,
                                              runs=runs, background_model=background_model, replace=replace,
-                                             network_data=network_data, progress=progress)
+                                             network_data=network_data, seed=seed, workers=workers,
+                                             progress=progress)
         # ===== Statistical analysis =====
         ru.print_current_usage('Calculating p-values ...') if verbose else None
         set_value = eu.calc_pvalue(test_value=my_value, random_values=comp_values[0], maximize=True)
@@ -115,7 +102,7 @@ def single_validation(tar: Union[pd.DataFrame, set], tar_id: str, mode: str, dis
         comparator.verbose = False
         comparator.input_run = False
         comp_values = get_random_runs_values(comparator=comparator, mode=mode, mapper=mapper, tar_id=tar_id,
-                                             runs=runs, progress=progress)
+                                             runs=runs, seed=seed, workers=workers, progress=progress)
         # ===== Statistical analysis =====
         ru.print_current_usage('Calculating p-values ...') if verbose else None
         p_values_di = eu.calc_pvalue(test_value=my_value_di, random_values=comp_values[0], maximize=True)
@@ -138,12 +125,56 @@ def single_validation(tar: Union[pd.DataFrame, set], tar_id: str, mode: str, dis
     return results
 
 
+def load_set_comparator(tar: set, tar_id: str, mode: str, distance: str = "jaccard", ref: set = None,
+                        ref_id: str = None, enriched: bool = False, mapper: Mapper = None, verbose: bool = False,
+                        progress: Callable[[float, str], None] = None) -> comp.Comparator:
+    """
+    Create the comparator of the set modes and load the target and, if needed, the reference into it.
+
+    :param tar: set of target ids
+    :param tar_id: id type of target input
+    :param mode: comparison mode [set, set-set, subnetwork, subnetwork-set]
+    :param distance: distance measure used for comparison. [Default=jaccard]
+    :param ref: set of reference ids [Default=None]
+    :param ref_id: id type of reference input [Default=None]
+    :param enriched: bool setting if values of reference set should be filtered for enriched values [Default=False]
+    :param mapper: mapper from type Mapper defining where the precalculated information comes from
+    :param verbose: bool if additional info like ids without assigned attributes should be printed [Default=False]
+    :param progress: method that will get a float [0,1] and message indicating the current progress
+    :return: comparator with loaded target
+    """
+    error_mappings = []
+    if mode in ["set-set", "subnetwork-set"]:
+        comparator = comp.SetSetComparator(mapper=mapper, enriched=enriched, verbose=verbose,
+                                           distance_measure=distance)
+        comparator.load_reference(ref=ref, ref_id_type=ref_id, tar_id_type=tar_id)
+        if not comparator.ref_dict:
+            error_mappings.append("reference")
+    else:  # mode == "set"
+        comparator = comp.SetComparator(mapper=mapper, verbose=verbose, distance_measure=distance)
+        if mapper.load:
+            ru.print_current_usage('Load distances for input into cache ...') if verbose else None
+            progress(0.05, "Load distances...") if progress is not None else None
+            mapper.load_distances(set_type=tar_id, distance_measure=distance)
+    comparator.load_target(id_set=tar, id_type=tar_id)
+    # ===== Check if mappings possible =====
+    if comparator.mapping.empty:
+        error_mappings.append("target set")
+    if len(error_mappings) > 0:
+        raise Exception('No mapping found for ' + ' and '.join(error_mappings) +
+                        '. Please check if ID type is correct.')
+    return comparator
+
+
 def get_random_runs_values(comparator: comp.Comparator, mode: str, mapper: Mapper, tar_id: str, runs: int,
                            background_model: str = "complete", replace=100, term: str = "sum",
-                           network_data: dict = None, progress: Callable[[float, str], None] = None) -> list:
+                           network_data: dict = None, seed: int = None, workers: int = 1, size: int = None,
+                           progress: Callable[[float, str], None] = None) -> list:
     """
     Pick random ids to recreate a target input and run the comparison against reference or itself.
-    The random ids are of the same id type of the original target input.
+    The random ids are of the same id type of the original target input. The runs are split into chunks
+    of fixed size, each with its own random generator spawned from the seed, so the results for a
+    fixed seed do not depend on the number of workers.
 
     :param comparator: comparator with defined way how to make the comparison
     :param mode: comparison mode [set, id-set, set-set, cluster]
@@ -156,14 +187,20 @@ def get_random_runs_values(comparator: comp.Comparator, mode: str, mapper: Mappe
     :param network_data: dict consisting of {"network_file": path to network file,
     "prop_name": name of vertex property with ids if network file of type graphml or gt,
     "id_type": id type of network ids}
+    :param seed: seed for the random generators of the runs [Default=None]
+    :param workers: number of processes running chunks of random runs in parallel [Default=1]
+    :param size: size of the target input the random runs recreate, e.g. one less than the loaded target
+    to leave one id out, the size of the loaded target if None [Default=None]
     :param progress: method that will get a float [0,1] and message indicating the current progress
     :return: comparison
     """
-    results = list()
     threshold = min(runs + 1, 100)
-    limit, counter = int((runs + 1) / threshold), 1
+    limit = int((runs + 1) / threshold)
+    chunks = [(start, min(start + limit, runs)) for start in range(0, runs, limit)]
+    model_seed, *chunk_seeds = np.random.SeedSequence(seed).spawn(len(chunks) + 1)
+    state = {'comparator': comparator, 'mode': mode, 'background_model': background_model, 'term': term}
     if not mode == "clustering":
-        results.extend([list()])
+        results = [list()]
         # ===== Get full id mapping =====
         if tar_id in config.SUPPORTED_DISEASE_IDS:
             full_id_map = mapper.get_full_set(id_type=tar_id, mapping_name='disorder_ids')
@@ -173,14 +210,29 @@ def get_random_runs_values(comparator: comp.Comparator, mode: str, mapper: Mappe
             new_id_type, map_id_type, map_att_type = "entrez", "gene_ids", "gene_atts"
         # ===== Precalculate sizes =====
         orig_ids = set(comparator.id_set)
-        size = len(orig_ids)
+        size = len(orig_ids) if size is None else size
         random_size = int((size / 100) * replace)
+        state.update({'tar_id': tar_id, 'new_id_type': new_id_type, 'full_id_map': full_id_map,
+                      'orig_ids': sorted(orig_ids), 'size': size, 'random_size': random_size,
+                      'network_data': network_data})
 
         if background_model == "complete":
-            background = bm.CompleteModel(prev_id_type=tar_id, full_id_map=full_id_map)
+            # ===== Random target ids are picked like by the complete model and expanded to comparator indices =====
+            tar_col = config.ID_TYPE_KEY[tar_id]
+            candidates = full_id_map[full_id_map[tar_col] != ""]
+            codes, tar_ids = pd.factorize(candidates[tar_col])
+            att_ids = candidates[comparator.att_id].fillna("")
+            indices = comparator.get_indices(att_ids=att_ids)
+            # ===== ids without attributes are still members of a module, with distinct indices below -1 =====
+            without_atts = (indices < 0) & (att_ids != "").to_numpy()
+            indices[without_atts] = -2 - pd.factorize(att_ids[without_atts])[0]
+            state['population'] = codes
+            state['id_indices'] = get_id_indices(codes=codes[indices != -1], indices=indices[indices != -1],
+                                                 num_ids=len(tar_ids))
+            state['orig_codes'] = tar_ids.get_indexer(state['orig_ids'])
         elif background_model == "term-pres":
-            background = bm.TermPresModel(mapper=mapper, prev_id_type=tar_id, new_id_type=new_id_type,
-                                          map_id_type=map_id_type, map_att_type=map_att_type, term=term)
+            state['background'] = bm.TermPresModel(mapper=mapper, prev_id_type=tar_id, new_id_type=new_id_type,
+                                                   map_id_type=map_id_type, map_att_type=map_att_type, term=term)
         elif background_model == "network":
             if network_data is None:  # load default network from config
                 if new_id_type == "mondo":
@@ -189,81 +241,203 @@ def get_random_runs_values(comparator: comp.Comparator, mode: str, mapper: Mappe
                 else:
                     network_data = {"network_file": os.path.join(mapper.files_dir, "ggi_graph.graphml"),
                                     "id_type": new_id_type, "prop_name": "id"}
+                state['network_data'] = network_data
             if network_data["id_type"] != tar_id:  # remap ids
                 input_ids = set(full_id_map[full_id_map[config.ID_TYPE_KEY[tar_id]].isin(orig_ids)][
                                     config.ID_TYPE_KEY[network_data["id_type"]]])
-                background = bm.NetworkModel(network_data=network_data, to_replace=input_ids, N=runs)
+                state['background'] = bm.NetworkModel(network_data=network_data, to_replace=input_ids, N=runs,
+                                                      rng=np.random.default_rng(model_seed))
             else:
-                background = bm.NetworkModel(network_data=network_data, to_replace=orig_ids, N=runs)
-
+                state['background'] = bm.NetworkModel(network_data=network_data, to_replace=orig_ids, N=runs,
+                                                      rng=np.random.default_rng(model_seed))
         else:
             return list()
-        for run in range(1, runs + 1):
-            # ===== Update progress =====
-            if run % limit == 0:
-                progress(0.1 + (counter * (0.9 / threshold)),
-                         str(
-                             limit * counter) + " run(s) with background model finished...") if progress is not None else None
-                counter += 1
-            # ===== Pick new samples =====
-            old_sample = set(random.sample(list(orig_ids), (size - random_size)))  # ignore when network model
-            to_replace = orig_ids.difference(old_sample)
-
-            if background_model == "complete":
-                random_sample = background.get_module(to_replace=to_replace)
-            elif background_model == "term-pres":
-                random_sample = background.get_module(to_replace=to_replace, term=term, prev_id_type=tar_id)
-            elif background_model == "network":
-                random_sample = background.get_module(index=run - 1)
-                if network_data["id_type"] != tar_id:  # remap ids
-                    # random_sample = \
-                    # set(full_id_map[full_id_map[config.ID_TYPE_KEY[network_data["id_type"]]].isin(random_sample)][
-                    #    config.ID_TYPE_KEY[tar_id]])
-                    tar_id = network_data["id_type"]
-                    old_sample = set()
-            else:
-                return list()
-
-            # ===== Get corresponding id set =====
-            id_set = full_id_map[full_id_map[config.ID_TYPE_KEY[tar_id]].isin(random_sample.union(old_sample))][
-                comparator.att_id]
-            # ===== Calculate values =====
-            comparator.load_target(id_set=set(id_set), id_type=new_id_type)
-            result, _ = comparator.compare()
-            if result:
-                results[0].append(result)
 
     # ===== Special case cluster =====
     else:
-        # ===== Calculate values =====
-        results.extend([list(), list(), list()])
+        results = [list(), list(), list()]
         # ===== Precalculate sizes =====
         orig_ids = set(comparator.clustering['id'])
-        orig_clusters = comparator.clustering
-        size = len(orig_ids)
-        random_size = int((size / 100) * replace)
-        for run in range(0, runs):
-            # ===== Update progress =====
-            if run % limit == 0:
-                progress(0.1 + (counter * (0.9 / threshold)),
-                         str(
-                             limit * counter) + " run(s) with background model finished...") if progress is not None else None
-                counter += 1
-            old_sample = set(random.sample(orig_ids, (size - random_size)))
+        size = len(orig_ids) if size is None else size
+        state.update({'orig_ids': sorted(orig_ids), 'orig_clusters': comparator.clustering, 'size': size,
+                      'random_size': int((size / 100) * replace)})
+    # ===== Calculate values =====
+    tasks = [(start, end, chunk_seed) for (start, end), chunk_seed in zip(chunks, chunk_seeds)]
+    for counter, chunk_results in enumerate(_iter_random_chunks(state=state, tasks=tasks, workers=workers), 1):
+        for index, chunk_result in enumerate(chunk_results):
+            results[index].extend(chunk_result)
+        progress(0.1 + (counter * (0.9 / threshold)),
+                 str(tasks[counter - 1][1]) + " run(s) with background model finished...") \
+            if progress is not None else None
+    # convert to dataframes
+    final_results = list()
+    for result in results:
+        final_results.append(pd.DataFrame(result))
+    return final_results
+
+
+def run_random_chunk(state: dict, start: int, end: int, rng: np.random.Generator) -> list:
+    """
+    Run the random runs from start to end prepared by get_random_runs_values.
+
+    :param state: comparator, background model and sizes prepared by get_random_runs_values
+    :param start: index of first run in chunk
+    :param end: index after last run in chunk
+    :param rng: generator used for all random picks of the chunk
+    :return: list with list of results per result type
+    """
+    comparator, orig_ids, random_size = state['comparator'], state['orig_ids'], state['random_size']
+    size = state['size']
+    # ===== Special case cluster =====
+    if state['mode'] == "clustering":
+        results = [list(), list(), list()]
+        orig_clusters = state['orig_clusters']
+        for _ in range(start, end):
+            old_sample = pick_kept_ids(orig_ids=orig_ids, num_kept=size - random_size, rng=rng)
             # ===== Shuffle subset of clusters =====
-            subset = orig_clusters[~orig_clusters['id'].isin(old_sample)]
-            subset["cluster_index"] = np.random.permutation(subset["cluster_index"])
+            subset = orig_clusters[~orig_clusters['id'].isin(old_sample)].copy()
+            subset["cluster_index"] = rng.permutation(subset["cluster_index"])
             comparator.clustering = pd.concat([orig_clusters[orig_clusters['id'].isin(old_sample)], subset])
             # ===== Start validating =====
             value_di, value_ss, value_dbi, value_ss_inter, mapped = comparator.compare()
             results[0].append(value_di)
             results[1].append(value_ss)
             results[2].append(value_dbi)
-    # convert to dataframes
-    final_results = list()
-    for result in results:
-        final_results.append(pd.DataFrame(result))
-    return final_results
+        return results
+    if state['background_model'] == "complete":
+        modules = draw_random_modules(population=state['population'], id_indices=state['id_indices'],
+                                      orig_codes=state['orig_codes'], runs=end - start, num_kept=size - random_size,
+                                      random_size=random_size, rng=rng)
+        return [comparator.compare_batch(modules=modules).to_dict('records')]
+    results = [list()]
+    tar_id, full_id_map, network_data = state['tar_id'], state['full_id_map'], state['network_data']
+    for run in range(start, end):
+        # ===== Pick new samples =====
+        old_sample = pick_kept_ids(orig_ids=orig_ids, num_kept=size - random_size, rng=rng)  # ignore for network
+        to_replace = set(orig_ids).difference(old_sample)
+        if state['background_model'] == "term-pres":
+            random_sample = state['background'].get_module(to_replace=to_replace, term=state['term'],
+                                                           prev_id_type=tar_id, rng=rng)
+        else:  # background_model == "network"
+            random_sample = state['background'].get_module(index=run)
+            if network_data["id_type"] != tar_id:  # remap ids
+                tar_id = network_data["id_type"]
+                old_sample = set()
+        # ===== Get corresponding id set =====
+        id_set = full_id_map[full_id_map[config.ID_TYPE_KEY[tar_id]].isin(random_sample.union(old_sample))][
+            comparator.att_id]
+        # ===== Calculate values =====
+        comparator.load_target(id_set=set(id_set), id_type=state['new_id_type'])
+        result, _ = comparator.compare()
+        if result:
+            results[0].append(result)
+    return results
+
+
+_worker_state = dict()
+
+
+def _init_random_runs_worker(state: dict):
+    _worker_state.update(state)
+
+
+def _run_random_chunk(args):
+    start, end, chunk_seed = args
+    return run_random_chunk(state=_worker_state, start=start, end=end, rng=np.random.default_rng(chunk_seed))
+
+
+def _iter_random_chunks(state: dict, tasks: list, workers: int = 1):
+    """
+    Yield the results of all chunks of random runs in order. With more than one worker the chunks are
+    run by a process pool. A forked pool shares the loaded mappings and distances copy-on-write instead
+    of pickling them. A process running further threads, e.g. a service answering requests on a thread
+    pool, is not forked, as a lock or sqlite connection held by another thread would stay locked in the
+    child forever. Its workers are started by forkserver or spawn and get the state pickled once, the
+    distance matrices saved unchanged on disk are memory mapped again by every worker. Anything the
+    workers add to the mapper, e.g. lookups of ids missing in the mappings, is lost with the workers.
+
+    :param state: comparator, background model and sizes prepared by get_random_runs_values
+    :param tasks: list with start, end and seed of every chunk
+    :param workers: number of processes running chunks in parallel [Default=1]
+    """
+    if workers > 1 and len(tasks) > 1:
+        with mp.get_context(_get_start_method()).Pool(processes=workers, initializer=_init_random_runs_worker,
+                                                      initargs=(state,)) as pool:
+            yield from pool.imap(_run_random_chunk, tasks)
+    else:
+        for start, end, chunk_seed in tasks:
+            yield run_random_chunk(state=state, start=start, end=end, rng=np.random.default_rng(chunk_seed))
+
+
+def _get_start_method() -> str:
+    methods = mp.get_all_start_methods()
+    if 'fork' in methods and threading.active_count() == 1:
+        return 'fork'
+    return 'forkserver' if 'forkserver' in methods else 'spawn'
+
+
+def get_id_indices(codes: np.ndarray, indices: np.ndarray, num_ids: int) -> tuple:
+    """
+    Group the comparator indices by target id.
+
+    :param codes: code of the target id of every index
+    :param indices: comparator indices, e.g. of the attribute ids of the target ids
+    :param num_ids: number of target id codes
+    :return: indptr with the start of the indices of every code and the distinct indices of every code
+    """
+    pairs = np.unique(np.stack([np.asarray(codes, dtype=np.int64), np.asarray(indices, dtype=np.int64)]), axis=1)
+    return np.searchsorted(pairs[0], np.arange(num_ids + 1)), pairs[1]
+
+
+def pick_kept_ids(orig_ids: list, num_kept: int, rng: np.random.Generator) -> set:
+    """
+    Pick the original ids kept in a random run. Nothing is drawn if no id is kept, so that the random
+    picks of a run only depend on the number of replaced ids then.
+
+    :param orig_ids: original ids of the target input
+    :param num_kept: number of original ids to keep
+    :param rng: generator used for picking the kept ids
+    :return: set of kept ids
+    """
+    if num_kept <= 0:
+        return set()
+    return set(rng.choice(orig_ids, size=num_kept, replace=False))
+
+
+def draw_random_modules(population: np.ndarray, id_indices: tuple, orig_codes: np.ndarray, runs: int,
+                        num_kept: int, random_size: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Draw the random modules of all runs with the picks of the complete background model. In every run
+    num_kept original ids are kept and random_size target ids are picked from the population without
+    replacement, all ids of the run are then expanded to their comparator indices.
+
+    :param population: code of the target id of every row of the full id mapping, an id with several rows is
+    picked more likely like in the complete background model
+    :param id_indices: indptr and indices from get_id_indices
+    :param orig_codes: code of every original id, -1 if it is not in the full id mapping
+    :param runs: number of random runs
+    :param num_kept: number of original ids kept in every run
+    :param random_size: number of random ids in every run
+    :param rng: generator used for picking the random ids
+    :return: matrix with the indices of one module per row, padded with -1, ids without attributes have
+    indices below -1
+    """
+    indptr, indices = id_indices
+    modules = list()
+    for _ in range(runs):
+        kept = orig_codes[rng.choice(len(orig_codes), size=num_kept, replace=False)] if num_kept > 0 else \
+            orig_codes[:0]
+        # ===== a population smaller than the ids to replace is picked completely =====
+        picked = population[rng.choice(len(population), size=min(random_size, len(population)), replace=False)]
+        ids = np.unique(np.concatenate([kept, picked]))
+        ids = ids[ids >= 0]
+        starts, counts = indptr[ids], indptr[ids + 1] - indptr[ids]
+        positions = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        modules.append(np.unique(indices[positions]))
+    padded = np.full((runs, max([len(module) for module in modules] + [1])), -1, dtype=np.int64)
+    for run, module in enumerate(modules):
+        padded[run, :len(module)] = module
+    return padded
 
 
 def save_results(results: dict, prefix: str, out_dir):
@@ -278,9 +452,10 @@ def save_results(results: dict, prefix: str, out_dir):
 
 def significance_contribution(results: dict, excluded: str, tar: Union[pd.DataFrame, set], tar_id: str, mode: str,
                               distance: str = "jaccard", ref: set = None, ref_id: str = None, enriched: bool = False,
-                              mapper: Mapper = FileMapper(), runs: int = config.NUMBER_OF_RANDOM_RUNS,
+                              mapper: Mapper = None, runs: int = config.NUMBER_OF_RANDOM_RUNS,
                               background_model: str = "complete",
-                              replace=100, verbose: bool = False, network_data: dict = None):
+                              replace=100, verbose: bool = False, network_data: dict = None, seed: int = None,
+                              workers: int = 1):
     """
     Calculate the significance contribution of the excluded id by removing it from the target set,
     running the single_validation on the subset and then comparing the empirical p-values to determine, if
@@ -303,7 +478,10 @@ def significance_contribution(results: dict, excluded: str, tar: Union[pd.DataFr
     :param network_data: dict consisting of {"network_file": path to network file,
     "prop_name": name of vertex property with ids if network file of type graphml or gt,
     "id_type": id type of network ids}
+    :param seed: seed for the random runs to make the results reproducible [Default=None]
+    :param workers: number of processes running the random runs in parallel [Default=1]
     """
+    mapper = FileMapper() if mapper is None else mapper
     ru.print_current_usage('Check for usable results values ...') if verbose else None
     if results["status"] != "ok":
         raise Exception('Status of results input is not ok. Please check your results again.')
@@ -327,7 +505,7 @@ def significance_contribution(results: dict, excluded: str, tar: Union[pd.DataFr
                                     mode=mode, mapper=mapper, runs=runs,
                                     background_model=background_model, verbose=verbose,
                                     enriched=enriched, replace=replace,
-                                    distance=distance, network_data=network_data)
+                                    distance=distance, network_data=network_data, seed=seed, workers=workers)
     # ===== Calculate significance contribution =====
     new_df = pd.DataFrame(results_sig["p_values"]['values']) - pd.DataFrame(results["p_values"]['values'])
     return {excluded: new_df.to_dict()}
@@ -335,10 +513,10 @@ def significance_contribution(results: dict, excluded: str, tar: Union[pd.DataFr
 
 def significance_contributions(results: dict, tar: Union[pd.DataFrame, set], tar_id: str, mode: str,
                                distance: str = "jaccard", ref: set = None, ref_id: str = None, enriched: bool = False,
-                               mapper: Mapper = FileMapper(), runs: int = config.NUMBER_OF_RANDOM_RUNS,
+                               mapper: Mapper = None, runs: int = config.NUMBER_OF_RANDOM_RUNS,
                                background_model: str = "complete",
-                               replace=100, verbose: bool = False, network_data: dict = None,
-                               progress: Callable[[float, str], None] = None):
+                               replace=100, verbose: bool = False, network_data: dict = None, seed: int = None,
+                               workers: int = 1, progress: Callable[[float, str], None] = None):
     """
     Calculate the significance contribution of every input id separately by removing it from the target set,
     running the single_validation on the subset and then comparing the empirical p-values to determine, if
@@ -360,22 +538,36 @@ def significance_contributions(results: dict, tar: Union[pd.DataFrame, set], tar
     :param network_data: dict consisting of {"network_file": path to network file,
     "prop_name": name of vertex property with ids if network file of type graphml or gt,
     "id_type": id type of network ids}
+    :param seed: seed for the random runs to make the results reproducible [Default=None]
+    :param workers: number of processes running the random runs in parallel [Default=1]
     :param progress: method that will get a float [0,1] and message indicating the current progress
     """
+    mapper = FileMapper() if mapper is None else mapper
     ru.print_current_usage('Check for usable results values ...') if verbose else None
     if results["status"] != "ok":
         raise Exception('Status of results input is not ok. Please check your results again.')
     ru.print_current_usage('Check for proper id input ...') if verbose else None
     tar = normalize_ids(tar=tar, tar_id=tar_id)
-    results_sig = dict()
+    results_sig = None
     progress(0.05, "Prepare for run ...") if progress is not None else None
-    # ===== Calculate significance for each id from input =====
     id_set = tar if isinstance(tar, set) else tar["id"]
+    # ===== Leave each id out of the input values if the random runs only depend on the size =====
+    if mode != "clustering" and background_model == "complete" and \
+            int(((len(id_set) - 1) / 100) * replace) == len(id_set) - 1:
+        results_sig = leave_one_out_contributions(results=results, tar=tar, tar_id=tar_id, mode=mode,
+                                                  distance=distance, ref=ref, ref_id=ref_id, enriched=enriched,
+                                                  mapper=mapper, runs=runs, verbose=verbose, seed=seed,
+                                                  workers=workers, progress=progress)
+    if results_sig is not None:
+        return transform_dict(results_sig)
+    results_sig = dict()
+    # ===== Calculate significance for each id from input =====
     for index, excluded in enumerate(id_set):
         result_sig = significance_contribution(results=results, excluded=excluded, tar=tar, tar_id=tar_id, ref=ref,
                                                ref_id=ref_id, mode=mode, mapper=mapper, runs=runs,
                                                background_model=background_model, verbose=False, enriched=enriched,
-                                               replace=replace, distance=distance, network_data=network_data)
+                                               replace=replace, distance=distance, network_data=network_data,
+                                               seed=seed, workers=workers)
         results_sig.update(result_sig)
         ru.print_current_usage(
             '{}/{} significance contributions calculated ...'.format(index + 1, len(tar))) if verbose else None
@@ -387,6 +579,62 @@ def significance_contributions(results: dict, tar: Union[pd.DataFrame, set], tar
     return final_results_sig
 
 
+def leave_one_out_contributions(results: dict, tar: set, tar_id: str, mode: str, distance: str = "jaccard",
+                                ref: set = None, ref_id: str = None, enriched: bool = False, mapper: Mapper = None,
+                                runs: int = config.NUMBER_OF_RANDOM_RUNS, verbose: bool = False, seed: int = None,
+                                workers: int = 1, progress: Callable[[float, str], None] = None):
+    """
+    Calculate the significance contribution of every input id of the set modes at once. The input values
+    without each id are derived from the values of the full input by the comparator and all of them are
+    compared against one shared set of random runs with one id less, as those only depend on the size of
+    the input if all ids are replaced by the complete background model.
+
+    :param results: results from the single_validation run to compare to
+    :param tar: set of target ids
+    :param tar_id: id type of target input
+    :param mode: comparison mode [set, set-set, subnetwork, subnetwork-set]
+    :param distance: distance measure used for comparison. [Default=jaccard]
+    :param ref: set of reference ids [Default=None]
+    :param ref_id: id type of reference input [Default=None]
+    :param enriched: bool setting if values of reference set should be filtered for enriched values [Default=False]
+    :param mapper: mapper from type Mapper defining where the precalculated information comes from
+    :param runs: number of random runs to create p-values [Default=1000]
+    :param verbose: bool if additional info like ids without assigned attributes should be printed [Default=False]
+    :param seed: seed for the random runs to make the results reproducible [Default=None]
+    :param workers: number of processes running the random runs in parallel [Default=1]
+    :param progress: method that will get a float [0,1] and message indicating the current progress
+    :return: significance contribution per id or None if the target has less than two mapped ids
+    """
+    mapper.check_for_setup_sources()
+    if mapper.load:
+        mapper.load_mappings()
+    comparator = load_set_comparator(tar=tar, tar_id=tar_id, mode=mode, distance=distance, ref=ref, ref_id=ref_id,
+                                     enriched=enriched, mapper=mapper)
+    if len(comparator.mapping) < 2:
+        return None
+    # ===== Get validation values of input without each id =====
+    ru.print_current_usage('Validation of input without each id ...') if verbose else None
+    loo_values = comparator.compare_leave_one_out()
+    # ===== Get shared validation values of random runs =====
+    ru.print_current_usage('Validation of random runs ...') if verbose else None
+    comparator.input_run = False
+    comp_values = get_random_runs_values(comparator=comparator, mode=mode, mapper=mapper, tar_id=tar_id, runs=runs,
+                                         seed=seed, workers=workers, size=len(comparator.id_set) - 1,
+                                         progress=(lambda value, message: progress(0.05 + 0.9 * value, message))
+                                         if progress is not None else None)
+    # ===== Calculate significance contribution =====
+    measure_short = {"jaccard": "JI-based", "overlap": "OC-based"}
+    results_sig = dict()
+    for excluded, loo_value in loo_values.items():
+        p_values = {measure_short[distance]: eu.calc_pvalue(test_value=loo_value, random_values=comp_values[0],
+                                                            maximize=True)}
+        new_df = pd.DataFrame(p_values) - pd.DataFrame(results["p_values"]['values'])
+        results_sig[excluded] = new_df.to_dict()
+    progress(1.0, str(len(results_sig)) + "/" + str(len(tar)) + " significance contributions calculated ...") \
+        if progress is not None else None
+    return results_sig
+
+
 def transform_dict(in_dict):
     """
     Transform dictionary from significance calculation.
@@ -442,14 +690,14 @@ if __name__ == "__main__":
     desc = "            Evaluation of disease and gene sets, clusterings or subnetworks."
     args = ru.save_parameters(script_desc=desc,
                               arguments=('r', 'ri', 't', 'ti', 'm', 'o', 'e', 'c', 'v', 'b', 'pr', 'p', 'dg',
-                                         'n', 'ni', 'np', 'sc'))
+                                         'n', 'ni', 'np', 'sd', 'w', 'sc'))
     mapper = FileMapper()
     res = single_validation(tar=args.target, tar_id=args.target_id_type, verbose=args.verbose,
                             mode=args.mode, ref=args.reference, ref_id=args.reference_id_type, mapper=mapper,
                             enriched=args.enriched, runs=args.runs, distance=args.distance_measure,
                             background_model=args.background_model, replace=args.replace,
                             network_data={"network_file": args.network, "prop_name": args.network_property_name,
-                                          "id_type": args.network_id_type})
+                                          "id_type": args.network_id_type}, seed=args.seed, workers=args.workers)
     # ===== Saving final files and results =====
     ru.print_current_usage('Save files') if args.verbose else None
     Path(args.out_dir).mkdir(parents=True, exist_ok=True)  # make sure output dir exists
@@ -470,7 +718,8 @@ if __name__ == "__main__":
                                                  background_model=args.background_model, replace=args.replace,
                                                  network_data={"network_file": args.network,
                                                                "prop_name": args.network_property_name,
-                                                               "id_type": args.network_id_type})
+                                                               "id_type": args.network_id_type},
+                                                 seed=args.seed, workers=args.workers)
             ru.print_current_usage('Save files') if args.verbose else None
             save_contribution_results(results=res_sig, prefix=pref, out_dir=args.out_dir)
             if args.plot:
@@ -0,0 +1,53 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class NotFoundClient:
+    """
+    Biothings client without hits for any query.
+    """
+
+    def querymany(self, queries, **kwargs):
+        return [{'query': query, 'notfound': True} for query in queries]
+
+    def getdiseases(self, queries, **kwargs):
+        return self.querymany(queries)
+
+
+def not_found_client(client_type: str, **kwargs) -> NotFoundClient:
+    return NotFoundClient()
+
+
+@pytest.fixture
+def gene_mapper():
+    """
+    Mapper with small gene id and gene attribute mappings in memory. Symbols S0 to S39 belong to
+    entrez ids 0 to 39, some of them to entrez ids 40 to 54 as well. Symbols S41 to S45 belong to entrez
+    ids 60 to 64. Entrez ids 50 to 59 have no attribute values, entrez ids 60 to 64 have no attribute row
+    at all. Ids missing in the mappings are not found by lookups.
+    """
+    from evaluation import config as c
+    from evaluation.mappers.mapper import Mapper
+    from evaluation.mappers.lookup_cache import LookupCache
+    from evaluation.mappers.biothings_fetcher import BiothingsFetcher
+    rng = np.random.default_rng(0)
+    gene_atts = pd.DataFrame({'entrezgene': [str(index) for index in range(60)], **{
+        attribute: [set("t" + str(term) for term in rng.choice(15, rng.integers(0, 4) if index < 50 else 0,
+                                                                replace=False)) for index in range(60)]
+        for attribute in c.GENE_ATTRIBUTES_KEY}})
+    pairs = [(str(index), "S" + str(index)) for index in range(40)] + \
+            [(str(40 + index // 4), "S" + str(index)) for index in range(0, 40, 4)] + \
+            [(str(50 + index // 9), "S" + str(index)) for index in range(0, 40, 9)] + \
+            [(str(60 + index), "S" + str(41 + index)) for index in range(5)]
+    gene_ids = pd.DataFrame(pairs, columns=['entrezgene', 'symbol'])
+    for column in c.GENE_IDS[2:]:
+        gene_ids[column] = ""
+    mapper = Mapper(lookup_cache=LookupCache(fetcher=BiothingsFetcher(client_factory=not_found_client)))
+    mapper.set_loaded_mapping(key='gene_ids', mapping=gene_ids)
+    mapper.set_loaded_mapping(key='gene_atts', mapping=gene_atts)
+    return mapper
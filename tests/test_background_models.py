@@ -0,0 +1,56 @@
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip("graph_tool", reason="the evaluation package imports graph_tool")
+
+from evaluation import background_models as bm, config as c
+
+
+class FakeGraph:
+
+    def set_directed(self, directed: bool):
+        pass
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    network_file = str(tmp_path / "network.graphml")
+    with open(network_file, 'w') as f:
+        f.write("network")
+    calls = []
+
+    def generate_rand_modules(G, N, ccs_num, MS, rng):
+        calls.append((N, ccs_num, MS))
+        return [set(range(index, index + MS)) for index in range(N)]
+
+    monkeypatch.setattr(bm, "load_network", lambda network_file, prop_name: (FakeGraph(), None))
+    monkeypatch.setattr(bm, "generate_rand_modules", generate_rand_modules)
+    store = bm.NetworkModuleStore(network_file=network_file)
+    store.generate(sizes=[2], ccs=[1, 2, 3], rng=np.random.default_rng(0))
+    return store, calls
+
+
+def test_pool_is_larger_than_runs(store):
+    store, calls = store
+    runs = c.NUMBER_OF_RANDOM_RUNS * c.NETWORK_MODULE_POOL_FACTOR
+    assert calls == [(runs, 1, 2), (runs, 2, 2)]
+    assert c.NETWORK_MODULE_POOL_FACTOR > 1
+    first = store.sample(size=2, ccs_num=1, N=c.NUMBER_OF_RANDOM_RUNS, rng=np.random.default_rng(1))
+    second = store.sample(size=2, ccs_num=1, N=c.NUMBER_OF_RANDOM_RUNS, rng=np.random.default_rng(2))
+    assert len(first) == c.NUMBER_OF_RANDOM_RUNS
+    assert len({tuple(module) for module in first}) == c.NUMBER_OF_RANDOM_RUNS
+    assert {tuple(module) for module in first} != {tuple(module) for module in second}
+    assert all(len(module) == 2 for module in first)
+
+
+def test_sample_without_modules(store):
+    store, _ = store
+    assert store.sample(size=2, ccs_num=3, N=1, rng=np.random.default_rng(0)) is None
+    assert store.sample(size=2, ccs_num=1, N=c.NUMBER_OF_RANDOM_RUNS * c.NETWORK_MODULE_POOL_FACTOR + 1,
+                        rng=np.random.default_rng(0)) is None
+    # ===== a changed network invalidates the store =====
+    with open(store.network_file, 'a') as f:
+        f.write(" changed")
+    assert store.sample(size=2, ccs_num=1, N=1, rng=np.random.default_rng(0)) is None
+    assert not os.path.isdir(os.path.join(store.path, "2_3"))
@@ -0,0 +1,109 @@
+import threading
+import time
+import pandas as pd
+import pytest
+
+pytest.importorskip("graph_tool", reason="the evaluation package imports graph_tool")
+
+from evaluation import config as c
+from evaluation.mappers import biothings_fetcher as bf, gene_getter as gg
+from evaluation.mappers.lookup_cache import LookupCache
+from evaluation.mappers.mapper import Mapper
+
+
+class FakeClient:
+    """
+    Biothings client with one hit with attributes for every query. Chunks with the first query
+    take longer, a number of calls fail before the first success.
+    """
+
+    def __init__(self, failures: int = 0, slow_query: str = None, on_call=None):
+        self.failures = failures
+        self.slow_query = slow_query
+        self.on_call = on_call
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def querymany(self, queries, **kwargs):
+        with self._lock:
+            self.calls.append(list(queries))
+            if self.failures > 0:
+                self.failures -= 1
+                raise ConnectionError("connection reset")
+        if self.on_call is not None:
+            self.on_call(queries)
+        if self.slow_query in queries:
+            time.sleep(0.2)
+        return [{'query': query, '_id': query, '_score': 1.0,
+                 'go': {'BP': [{'id': "GO:" + query}], 'CC': [{'id': "GO:C"}], 'MF': [{'id': "GO:M"}]},
+                 'pathway': {'kegg': [{'id': "hsa" + query}]}} for query in queries]
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(bf.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def create_fetcher(client, **kwargs) -> bf.BiothingsFetcher:
+    return bf.BiothingsFetcher(client_factory=lambda client_type, **client_kwargs: client, **kwargs)
+
+
+def test_query_keeps_order_of_completed_chunks():
+    client = FakeClient(slow_query="0")
+    fetcher = create_fetcher(client=client, chunk_size=2, workers=3)
+    queries = [str(query) for query in range(6)]
+    chunks = [chunk for chunk, _ in fetcher.fetch(client_type="gene", method="querymany", queries=queries)]
+    assert chunks[-1] == ["0", "1"]
+    hits = LookupCache(fetcher=fetcher).query(client_type="gene", method="querymany", queries=queries)
+    assert hits['query'].tolist() == queries
+
+
+def test_failed_chunk_is_retried_with_backoff(sleeps):
+    client = FakeClient(failures=2)
+    fetcher = create_fetcher(client=client, chunk_size=2, workers=1, retries=3, backoff=0.5)
+    results = list(fetcher.fetch(client_type="gene", method="querymany", queries=["1", "2", "3"]))
+    assert [chunk for chunk, _ in results] == [["1", "2"], ["3"]]
+    assert [[hit['query'] for hit in hits] for _, hits in results] == [["1", "2"], ["3"]]
+    # ===== only the failed chunk is repeated =====
+    assert client.calls == [["1", "2"], ["1", "2"], ["1", "2"], ["3"]]
+    assert sleeps == [0.5, 1.0]
+
+
+def test_fetch_gives_up_after_retries(sleeps):
+    client = FakeClient(failures=10)
+    fetcher = create_fetcher(client=client, workers=1, retries=2, backoff=1.0)
+    with pytest.raises(ConnectionError):
+        list(fetcher.fetch(client_type="gene", method="querymany", queries=["1"]))
+    assert len(client.calls) == 3
+    assert sleeps == [1.0, 2.0]
+
+
+def test_client_is_created_once_per_type():
+    created = []
+    fetcher = bf.BiothingsFetcher(client_factory=lambda client_type, **kwargs: created.append(
+        (client_type, kwargs)) or FakeClient(), urls={'gene': "http://localhost:1"}, workers=1)
+    for _ in range(3):
+        fetcher.get_client(client_type="gene")
+        fetcher.get_client(client_type="disease")
+    assert created == [("gene", {'url': "http://localhost:1"}), ("disease", dict())]
+
+
+def test_fetched_chunks_are_added_to_the_mapper_while_fetching():
+    loaded = []
+    client = FakeClient(on_call=lambda queries: loaded.append(len(mapper.get_columnar_mapping(key='gene_atts'))))
+    mapper = Mapper(lookup_cache=LookupCache(fetcher=create_fetcher(client=client, chunk_size=2, workers=1)))
+    gene_ids = pd.DataFrame({'entrezgene': [str(index) for index in range(1, 6)],
+                             'symbol': ["S" + str(index) for index in range(1, 6)]})
+    for column in c.GENE_IDS[2:]:
+        gene_ids[column] = ""
+    mapper.set_loaded_mapping(key='gene_ids', mapping=gene_ids)
+    mapping = gg.get_gene_to_attributes(gene_set={str(index) for index in range(1, 6)}, id_type="entrez",
+                                        mapper=mapper)
+    assert len(client.calls) == 3
+    # ===== every chunk is in the mapper before the next one is fetched =====
+    assert loaded == [0, 2, 4]
+    assert len(mapper.get_columnar_mapping(key='gene_atts')) == 5
+    assert set(mapping['entrezgene']) == {str(index) for index in range(1, 6)}
+    assert mapper.loaded_mappings['gene_atts'].set_index('entrezgene')['go.BP']['3'] == {"GO:3"}
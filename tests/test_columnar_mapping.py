@@ -0,0 +1,143 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("graph_tool", reason="the evaluation package imports graph_tool")
+
+from evaluation.mappers import mapping_utils as mu
+from evaluation.mappers.columnar_mapping import ColumnarMapping, InvertedIndex
+from evaluation.mappers.mapper import FileMapper
+
+
+def mapping(ids, values) -> pd.DataFrame:
+    return pd.DataFrame({'entrezgene': ids, 'go_BP': values})
+
+
+def assert_index_equal(index: InvertedIndex, expected: InvertedIndex):
+    assert list(index.terms) == list(expected.terms)
+    np.testing.assert_array_equal(index.indptr, expected.indptr)
+    np.testing.assert_array_equal(index.entities, expected.entities)
+    assert index.size == expected.size
+
+
+def test_concat_merges_postings_into_built_indices(monkeypatch):
+    first = ColumnarMapping.from_frame(mapping(['1', '2', '3'], [{"b", "c"}, set(), {"c"}]))
+    second = ColumnarMapping.from_frame(mapping(['2', '4', '5'], [{"a", "c"}, {"d"}, {"b"}]))
+    expected = first.concat(second)
+    expected = {column: expected.get_index(column=column) for column in ['entrezgene', 'go_BP']}
+    for column in ['entrezgene', 'go_BP']:
+        first.get_index(column=column)
+    # ===== the carried indices are not built again =====
+    monkeypatch.setattr(InvertedIndex, "from_codes", None)
+    merged = first.concat(second)
+    for column in ['entrezgene', 'go_BP']:
+        assert_index_equal(index=merged.get_index(column=column), expected=expected[column])
+    np.testing.assert_array_equal(merged.find(column='go_BP', values=["c", "a"])[0], [0, 2, 3, 3])
+    np.testing.assert_array_equal(merged.find(column='entrezgene', values=["2"])[0], [1, 3])
+
+
+@pytest.fixture
+def index() -> InvertedIndex:
+    columnar = ColumnarMapping.from_frame(mapping(['1', '2', '3', '4'], [{"b", "c"}, set(), {"c"}, {"a", "c"}]))
+    return columnar.get_index(column='go_BP')
+
+
+def test_inverted_index_queries(index):
+    assert list(index.terms) == ["a", "b", "c"]
+    positions, entities = index.get_term_entities(terms=["c", "x", "a"])
+    np.testing.assert_array_equal(positions, [0, 0, 0, 2])
+    np.testing.assert_array_equal(entities, [0, 2, 3, 3])
+    np.testing.assert_array_equal(index.get_entities(terms=["a", "b", "x"]), [0, 3])
+    np.testing.assert_array_equal(index.get_entities(terms=["x"]), [])
+    np.testing.assert_array_equal(index.get_code_entities(codes=np.array([1, 0, 1])), [0, 3])
+    np.testing.assert_array_equal(index.get_counts(), [1, 1, 3])
+    np.testing.assert_array_equal(index.get_matrix().toarray(), [[0, 0, 0, 1], [1, 0, 0, 0], [1, 0, 1, 1]])
+
+
+def test_inverted_index_save_and_load_memory_mapped(index, tmp_path):
+    index.save(path=str(tmp_path / "index"))
+    assert InvertedIndex.is_saved(path=str(tmp_path / "index"))
+    assert not InvertedIndex.is_saved(path=str(tmp_path))
+    loaded = InvertedIndex.load(path=str(tmp_path / "index"), terms=index.terms, size=index.size)
+    assert isinstance(loaded.entities, np.memmap)
+    assert not loaded.entities.flags.writeable
+    assert_index_equal(index=loaded, expected=index)
+    np.testing.assert_array_equal(loaded.get_entities(terms=["a", "b"]), index.get_entities(terms=["a", "b"]))
+
+
+def test_save_and_load_keep_mapping_and_indices(tmp_path):
+    columnar = ColumnarMapping.from_frame(mapping(['1', '2', '3'], [{"b", "c"}, set(), "c;a"]))
+    (tmp_path / "source.csv").write_text("entrezgene,go_BP\n")
+    columnar.get_index(column='go_BP')
+    columnar.save(path=str(tmp_path / "columnar"), source_file=str(tmp_path / "source.csv"))
+    assert ColumnarMapping.is_current(path=str(tmp_path / "columnar"), source_file=str(tmp_path / "source.csv"))
+    loaded = ColumnarMapping.load(path=str(tmp_path / "columnar"))
+    pd.testing.assert_frame_equal(loaded.to_frame(), columnar.to_frame())
+    assert isinstance(loaded.columns['go_BP']['indices'], np.memmap)
+    assert_index_equal(index=loaded.get_index(column='go_BP'), expected=columnar.get_index(column='go_BP'))
+    # ===== a changed source file makes the saved mapping stale =====
+    (tmp_path / "source.csv").write_text("entrezgene,go_BP\n4,d\n")
+    assert not ColumnarMapping.is_current(path=str(tmp_path / "columnar"), source_file=str(tmp_path / "source.csv"))
+    assert not ColumnarMapping.is_current(path=str(tmp_path / "columnar"), source_file=str(tmp_path / "missing.csv"))
+
+
+def test_interrupted_save_is_not_current(tmp_path):
+    (tmp_path / "source.csv").write_text("entrezgene,go_BP\n")
+    columnar = ColumnarMapping.from_frame(mapping(['1'], [{"a"}]))
+    columnar.save(path=str(tmp_path / "columnar"), source_file=str(tmp_path / "source.csv"))
+    os.remove(tmp_path / "columnar" / "source.npy")
+    assert not ColumnarMapping.is_current(path=str(tmp_path / "columnar"), source_file=str(tmp_path / "source.csv"))
+
+
+def test_file_mapper_reuses_current_columnar_mappings(tmp_path, monkeypatch):
+    frames = {'gene_atts': mapping(['1', '2'], [{"b", "a"}, set()]),
+              'disorder_atts': pd.DataFrame({'mondo': ['M1'], 'ctd.pathway_related_to_disease': [{"p"}]}),
+              'gene_ids': pd.DataFrame({'entrezgene': ['1'], 'symbol': [{"A"}]}),
+              'disorder_ids': pd.DataFrame({'mondo': ['M1'], 'ICD-10': [{"A01"}]})}
+    mapper = FileMapper(files_dir=str(tmp_path))
+    for key, frame in frames.items():
+        mapper.update_mappings(in_df=frame, key=key)
+    mapper.save_mappings()
+    # ===== the file keeps the format of the baseline with values joined by ';' =====
+    source_file = os.path.join(str(tmp_path), mapper.file_names['gene_atts'])
+    with open(source_file) as f:
+        assert f.read() == "entrezgene,go_BP\n1,a;b\n2,\n"
+    saved = pd.read_csv(source_file, dtype=str).fillna('')
+    assert saved['go_BP'].apply(mu.string_to_set).tolist() == frames['gene_atts']['go_BP'].tolist()
+    parsed = []
+    parse = FileMapper._load_file_mapping
+    monkeypatch.setattr(FileMapper, "_load_file_mapping", lambda self, file, sep, mapping_name: parsed.append(
+        mapping_name) or parse(self, file=file, sep=sep, mapping_name=mapping_name))
+    copy = FileMapper(files_dir=str(tmp_path))
+    copy.load_mappings()
+    assert parsed == []
+    pd.testing.assert_frame_equal(copy.get_columnar_mapping(key='gene_atts').to_frame(),
+                                  mapper.get_columnar_mapping(key='gene_atts').to_frame())
+    # ===== a changed file is parsed again and its columnar mapping saved anew =====
+    with open(source_file, 'a') as f:
+        f.write("3,c\n")
+    copy = FileMapper(files_dir=str(tmp_path))
+    copy.load_mappings()
+    assert parsed == ['gene_atts']
+    assert list(copy.get_columnar_mapping(key='gene_atts').ids) == ['1', '2', '3']
+    assert ColumnarMapping.is_current(path=copy.get_columnar_path(key='gene_atts'), source_file=source_file)
+
+
+def test_term_codes_are_stable_across_concat_and_save(tmp_path):
+    columnar = ColumnarMapping.from_frame(mapping(['1', '2'], [{"go:2", "go:1"}, {"go:3"}]))
+    codes = {term: code for code, term in enumerate(columnar.get_terms(column='go_BP'))}
+    assert columnar.columns['go_BP']['indices'].dtype == np.int32
+    columnar.save(path=str(tmp_path / "columnar"))
+    loaded = ColumnarMapping.load(path=str(tmp_path / "columnar"))
+    # ===== new terms are appended, the codes of known terms and of the saved rows stay =====
+    grown = loaded.concat(ColumnarMapping.from_frame(mapping(['3', '4'], [{"go:0", "go:3"}, {"go:1"}])))
+    terms = grown.get_terms(column='go_BP')
+    assert list(terms[:len(codes)]) == list(codes)
+    assert list(terms[len(codes):]) == ["go:0"]
+    np.testing.assert_array_equal(grown.columns['go_BP']['indices'][:3], columnar.columns['go_BP']['indices'])
+    np.testing.assert_array_equal(grown.columns['go_BP']['indices'][3:], [codes["go:3"], 3, codes["go:1"]])
+    grown.save(path=str(tmp_path / "columnar"))
+    reloaded = ColumnarMapping.load(path=str(tmp_path / "columnar"))
+    assert list(reloaded.get_terms(column='go_BP')) == list(terms)
+    assert reloaded.to_frame()['go_BP'].tolist() == [{"go:1", "go:2"}, {"go:3"}, {"go:0", "go:3"}, {"go:1"}]
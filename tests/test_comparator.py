@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("graph_tool", reason="the evaluation package imports graph_tool")
+
+from evaluation import comparator as comp, config as c
+from evaluation.mappers.mapper import FileMapper
+
+
+def random_set(rng, terms: int = 30, size: int = 6) -> set:
+    return set("t" + str(term) for term in rng.choice(terms, rng.integers(0, size), replace=False))
+
+
+@pytest.fixture
+def gene_atts():
+    rng = np.random.default_rng(0)
+    # ===== some ids have several rows =====
+    ids = [str(index) for index in range(80)] + [str(index) for index in rng.choice(80, 20, replace=False)]
+    return pd.DataFrame({'entrezgene': ids, **{attribute: [random_set(rng) for _ in ids]
+                                               for attribute in c.GENE_ATTRIBUTES_KEY}})
+
+
+@pytest.fixture
+def mapper(gene_atts, tmp_path):
+    mapper = FileMapper(files_dir=str(tmp_path))
+    mapper.set_loaded_mapping(key='gene_atts', mapping=gene_atts)
+    return mapper
+
+
+def set_mapping(gene_atts: pd.DataFrame, ids) -> pd.DataFrame:
+    """
+    Mapping of a set as loaded by load_target, with the values of all rows of an id united.
+    """
+    subset = gene_atts[gene_atts['entrezgene'].isin(ids)]
+    return subset.groupby('entrezgene', as_index=False).agg(lambda sets: set().union(*sets))
+
+
+def set_set_comparator(mapper, distance_measure: str) -> comp.SetSetComparator:
+    rng = np.random.default_rng(1)
+    comparator = comp.SetSetComparator(mapper=mapper, distance_measure=distance_measure)
+    comparator.att_key, comparator.att_id, comparator.id_type = 'gene_atts', 'entrezgene', 'entrez'
+    comparator.input_run = False
+    comparator.ref_dict = {attribute: random_set(rng, size=12) for attribute in c.GENE_ATTRIBUTES_KEY}
+    return comparator
+
+
+@pytest.mark.parametrize("distance_measure", ["jaccard", "overlap"])
+@pytest.mark.parametrize("threshold", [0.0, 0.1])
+def test_set_set_compare_batch_equals_compare(mapper, gene_atts, distance_measure, threshold):
+    comparator = set_set_comparator(mapper=mapper, distance_measure=distance_measure)
+    rng = np.random.default_rng(2)
+    modules = [rng.choice(80, rng.integers(1, 15), replace=False).astype(str) for _ in range(30)]
+    padded = np.full((len(modules), 15), -1)
+    for run, module in enumerate(modules):
+        padded[run, :len(module)] = comparator.get_indices(att_ids=module)
+    assert (padded >= 0).sum() == sum(len(module) for module in modules)
+    expected = list()
+    for module in modules:
+        comparator.mapping = set_mapping(gene_atts=gene_atts, ids=module)
+        expected.append(comparator.compare(threshold=threshold)[0])
+    assert comparator.compare_batch(modules=padded, threshold=threshold).to_dict('records') == expected
+
+
+def test_set_set_compare_batch_counts_members_without_attributes(mapper, gene_atts):
+    comparator = set_set_comparator(mapper=mapper, distance_measure="jaccard")
+    rng = np.random.default_rng(3)
+    missing = np.array(["x" + str(index) for index in range(5)], dtype=object)
+    modules = [np.concatenate((rng.choice(80, rng.integers(0, 8), replace=False).astype(str),
+                               rng.choice(missing, rng.integers(1, 4), replace=False))) for _ in range(30)]
+    padded = np.full((len(modules), 15), -1)
+    for run, module in enumerate(modules):
+        indices = comparator.get_indices(att_ids=module)
+        # ===== ids without attribute row get distinct indices below -1 =====
+        indices[indices < 0] = -2 - pd.Index(missing).get_indexer(module[indices < 0])
+        padded[run, :len(module)] = indices
+    expected = list()
+    for module in modules:
+        # ===== ids with an id mapping but without attribute row have empty sets, like after map_to_prev_id =====
+        without_atts = pd.DataFrame({'entrezgene': [x for x in module if x in missing],
+                                     **{attribute: [set() for x in module if x in missing]
+                                        for attribute in c.GENE_ATTRIBUTES_KEY}})
+        comparator.mapping = pd.concat([set_mapping(gene_atts=gene_atts, ids=module), without_atts],
+                                       ignore_index=True)
+        expected.append(comparator.compare()[0])
+    assert comparator.compare_batch(modules=padded).to_dict('records') == expected
+
+
+def test_set_set_get_indices(mapper):
+    comparator = set_set_comparator(mapper=mapper, distance_measure="jaccard")
+    indices = comparator.get_indices(att_ids=['5', 'unknown', '79', '5'])
+    assert indices[1] == -1 and indices[0] == indices[3]
+    assert comparator.get_table_groups()[0][indices[[0, 2]]].tolist() == ['5', '79']
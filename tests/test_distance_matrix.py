@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+pytest.importorskip("graph_tool", reason="the evaluation package imports graph_tool")
+
+from evaluation.mappers.distance_matrix import DistanceMatrix
+
+
+def padded(matrix: sp.spmatrix, size: int) -> np.ndarray:
+    dense = np.zeros((size, size))
+    dense[:matrix.shape[0], :matrix.shape[1]] = matrix.toarray()
+    return dense
+
+
+@pytest.fixture
+def matrices():
+    base = sp.random(4, 4, density=0.5, format='csr', random_state=0)
+    # ===== distances of the new ids 4 and then 5, also to the ids of the base =====
+    first = sp.coo_matrix(([0.5, 0.25, 0.75], ([4, 1, 0], [1, 4, 0])), shape=(5, 5))
+    second = sp.coo_matrix(([0.125, 1.0, 0.5], ([5, 3, 4], [3, 5, 1])), shape=(6, 6))
+    matrix = DistanceMatrix(base=base).append(in_mat=first, size=5).append(in_mat=second, size=6)
+    return matrix, base, padded(base, 6) + padded(first, 6) + second.toarray()
+
+
+def test_append_and_compact_equal_dense(matrices):
+    matrix, base, dense = matrices
+    assert matrix.shape == (6, 6)
+    # ===== the base is only padded, never copied =====
+    assert np.shares_memory(matrix.base.data, base.data)
+    np.testing.assert_array_equal(matrix.tocsr().toarray(), dense)
+    compacted = matrix.compact()
+    assert compacted.delta is None
+    np.testing.assert_array_equal(compacted.base.toarray(), dense)
+    assert compacted.nnz == np.count_nonzero(dense)
+    assert compacted.compact() is compacted
+
+
+def test_select_across_base_and_delta(matrices):
+    matrix, _, dense = matrices
+    rows, cols = np.array([0, 5, 2, 4]), np.array([4, 1, 5, 3])
+    np.testing.assert_array_equal(matrix.select(rows=rows, cols=cols).toarray(), dense[np.ix_(rows, cols)])
+    np.testing.assert_array_equal(matrix.select(rows=rows, cols=rows).toarray(),
+                                  matrix.compact().select(rows=rows, cols=rows).toarray())
+
+
+def test_product_across_base_and_delta(matrices):
+    matrix, _, dense = matrices
+    left = sp.random(3, 6, density=0.5, format='csr', random_state=1)
+    np.testing.assert_allclose(matrix.product(left=left).toarray(), left.toarray() @ dense)
+    np.testing.assert_allclose(matrix.compact().product(left=left).toarray(), left.toarray() @ dense)
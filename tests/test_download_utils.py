@@ -0,0 +1,175 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+pytest.importorskip("graph_tool", reason="the evaluation package imports graph_tool")
+
+from evaluation.d_utils import download_utils as du
+
+CONTENT = bytes(range(256)) * 40
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """
+    Serve CONTENT at every path with range requests, a path ending on /full ignores ranges and
+    one ending on /nosize sends no Content-Length. The Range header of every request is recorded.
+    """
+
+    def do_HEAD(self):
+        self.send_content(body=False)
+
+    def do_GET(self):
+        self.send_content(body=True)
+
+    def send_content(self, body: bool):
+        self.server.requests.append((self.command, self.headers.get('Range')))
+        start = 0
+        if self.headers.get('Range') is not None and not self.path.endswith("/full"):
+            start = int(self.headers['Range'][len("bytes="):].split("-")[0])
+            if start >= len(CONTENT):
+                self.send_response(416)
+                self.send_header('Content-Length', "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', "bytes " + str(start) + "-" + str(len(CONTENT) - 1) + "/" +
+                             str(len(CONTENT)))
+        else:
+            self.send_response(200)
+        if not self.path.endswith("/nosize"):
+            self.send_header('Content-Length', str(len(CONTENT) - start))
+        self.end_headers()
+        if body:
+            self.wfile.write(CONTENT[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server, path: str = "file") -> str:
+    return "http://127.0.0.1:" + str(server.server_address[1]) + "/" + path
+
+
+def read(file: str) -> bytes:
+    with open(file, 'rb') as f:
+        return f.read()
+
+
+def write(file: str, content: bytes):
+    with open(file, 'wb') as f:
+        f.write(content)
+
+
+def expected(content: bytes = CONTENT) -> dict:
+    return {'size': len(content), 'sha256': hashlib.sha256(content).hexdigest()}
+
+
+def test_download_resumes_partial_file(server, tmp_path):
+    file = str(tmp_path / "file")
+    write(file + ".part", CONTENT[:1000])
+    du.download_file(url=url(server), file=file, expected=expected(), chunk_size=100)
+    assert server.requests == [("GET", "bytes=1000-")]
+    assert read(file) == CONTENT
+    assert not os.path.exists(file + ".part")
+
+
+def test_download_restarts_if_range_is_ignored(server, tmp_path):
+    file = str(tmp_path / "file")
+    write(file + ".part", b"x" * 1000)
+    du.download_file(url=url(server, path="full"), file=file, expected=expected())
+    assert read(file) == CONTENT
+
+
+def test_download_restarts_if_range_is_not_satisfiable(server, tmp_path):
+    file = str(tmp_path / "file")
+    write(file + ".part", b"x" * (len(CONTENT) + 10))
+    du.download_file(url=url(server), file=file, expected=expected())
+    assert server.requests == [("GET", "bytes=" + str(len(CONTENT) + 10) + "-"), ("GET", None)]
+    assert read(file) == CONTENT
+
+
+def test_download_with_wrong_checksum_is_discarded(server, tmp_path):
+    file = str(tmp_path / "file")
+    with pytest.raises(IOError):
+        du.download_file(url=url(server), file=file, expected=expected(content=CONTENT[::-1]))
+    assert not os.path.exists(file)
+    assert not os.path.exists(file + ".part")
+
+
+def test_download_files_skips_current_files(server, tmp_path):
+    write(str(tmp_path / "listed"), CONTENT)
+    write(str(tmp_path / "same_size"), CONTENT)
+    write(str(tmp_path / "other_size"), CONTENT[:10])
+    write(str(tmp_path / "nosize"), CONTENT)
+    downloads = {name: url(server, path=name) for name in ["listed", "same_size", "other_size", "nosize", "new"]}
+    downloaded = du.download_files(downloads=downloads, path=str(tmp_path), manifest={'listed': expected()},
+                                   workers=2)
+    assert sorted(downloaded) == ["new", "nosize", "other_size"]
+    for name in downloads:
+        assert read(str(tmp_path / name)) == CONTENT
+
+
+def test_download_files_links_current_files_of_previous_download(server, tmp_path):
+    current, path = tmp_path / "current", tmp_path / "new"
+    downloads = {name: url(server, path=name) for name in ["same", "converted", "stale", "new"]}
+    du.download_files(downloads={name: downloads[name] for name in ["same", "converted", "stale"]},
+                      path=str(current), workers=1)
+    write(str(current / "stale"), CONTENT[:10])
+    # ===== the conversion removes the download, its output keeps it current =====
+    write(str(current / "converted.npy"), b"converted")
+    du.record_outputs(path=str(current), outputs={'converted': ["converted.npy"]})
+    os.remove(current / "converted")
+    server.requests.clear()
+    downloaded = du.download_files(downloads=downloads, path=str(path), workers=1, current_dir=str(current))
+    assert sorted(downloaded) == ["new", "stale"]
+    assert [request for request in server.requests if request[0] == "GET"] == [("GET", None)] * 2
+    assert os.path.samefile(current / "same", path / "same")
+    assert os.path.samefile(current / "converted.npy", path / "converted.npy")
+    assert not os.path.exists(path / "converted")
+    assert read(str(path / "stale")) == CONTENT
+    # ===== a repeated download into the same directory finds everything current =====
+    assert du.download_files(downloads=downloads, path=str(path), workers=1) == []
+    assert du.load_state(path=str(path))['converted'] == {'expected': {'size': len(CONTENT)},
+                                                           'outputs': ["converted.npy"]}
+
+
+def test_swap_directory(tmp_path):
+    source, target = tmp_path / "target" / "tmp", tmp_path / "target"
+    os.makedirs(source / "jaccard")
+    os.makedirs(target / "jaccard")
+    write(str(source / "mapping.csv"), b"new")
+    write(str(source / "jaccard" / "ids.npy"), b"new")
+    write(str(target / "mapping.csv"), b"old")
+    write(str(target / "jaccard" / "old.npy"), b"old")
+    write(str(target / "cache.sqlite"), b"old")
+    du.swap_directory(source=str(source), target=str(target))
+    # ===== target is flipped to a versioned directory with the old entries missing in source =====
+    assert os.path.islink(target)
+    assert sorted(os.listdir(target)) == ["cache.sqlite", "jaccard", "mapping.csv"]
+    assert os.listdir(target / "jaccard") == ["ids.npy"]
+    assert read(str(target / "mapping.csv")) == b"new"
+    assert read(str(target / "cache.sqlite")) == b"old"
+    version = os.path.realpath(target)
+    with open(target / "mapping.csv", 'rb') as opened:
+        os.makedirs(target / "tmp")
+        write(str(target / "tmp" / "mapping.csv"), b"newer")
+        du.swap_directory(source=str(target / "tmp"), target=str(target))
+        # ===== readers of the previous version keep their open files =====
+        assert opened.read() == b"new"
+    assert read(str(target / "mapping.csv")) == b"newer"
+    assert sorted(os.listdir(target)) == ["cache.sqlite", "jaccard", "mapping.csv"]
+    assert not os.path.exists(version)
+    assert sorted(os.listdir(tmp_path)) == ["target", os.path.basename(os.path.realpath(target))]
@@ -0,0 +1,154 @@
+from collections import deque
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import pytest
+
+pytest.importorskip("graph_tool", reason="the evaluation package imports graph_tool")
+
+from evaluation.d_utils import eval_utils as eu
+
+
+@pytest.fixture
+def att_series():
+    rng = np.random.default_rng(0)
+    return pd.Series([set("t" + str(term) for term in rng.choice(20, rng.integers(0, 5), replace=False))
+                      for _ in range(60)])
+
+
+@pytest.fixture
+def id_to_index():
+    return pd.Index(["id" + str(index) for index in range(60)])
+
+
+def to_triples(matrix) -> list:
+    matrix = matrix.tocoo()
+    return sorted(zip(matrix.row.tolist(), matrix.col.tolist(), matrix.data.tolist()))
+
+
+@pytest.mark.parametrize("coefficient", ["jaccard", "overlap"])
+def test_unique_pairs_equal_full_calculation(att_series, id_to_index, coefficient):
+    old_ids, new_ids = pd.Series(id_to_index[:45]), pd.Series(id_to_index[45:])
+    full = eu.get_distance_matrix(full_att_series=att_series, from_ids=pd.Series(id_to_index),
+                                  id_to_index=id_to_index, coefficient=coefficient)
+    old = eu.get_distance_matrix(full_att_series=att_series, from_ids=old_ids, id_to_index=id_to_index,
+                                 coefficient=coefficient)
+    # ===== new ids are part of from_ids as well, their pairs must not be added twice =====
+    new = eu.get_distance_matrix(full_att_series=att_series, from_ids=pd.Series(id_to_index),
+                                 id_to_index=id_to_index, to_ids=new_ids, coefficient=coefficient,
+                                 unique_pairs=True)
+    assert all(row < col for row, col, _ in to_triples(new))
+    assert to_triples((old + new).tocsr()) == to_triples(full.tocsr())
+
+
+def test_to_ids_keep_all_pairs_by_default(att_series, id_to_index):
+    ids = pd.Series(id_to_index[:10])
+    matrix = eu.get_distance_matrix(full_att_series=att_series, from_ids=ids, id_to_index=id_to_index, to_ids=ids)
+    triples = to_triples(matrix)
+    sizes = att_series[:10].apply(len)
+    # ===== every non empty set has distance 1.0 to itself and every other pair is contained twice =====
+    assert [(row, data) for row, col, data in triples if row == col] == [(index, 1.0) for index in
+                                                                           np.flatnonzero(sizes > 0)]
+    others = [triple for triple in triples if triple[0] != triple[1]]
+    assert others[::2] == others[1::2]
+
+
+@pytest.fixture
+def small_att_series():
+    return pd.Series([{"a", "b", "c"}, {"b", "c", "d"}, set(), {"a"}, {"e"}])
+
+
+def assert_triples(matrix, expected: list):
+    triples = to_triples(matrix)
+    assert [(row, col) for row, col, _ in triples] == [(row, col) for row, col, _ in expected]
+    assert [data for _, _, data in triples] == pytest.approx([data for _, _, data in expected])
+
+
+@pytest.mark.parametrize("block_size,workers", [(1000, 1), (2, 1), (2, 2)])
+def test_distance_matrices_of_known_sets(small_att_series, block_size, workers):
+    id_to_index = pd.Index(["id" + str(index) for index in range(5)])
+    # ===== unordered ids, so that the position in from_ids differs from the matrix index =====
+    mats = eu.get_distance_matrices(full_att_series=small_att_series, from_ids=pd.Series(id_to_index[::-1]),
+                                    id_to_index=id_to_index, block_size=block_size, workers=workers)
+    assert all(matrix.shape == (5, 5) for matrix in mats.values())
+    # ===== {a,b,c} and {b,c,d} share 2 of 4 terms and 2 of 3, {a,b,c} and {a} 1 of 3 and 1 of 1 =====
+    assert_triples(mats['jaccard'], [(0, 1, 0.5), (0, 3, 1 / 3)])
+    assert_triples(mats['overlap'], [(0, 1, 2 / 3), (0, 3, 1.0)])
+
+
+@pytest.mark.parametrize("block_size,workers", [(1000, 1), (1, 1), (1, 2)])
+def test_distance_matrices_to_ids_of_known_sets(small_att_series, block_size, workers):
+    id_to_index = pd.Index(["id" + str(index) for index in range(5)])
+    # ===== overlapping from_ids and to_ids, the shared id 0 has distance 1.0 to itself =====
+    mats = eu.get_distance_matrices(full_att_series=small_att_series, from_ids=pd.Series(["id1", "id0", "id2"]),
+                                    id_to_index=id_to_index, to_ids=pd.Series(["id3", "id0"]),
+                                    block_size=block_size, workers=workers)
+    assert_triples(mats['jaccard'], [(0, 0, 1.0), (0, 1, 0.5), (0, 3, 1 / 3)])
+    assert_triples(mats['overlap'], [(0, 0, 1.0), (0, 1, 2 / 3), (0, 3, 1.0)])
+
+
+@pytest.fixture
+def graph():
+    rng = np.random.default_rng(2)
+    # ===== sparse random graph with several components and a few self loops and parallel edges =====
+    edges = rng.integers(0, 60, size=(80, 2))
+    edges = np.concatenate((edges, edges[:5], [[7, 7]]))
+    targets = np.flatnonzero(rng.random(60) < 0.5)
+    return edges, targets
+
+
+def to_adjacency(edges: np.ndarray, size: int = 60) -> sp.csr_matrix:
+    return sp.csr_matrix((np.ones(2 * len(edges)), (np.concatenate((edges[:, 0], edges[:, 1])),
+                                                    np.concatenate((edges[:, 1], edges[:, 0])))), shape=(size, size))
+
+
+def baseline_distance_pairs(edges: np.ndarray, targets: np.ndarray, distance: int, size: int = 60) -> list:
+    """
+    Pairs as found by the former projection in setup.recreate_network: for every target vertex in order the
+    targets at distance of a shortest_distance(max_dist=distance, target=targets) call, in order of targets.
+    """
+    neighbours = [set() for _ in range(size)]
+    for source, target in edges.tolist():
+        neighbours[source].add(target)
+        neighbours[target].add(source)
+    pairs = list()
+    for from_pos, source in enumerate(targets.tolist()):
+        distances, queue = {source: 0}, deque([source])
+        while queue:
+            vertex = queue.popleft()
+            if distances[vertex] < distance:
+                for neighbour in neighbours[vertex]:
+                    if neighbour not in distances:
+                        distances[neighbour] = distances[vertex] + 1
+                        queue.append(neighbour)
+        pairs.extend((from_pos, to_pos) for to_pos, target in enumerate(targets.tolist())
+                     if distances.get(target) == distance)
+    return pairs
+
+
+@pytest.mark.parametrize("distance", [1, 2, 3])
+@pytest.mark.parametrize("block_size,workers", [(500, 1), (7, 1), (7, 2)])
+def test_distance_pairs_equal_breadth_first_search(graph, distance, block_size, workers):
+    edges, targets = graph
+    from_pos, to_pos = eu.get_distance_pairs(adjacency=to_adjacency(edges=edges), targets=targets,
+                                             distance=distance, block_size=block_size, workers=workers)
+    assert list(zip(from_pos.tolist(), to_pos.tolist())) == baseline_distance_pairs(edges=edges, targets=targets,
+                                                                                     distance=distance)
+
+
+@pytest.mark.parametrize("distance", [2, 3])
+def test_distance_pairs_equal_graph_tool(graph, distance):
+    gt = pytest.importorskip("graph_tool")
+    gtt = pytest.importorskip("graph_tool.topology")
+    edges, targets = graph
+    g = gt.Graph(directed=False)
+    g.add_vertex(60)
+    g.add_edge_list(edges)
+    vertices = [g.vertex(target) for target in targets]
+    pairs = list()
+    for from_pos, vertex in enumerate(vertices):
+        res = gtt.shortest_distance(g, source=vertex, max_dist=distance, target=vertices, directed=False)
+        pairs.extend((from_pos, to_pos) for to_pos in range(len(res)) if res[to_pos] == distance)
+    from_pos, to_pos = eu.get_distance_pairs(adjacency=to_adjacency(edges=edges), targets=targets,
+                                             distance=distance)
+    assert list(zip(from_pos.tolist(), to_pos.tolist())) == pairs
@@ -0,0 +1,114 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("graph_tool", reason="the evaluation package imports graph_tool")
+
+from evaluation.mappers import lookup_cache as lc
+from evaluation.mappers.biothings_fetcher import BiothingsFetcher
+
+
+class FakeClient:
+    """
+    Biothings client with one hit for every even query and none for odd queries, recording all queries.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def querymany(self, queries, **kwargs):
+        self.queries.extend(queries)
+        return [{'query': query, 'symbol': "S" + query} if int(query) % 2 == 0 else {'query': query, 'notfound': True}
+                for query in queries]
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def client():
+    return FakeClient()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(lc.time, "time", clock.time)
+    return clock
+
+
+def create_cache(client, path, **kwargs) -> lc.LookupCache:
+    fetcher = BiothingsFetcher(client_factory=lambda client_type, **client_kwargs: client, chunk_size=100,
+                               workers=1, backoff=0)
+    return lc.LookupCache(file=str(path / "lookups.sqlite"), fetcher=fetcher, **kwargs)
+
+
+def query(cache, queries) -> pd.DataFrame:
+    return cache.query(client_type="gene", method="querymany", queries=queries, scopes="entrezgene")
+
+
+def test_hits_and_misses_are_cached(client, clock, tmp_path):
+    cache = create_cache(client=client, path=tmp_path)
+    first = query(cache=cache, queries=["2", "3"])
+    assert client.queries == ["2", "3"]
+    assert first.set_index('query')['symbol']['2'] == "S2"
+    assert bool(first.set_index('query')['notfound']['3'])
+    # ===== hit and miss come from the cache, only the new id is queried =====
+    second = query(cache=cache, queries=["2", "3", "4"])
+    assert client.queries == ["2", "3", "4"]
+    pd.testing.assert_frame_equal(second[second['query'] != "4"].reset_index(drop=True), first, check_like=True)
+    # ===== other arguments are another request =====
+    cache.query(client_type="gene", method="querymany", queries=["2"], scopes="symbol")
+    assert client.queries == ["2", "3", "4", "2"]
+
+
+def test_entries_expire_after_their_ttl(client, clock, tmp_path):
+    cache = create_cache(client=client, path=tmp_path, ttl=100, negative_ttl=10)
+    query(cache=cache, queries=["2", "3"])
+    clock.now += 9
+    query(cache=cache, queries=["2", "3"])
+    assert client.queries == ["2", "3"]
+    # ===== misses expire first =====
+    clock.now += 2
+    query(cache=cache, queries=["2", "3"])
+    assert client.queries == ["2", "3", "3"]
+    clock.now += 90
+    query(cache=cache, queries=["2"])
+    assert client.queries == ["2", "3", "3", "2"]
+    clock.now += 5
+    cache.clear()
+    with cache._connect() as connection:
+        assert [row[0] for row in connection.execute("SELECT query FROM lookups")] == ["2"]
+
+
+def test_cache_lookup_of_many_ids(client, clock, tmp_path):
+    cache = create_cache(client=client, path=tmp_path)
+    queries = [str(query) for query in range(1234)]
+    first = query(cache=cache, queries=queries)
+    client.queries.clear()
+    second = query(cache=cache, queries=queries)
+    assert client.queries == []
+    assert len(second) == len(queries)
+    pd.testing.assert_frame_equal(second.sort_values('query').reset_index(drop=True),
+                                  first.sort_values('query').reset_index(drop=True), check_like=True)
+
+
+def test_cache_without_file_queries_everything(client, clock):
+    fetcher = BiothingsFetcher(client_factory=lambda client_type, **client_kwargs: client, workers=1)
+    cache = lc.LookupCache(fetcher=fetcher)
+    query(cache=cache, queries=["2", "3"])
+    query(cache=cache, queries=["2", "3"])
+    assert client.queries == ["2", "3", "2", "3"]
+
+
+def test_to_dataframe():
+    hits = {'1': [{'query': '1', 'go': {'BP': 'a'}}, {'query': '1', 'go': {'BP': 'b'}}], '2': []}
+    frame = lc._to_dataframe(queries=['2', '1'], hits=hits)
+    assert frame['query'].tolist() == ['1', '1', '2']
+    assert frame['go.BP'].tolist()[:2] == ['a', 'b']
+    assert frame['notfound'].tolist()[2] is True
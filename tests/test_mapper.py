@@ -0,0 +1,222 @@
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sp
+
+pytest.importorskip("graph_tool", reason="the evaluation package imports graph_tool")
+
+from evaluation.mappers.columnar_mapping import ColumnarMapping
+from evaluation.mappers import store_utils as su
+from evaluation.mappers.mapper import FileMapper, Mapper, MappingCache
+
+
+def gene_atts(ids) -> pd.DataFrame:
+    return pd.DataFrame({'entrezgene': ids, 'go_BP': [{"t" + str(index)} for index in range(len(ids))]})
+
+
+def test_update_mappings_drops_loaded_ids():
+    mapper = Mapper()
+    mapper.update_mappings(in_df=gene_atts(['1', '2']), key='gene_atts')
+    # ===== as if a second thread fetched id 2 at the same time =====
+    mapper.update_mappings(in_df=gene_atts(['2', '3', '3']), key='gene_atts')
+    assert list(mapper.get_columnar_mapping(key='gene_atts').ids) == ['1', '2', '3']
+    assert mapper.loaded_mappings['gene_atts']['go_BP'].tolist() == [{"t0"}, {"t1"}, {"t1"}]
+    mapper.update_mappings(in_df=gene_atts(['1']), key='gene_atts')
+    assert len(mapper.get_columnar_mapping(key='gene_atts')) == 3
+
+
+def test_update_mappings_keeps_rows_of_id_mappings():
+    mapper = Mapper()
+    ids = pd.DataFrame({'entrezgene': ['1', '1'], 'symbol': ['A', 'B']})
+    mapper.update_mappings(in_df=ids, key='gene_ids')
+    mapper.update_mappings(in_df=ids, key='gene_ids')
+    assert len(mapper.get_columnar_mapping(key='gene_ids')) == 4
+
+
+def test_distance_indices_of_repeated_ids():
+    mapper = Mapper()
+    mapper.set_loaded_distance_ids(key='gene_mat_ids', index=pd.Index(['1', '2', '1', '3', '2'], dtype=object))
+    indices = mapper.get_distance_indices(in_series=pd.Series(['2', '4', '1', '3']), id_type='gene_mat_ids')
+    np.testing.assert_array_equal(indices, [1, -1, 0, 3])
+    mapper.set_loaded_distance_ids(key='gene_mat_ids', index=pd.Index(['1', '2', '3'], dtype=object))
+    indices = mapper.get_distance_indices(in_series=pd.Series(['3', '4']), id_type='gene_mat_ids')
+    np.testing.assert_array_equal(indices, [2, -1])
+
+
+def test_mapping_cache_converts_once(monkeypatch):
+    calls = {'to_frame': 0, 'from_frame': 0}
+    to_frame, from_frame = ColumnarMapping.to_frame, ColumnarMapping.from_frame.__func__
+
+    def slow_to_frame(self, *args, **kwargs):
+        calls['to_frame'] += 1
+        time.sleep(0.05)
+        return to_frame(self, *args, **kwargs)
+
+    def slow_from_frame(cls, *args, **kwargs):
+        calls['from_frame'] += 1
+        time.sleep(0.05)
+        return from_frame(cls, *args, **kwargs)
+
+    monkeypatch.setattr(ColumnarMapping, "to_frame", slow_to_frame)
+    monkeypatch.setattr(ColumnarMapping, "from_frame", classmethod(slow_from_frame))
+    columnar = ColumnarMapping.from_frame(gene_atts(['1', '2']))
+    cache = MappingCache(keys=['gene_atts', 'gene_ids']).replace(key='gene_atts', columnar=columnar)
+    cache = cache.replace(key='gene_ids', mapping=pd.DataFrame({'entrezgene': ['1'], 'symbol': ['A']}))
+    calls['from_frame'] = 0
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        frames = list(pool.map(lambda _: cache['gene_atts'], range(4)))
+        encoded = list(pool.map(lambda _: cache.get_columnar('gene_ids'), range(4)))
+    assert calls == {'to_frame': 1, 'from_frame': 1}
+    assert all(frame is frames[0] for frame in frames)
+    assert all(columnar is encoded[0] for columnar in encoded)
+
+
+def test_pickled_mapper_reopens_saved_distances(tmp_path):
+    mapper = FileMapper(files_dir=str(tmp_path))
+    mapper.update_mappings(in_df=gene_atts(['1', '2']), key='gene_atts')
+    saved = sp.random(5, 5, density=0.4, format='csr', random_state=0)
+    su.save_sparse(matrix=saved, path=mapper.get_store_path(key='go_BP', distance_measure='jaccard'))
+    mapper.get_distance_matrix(key='go_BP', distance_measure='jaccard')
+    mapper.update_distance_ids(in_series=pd.Series([str(index) for index in range(5)]), key='gene_mat_ids')
+    changed = sp.random(5, 5, density=0.4, format='csr', random_state=1)
+    mapper.update_distances(in_mat=changed.tocoo(), id_type='gene_mat_ids', key='go_BP', distance_measure='overlap')
+    copy = pickle.loads(pickle.dumps(mapper))
+    # ===== saved matrices are memory mapped again, unsaved ones are pickled =====
+    assert copy.loaded_distances['jaccard']['go_BP'] is None
+    assert copy.loaded_distances['overlap']['go_BP'] is not None
+    assert (copy.get_distance_matrix(key='go_BP', distance_measure='jaccard').tocsr() != saved).nnz == 0
+    assert (copy.get_distance_matrix(key='go_BP', distance_measure='overlap').tocsr() !=
+            mapper.get_distance_matrix(key='go_BP', distance_measure='overlap').tocsr()).nnz == 0
+    assert copy.loaded_mappings['gene_atts'].equals(mapper.loaded_mappings['gene_atts'])
+    copy.update_mappings(in_df=gene_atts(['3']), key='gene_atts')
+    assert len(copy.get_columnar_mapping(key='gene_atts')) == 3
+    assert len(mapper.get_columnar_mapping(key='gene_atts')) == 2
+
+
+def save_distances(mapper: FileMapper, keys) -> dict:
+    saved = {key: sp.random(5, 5, density=0.4, format='csr', random_state=index) for index, key in enumerate(keys)}
+    for key, matrix in saved.items():
+        su.save_sparse(matrix=matrix, path=mapper.get_store_path(key=key, distance_measure='jaccard'))
+    return saved
+
+
+def resident(mapper: Mapper) -> set:
+    return {(distance_measure, key) for distance_measure, matrices in mapper.loaded_distances.items()
+            for key, matrix in matrices.items() if matrix is not None}
+
+
+def test_distances_are_evicted_least_recently_used_first(tmp_path):
+    mapper = FileMapper(files_dir=str(tmp_path))
+    saved = save_distances(mapper=mapper, keys=['go_BP', 'go_CC', 'go_MF'])
+    # ===== nothing is loaded before its first use =====
+    assert resident(mapper) == set()
+    size = mapper.get_distance_matrix(key='go_BP', distance_measure='jaccard').nbytes
+    mapper.distance_budget = 2 * size
+    mapper.get_distance_matrix(key='go_CC', distance_measure='jaccard')
+    mapper.get_distance_matrix(key='go_BP', distance_measure='jaccard')
+    mapper.get_distance_matrix(key='go_MF', distance_measure='jaccard')
+    assert resident(mapper) == {('jaccard', 'go_BP'), ('jaccard', 'go_MF')}
+    # ===== an evicted matrix is loaded again with the same values =====
+    reloaded = mapper.get_distance_matrix(key='go_CC', distance_measure='jaccard')
+    assert (reloaded.tocsr() != saved['go_CC']).nnz == 0
+    assert resident(mapper) == {('jaccard', 'go_MF'), ('jaccard', 'go_CC')}
+    assert sum(mapper._distance_usage.values()) <= mapper.distance_budget
+
+
+def test_distances_with_unsaved_delta_are_not_evicted(tmp_path):
+    mapper = FileMapper(files_dir=str(tmp_path), distance_budget=1)
+    saved = save_distances(mapper=mapper, keys=['go_BP', 'go_CC'])
+    mapper.update_distance_ids(in_series=pd.Series([str(index) for index in range(5)]), key='gene_mat_ids')
+    changed = sp.random(5, 5, density=0.4, format='csr', random_state=2)
+    mapper.update_distances(in_mat=changed.tocoo(), id_type='gene_mat_ids', key='go_BP', distance_measure='overlap')
+    mapper.get_distance_matrix(key='go_BP', distance_measure='jaccard')
+    mapper.get_distance_matrix(key='go_CC', distance_measure='jaccard')
+    # ===== the changed matrix is only in memory and stays although it was used least recently =====
+    assert resident(mapper) == {('overlap', 'go_BP'), ('jaccard', 'go_CC')}
+    assert (mapper.get_distance_matrix(key='go_BP', distance_measure='overlap').tocsr() != changed).nnz == 0
+    assert (mapper.get_distance_matrix(key='go_BP', distance_measure='jaccard').tocsr() != saved['go_BP']).nnz == 0
+    assert resident(mapper) == {('overlap', 'go_BP'), ('jaccard', 'go_BP')}
+
+
+def dataframe_lookup(mapping: pd.DataFrame, in_set, id_type: str):
+    # ===== lookup on the whole dataframe as done before the columnar mappings =====
+    if id_type not in ['entrezgene', 'mondo']:
+        mapping = mapping.explode(id_type)
+    hit_mapping = mapping.loc[mapping[id_type].isin(in_set)]
+    return hit_mapping, set(in_set) - set(hit_mapping[id_type])
+
+
+def comparable(frame: pd.DataFrame) -> pd.DataFrame:
+    frame = frame.apply(lambda column: column.map(lambda value: tuple(sorted(value)) if isinstance(value, set)
+                                                  else value))
+    return frame.sort_values(list(frame.columns)).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("id_type,in_set", [('entrezgene', ['1', '3', '9', '1']),
+                                            ('symbol', ['A', 'B', 'X', 'B']),
+                                            ('uniprot', ['P1', 'P3', 'P9'])])
+def test_loaded_mapping_lookup_equals_dataframe_lookup(id_type, in_set):
+    mapping = pd.DataFrame({'entrezgene': ['1', '2', '1', '3', '4'],
+                            'symbol': [{"A"}, {"B", "C"}, {"B"}, set(), {"D"}],
+                            'uniprot': [{"P1", "P2"}, set(), {"P3"}, {"P1"}, {"P4"}]})
+    mapper = Mapper()
+    mapper.set_loaded_mapping(key='gene_ids', mapping=mapping)
+    hits, missing = mapper.get_loaded_mapping(in_set=in_set, id_type=id_type, key='gene_ids')
+    expected_hits, expected_missing = dataframe_lookup(mapping=mapping, in_set=in_set, id_type=id_type)
+    pd.testing.assert_frame_equal(comparable(hits), comparable(expected_hits))
+    assert missing == expected_missing
+
+
+def test_readers_keep_their_snapshot_while_a_writer_updates():
+    mapper = Mapper()
+    mapper.update_mappings(in_df=gene_atts(['1', '2']), key='gene_atts')
+    mapper.update_distance_ids(in_series=pd.Series(['1', '2']), key='gene_mat_ids')
+    mapper.update_distances(in_mat=sp.coo_matrix(([0.5], ([0], [1])), shape=(2, 2)), id_type='gene_mat_ids',
+                            key='go_BP', distance_measure='jaccard')
+    snapshot = mapper.state
+    written, release = threading.Event(), threading.Event()
+
+    def write():
+        with mapper.write():
+            mapper.update_mappings(in_df=gene_atts(['3']), key='gene_atts')
+            mapper.update_distance_ids(in_series=pd.Series(['1', '2', '3']), key='gene_mat_ids')
+            mapper.update_distances(in_mat=sp.coo_matrix(([0.25], ([2], [0])), shape=(3, 3)),
+                                    id_type='gene_mat_ids', key='go_BP', distance_measure='jaccard')
+            written.set()
+            release.wait()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    written.wait()
+    # ===== the unpublished writes are invisible to other threads =====
+    assert mapper.state is snapshot
+    assert list(mapper.get_columnar_mapping(key='gene_atts').ids) == ['1', '2']
+    np.testing.assert_array_equal(mapper.get_loaded_distances(
+        in_series=pd.Series(['1', '2']), id_type='gene_mat_ids', key='go_BP', distance_measure='jaccard').toarray(),
+        [[0, 0.5], [0, 0]])
+    release.set()
+    writer.join()
+    # ===== the old snapshot stays consistent, a new one sees all updates together =====
+    assert list(snapshot.mappings.get_columnar('gene_atts').ids) == ['1', '2']
+    assert list(snapshot.distance_ids['gene_mat_ids']) == ['1', '2']
+    assert snapshot.distances['jaccard']['go_BP'].shape == (2, 2)
+    assert list(mapper.state.mappings.get_columnar('gene_atts').ids) == ['1', '2', '3']
+    assert list(mapper.state.distance_ids['gene_mat_ids']) == ['1', '2', '3']
+    np.testing.assert_array_equal(mapper.get_loaded_distances(
+        in_series=pd.Series(['3', '1']), id_type='gene_mat_ids', key='go_BP', distance_measure='jaccard').toarray(),
+        [[0, 0.25], [0, 0]])
+
+
+def test_save_distances_creates_the_measure_directories(tmp_path):
+    mapper = FileMapper(files_dir=str(tmp_path / "files"))
+    mapper.update_distance_ids(in_series=pd.Series(['1', '2']), key='gene_mat_ids')
+    mapper.update_distances(in_mat=sp.coo_matrix(([0.5], ([0], [1])), shape=(2, 2)), id_type='gene_mat_ids',
+                            key='go_BP', distance_measure='overlap')
+    mapper.save_distances()
+    assert su.load_index(file=mapper.get_index_path(key='gene_mat_ids')).tolist() == ['1', '2']
+    saved = su.load_sparse(path=mapper.get_store_path(key='go_BP', distance_measure='overlap'))
+    np.testing.assert_array_equal(saved.toarray(), [[0, 0.5], [0, 0]])
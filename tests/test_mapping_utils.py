@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("graph_tool", reason="the evaluation package imports graph_tool")
+
+from evaluation import config as c
+from evaluation.mappers import mapping_utils as mu
+
+
+@pytest.fixture
+def gene_mappings():
+    id_mapping = pd.DataFrame({'entrezgene': ['1', '2', '3', '4'], 'symbol': ['A', 'A', np.nan, 'C'],
+                               'ensembl.gene': [['E1', 'E2'], np.nan, ['E2'], ['E3']]})
+    # ===== duplicated main id 1, main id 5 without id mapping and main id 4 without attributes =====
+    att_mapping = pd.DataFrame({'entrezgene': ['1', '2', '3', '1', '5'],
+                                'go.BP': [{"b1"}, {"b2"}, {"b3"}, {"b4"}, {"b5"}],
+                                'go.CC': [{"c1"}, set(), set(), set(), {"c5"}],
+                                'go.MF': [set(), {"m2"}, set(), set(), set()],
+                                'pathway.kegg': [set(), set(), {"k3"}, set(), set()]})
+    return id_mapping, att_mapping
+
+
+def records(id_type: str, rows: dict) -> list:
+    return [{id_type: id_value, **dict(zip(c.GENE_ATTRIBUTES_KEY, values))} for id_value, values in rows.items()]
+
+
+@pytest.mark.parametrize("id_type,expected", [
+    ("entrezgene", {'1': ({"b1", "b4"}, {"c1"}, set(), set()), '2': ({"b2"}, set(), {"m2"}, set()),
+                    '3': ({"b3"}, set(), set(), {"k3"}), '4': (set(), set(), set(), set()),
+                    '5': ({"b5"}, {"c5"}, set(), set())}),
+    # ===== A unites the attributes of 1 and 2, C has the empty ones of 4 =====
+    ("symbol", {'A': ({"b1", "b2", "b4"}, {"c1"}, {"m2"}, set()), 'C': (set(), set(), set(), set())}),
+    ("ensembl.gene", {'E1': ({"b1", "b4"}, {"c1"}, set(), set()), 'E2': ({"b1", "b3", "b4"}, {"c1"}, set(), {"k3"}),
+                      'E3': (set(), set(), set(), set())})])
+def test_map_to_prev_id(gene_mappings, id_type, expected):
+    id_mapping, att_mapping = gene_mappings
+    new = mu.map_to_prev_id(main_id_type='entrezgene', id_type=id_type, id_mapping=id_mapping,
+                            att_mapping=att_mapping)
+    assert list(new.columns) == [id_type] + list(c.GENE_ATTRIBUTES_KEY)
+    assert new.index.equals(pd.RangeIndex(len(new)))
+    assert new.to_dict('records') == records(id_type=id_type, rows=expected)
+
+
+def test_map_to_prev_id_without_attributes(gene_mappings):
+    id_mapping, att_mapping = gene_mappings
+    new = mu.map_to_prev_id(main_id_type='entrezgene', id_type='symbol', id_mapping=id_mapping,
+                            att_mapping=att_mapping.iloc[:0])
+    assert new.to_dict('records') == records(id_type='symbol', rows={'A': (set(),) * 4, 'C': (set(),) * 4})
+
+
+@pytest.fixture
+def disgenet_file(tmp_path):
+    # ===== surrounding whitespace, a space after a separator, a trailing separator and missing values =====
+    file = tmp_path / "disease_mapping.tsv.gz"
+    pd.DataFrame({'diseaseId': ['C1', 'C2', 'C1', 'C3', 'C4', 'C5'],
+                  'geneId': [" G1;G2 ", "G3; G4", "G5;", "", "G6", np.nan], 'other': "x"}).to_csv(
+        file, sep='\t', index=False, compression='gzip')
+    return str(file)
+
+
+@pytest.mark.parametrize("chunksize", [None, 1, 2, 1000])
+def test_transform_disgenet_mapping(disgenet_file, chunksize):
+    # ===== two disease ids of M1, C4 of the file without mondo id and C9 missing in the file =====
+    mapping = pd.DataFrame({'diseaseId': ['C1', 'C2', 'C3', 'C9', 'C5'], 'mondo': ['M1', 'M1', 'M2', 'M3', 'M4']})
+    column = 'disgenet.genes_related_to_disease'
+    new = mu.transform_disgenet_mapping(mapping=mapping, file=disgenet_file, col_old='geneId', col_new=column,
+                                        chunksize=chunksize)
+    assert list(new.columns) == ['mondo', column]
+    # ===== only the whole value is stripped, as before the chunked read =====
+    expected = {'M1': {"G1", "G2", "G3", " G4", "G5"}, 'M2': set(), 'M3': set(), 'M4': set()}
+    assert new.to_dict('records') == [{'mondo': mondo, column: values} for mondo, values in expected.items()]
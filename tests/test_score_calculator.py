@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+pytest.importorskip("graph_tool", reason="the evaluation package imports graph_tool")
+
+from evaluation import score_calculator as sc
+
+
+@pytest.fixture
+def distances():
+    """
+    Clusters {0, 1} and {2, 3} with similarities 0.8 between 0 and 1, 0.6 between 2 and 3 and 0.1 between
+    0 and 2, so distances of 0.2, 0.4 and 0.9. All other pairs have no similarity and distance 1.
+    """
+    similarities = sp.csr_matrix(([0.8, 0.1, 0.6], ([0, 0, 2], [1, 2, 3])), shape=(4, 4))
+    return sc.precalc_distance_arrays(distances=similarities, labels=np.array([5, 5, 7, 7]))
+
+
+def test_precalc_distance_arrays(distances):
+    np.testing.assert_array_equal(distances['clusters'], [5, 7])
+    np.testing.assert_array_equal(distances['sizes'], [2, 2])
+    np.testing.assert_allclose(distances['entity_intra']['sum'], [0.2, 0.2, 0.4, 0.4])
+    np.testing.assert_array_equal(distances['entity_intra']['count'], [1, 1, 1, 1])
+    np.testing.assert_allclose(distances['intra']['sum'], [0.2, 0.4])
+    np.testing.assert_array_equal(distances['entity_inter']['entity'], [0, 2])
+    np.testing.assert_array_equal(distances['entity_inter']['cluster'], [1, 0])
+    np.testing.assert_allclose(distances['entity_inter']['sum'], [0.9, 0.9])
+    np.testing.assert_allclose(distances['inter']['sum'], [[0, 0.9], [0.9, 0]])
+
+
+@pytest.mark.parametrize("linkage,score,clusters", [
+    # ===== average intra distance of 0 is (0.2 + 1) / 2, of 2 is (0.4 + 1) / 2, the inter distance is 1 =====
+    ("average", (0.4 + 0.4 + 0.3 + 0.3) / 4, {5: 0.4, 7: 0.3}),
+    ("complete", (0.8 + 0.8 + 0.6 + 0.6) / 4, {5: 0.8, 7: 0.6}),
+    ("single", (0.8 + 0.8 + 0.6 + 0.6) / 4, {5: 0.8, 7: 0.6})])
+def test_silhouette_score(distances, linkage, score, clusters):
+    result, result_clusters = sc.silhouette_score(distances=distances, linkage=linkage)
+    assert result == pytest.approx(score)
+    assert result_clusters == pytest.approx(clusters)
+
+
+@pytest.mark.parametrize("linkage,index", [
+    # ===== inter distance (0.9 + 3) / 4 over the larger intra distance (0.4 + 1) / 2 =====
+    ("average", 0.975 / 0.7),
+    ("complete", 0.9 / 0.4),
+    ("single", 0.9 / 0.4)])
+def test_dunn_index(distances, linkage, index):
+    assert sc.dunn_index(distances=distances, linkage=linkage) == pytest.approx(index)
+
+
+def test_davies_bouldin_index(distances):
+    # ===== intra distances 0.6 and 0.7 with inter distance 0.975 for both clusters =====
+    assert sc.davies_bouldin_index(distances=distances) == pytest.approx(0.6 * 0.7 / 0.975)
+
+
+def test_rows_shared_by_entities():
+    # ===== row 0 belongs to entities 0 and 1 of the first cluster, row 1 to entity 2 of the second =====
+    row_entities = sp.csr_matrix(([1, 1, 1], ([0, 0, 1], [0, 1, 2])), shape=(2, 4), dtype=np.int8)
+    distances = sc.precalc_distance_arrays(distances=sp.csr_matrix(([0.5], ([0], [1])), shape=(2, 2)),
+                                           labels=np.array([0, 0, 1, 1]), row_entities=row_entities)
+    np.testing.assert_array_equal(distances['entity_intra']['count'], [0, 0, 0, 0])
+    np.testing.assert_array_equal(distances['entity_inter']['entity'], [0, 1, 2])
+    np.testing.assert_allclose(distances['entity_inter']['sum'], [0.5, 0.5, 1.0])
+    np.testing.assert_array_equal(distances['inter']['count'], [[0, 2], [2, 0]])
+    # ===== no intra distances, so both intra distances are 1, the inter distance is (1.0 + 2) / 4 =====
+    assert sc.dunn_index(distances=distances) == pytest.approx(0.75)
+    assert sc.davies_bouldin_index(distances=distances) == pytest.approx(1 / 0.75)
+    assert sc.silhouette_score(distances=distances) == (0.0, {0: 0.0, 1: 0.0})
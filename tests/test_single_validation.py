@@ -0,0 +1,149 @@
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("graph_tool", reason="the evaluation package imports graph_tool")
+
+import single_validation as sv
+from evaluation import background_models as bm, comparator as comp, config as c
+
+TARGET = {"S0", "S3", "S7", "S9", "S12", "S14", "S21", "S28", "S33", "S35"}
+
+
+def create_comparator(mapper, mode: str, tar: set = TARGET):
+    if mode == "set":
+        comparator = comp.SetComparator(mapper=mapper, distance_measure="jaccard")
+    else:  # mode == "set-set"
+        comparator = comp.SetSetComparator(mapper=mapper, distance_measure="jaccard")
+        rng = np.random.default_rng(1)
+        comparator.ref_dict = {attribute: set("t" + str(term) for term in rng.choice(15, 5, replace=False))
+                               for attribute in c.GENE_ATTRIBUTES_KEY}
+    comparator.load_target(id_set=tar, id_type="symbol")
+    comparator.compare()
+    comparator.input_run = False
+    return comparator
+
+
+def per_run_values(comparator, mapper, runs: int, replace: int, seed: int) -> pd.DataFrame:
+    """
+    Random runs of the complete background model with one load_target and compare per run as before the
+    batched runs, with the same random generator per chunk of runs.
+    """
+    full_id_map = mapper.get_full_set(id_type='symbol', mapping_name='gene_ids')
+    orig_ids = sorted(comparator.id_set)
+    random_size = int((len(orig_ids) / 100) * replace)
+    model = bm.CompleteModel(prev_id_type='symbol', full_id_map=full_id_map)
+    limit = int((runs + 1) / min(runs + 1, 100))
+    starts = range(0, runs, limit)
+    _, *chunk_seeds = np.random.SeedSequence(seed).spawn(len(starts) + 1)
+    results = list()
+    for start, chunk_seed in zip(starts, chunk_seeds):
+        rng = np.random.default_rng(chunk_seed)
+        for _ in range(start, min(start + limit, runs)):
+            old_sample = set(rng.choice(orig_ids, size=len(orig_ids) - random_size, replace=False)) \
+                if random_size < len(orig_ids) else set()
+            random_sample = model.get_module(to_replace=set(orig_ids).difference(old_sample), rng=rng)
+            id_set = full_id_map[full_id_map['symbol'].isin(random_sample.union(old_sample))][comparator.att_id]
+            comparator.load_target(id_set=set(id_set), id_type="entrez")
+            result, _ = comparator.compare()
+            if result:
+                results.append(result)
+    return pd.DataFrame(results)
+
+
+@pytest.mark.parametrize("mode", ["set", "set-set"])
+@pytest.mark.parametrize("replace", [100, 50, 20])
+def test_complete_model_equals_per_run(gene_mapper, mode, replace):
+    comparator = create_comparator(mapper=gene_mapper, mode=mode)
+    values = sv.get_random_runs_values(comparator=comparator, mode=mode, mapper=gene_mapper, tar_id="symbol",
+                                       runs=150, replace=replace, seed=42)[0]
+    expected = per_run_values(comparator=create_comparator(mapper=gene_mapper, mode=mode), mapper=gene_mapper,
+                              runs=150, replace=replace, seed=42)
+    pd.testing.assert_frame_equal(values, expected)
+
+
+def test_set_without_attributes_compares_to_float(gene_mapper):
+    # ===== S41 and S42 are mapped to entrez ids without attribute row =====
+    comparator = create_comparator(mapper=gene_mapper, mode="set", tar={"S41", "S42"})
+    comparator.load_target(id_set={"S41", "S42"}, id_type="symbol")
+    result, _ = comparator.compare()
+    batch = comparator.compare_batch(modules=np.array([[-2, -3, -1]])).to_dict('records')
+    assert [result] == batch
+    assert all(type(value) is float for value in result.values())
+    assert all(type(value) is float for value in comparator.compare_leave_one_out()["S41"].values())
+
+
+def test_complete_model_with_small_population(gene_mapper):
+    # ===== more ids to replace than symbols to pick from =====
+    tar = set("S" + str(index) for index in range(40)) | {"S40", "S41"}
+    comparator = create_comparator(mapper=gene_mapper, mode="set", tar=tar)
+    modules = sv.draw_random_modules(population=np.arange(3), id_indices=(np.array([0, 1, 3, 3]), np.array([5, 6, 7])),
+                                     orig_codes=np.array([0, -1, 2]), runs=4, num_kept=0, random_size=3,
+                                     rng=np.random.default_rng(0))
+    assert modules.tolist() == [[5, 6, 7]] * 4
+    values = sv.get_random_runs_values(comparator=comparator, mode="set", mapper=gene_mapper, tar_id="symbol",
+                                       runs=10, seed=1)[0]
+    assert len(values) == 10
+
+
+@pytest.mark.parametrize("mode", ["set", "set-set"])
+def test_compare_leave_one_out_equals_compare(gene_mapper, mode):
+    # ===== S40 is not mapped, S0 and S36 map to several entrez ids =====
+    tar = TARGET | {"S36", "S40"}
+    comparator = create_comparator(mapper=gene_mapper, mode=mode, tar=tar)
+    loo_values = comparator.compare_leave_one_out()
+    assert set(loo_values) == tar
+    for excluded in tar:
+        comparator.load_target(id_set=tar - {excluded}, id_type="symbol")
+        expected, _ = comparator.compare()
+        assert loo_values[excluded] == pytest.approx(expected) if mode == "set" else loo_values[excluded] == expected
+
+
+@pytest.mark.parametrize("mode", ["set", "set-set"])
+def test_leave_one_out_contributions_equal_significance_contribution(gene_mapper, mode):
+    ref = {"S1", "S2", "S5", "S8"} if mode == "set-set" else None
+    ref_id = "symbol" if mode == "set-set" else None
+    results = sv.single_validation(tar=TARGET, tar_id="symbol", mode=mode, ref=ref, ref_id=ref_id,
+                                   mapper=gene_mapper, runs=60, seed=3)
+    contributions = sv.leave_one_out_contributions(results=results, tar=TARGET, tar_id="symbol", mode=mode, ref=ref,
+                                                   ref_id=ref_id, mapper=gene_mapper, runs=60, seed=4)
+    assert set(contributions) == TARGET
+    for excluded in TARGET:
+        expected = sv.significance_contribution(results=results, excluded=excluded, tar=TARGET, tar_id="symbol",
+                                                mode=mode, ref=ref, ref_id=ref_id, mapper=gene_mapper, runs=60,
+                                                seed=4)
+        if mode == "set-set":
+            assert contributions[excluded] == expected[excluded]
+        else:  # the input value is summed up in another order, which can break a tie with one random run
+            difference = pd.DataFrame(contributions[excluded]) - pd.DataFrame(expected[excluded])
+            assert (difference.abs().to_numpy() <= 1 / 61 + 1e-12).all()
+
+
+@pytest.mark.parametrize("mode", ["set", "set-set"])
+def test_random_runs_equal_with_workers(gene_mapper, mode):
+    comparator = create_comparator(mapper=gene_mapper, mode=mode)
+    serial = sv.get_random_runs_values(comparator=comparator, mode=mode, mapper=gene_mapper, tar_id="symbol",
+                                       runs=150, replace=50, seed=7, workers=1)[0]
+    parallel = sv.get_random_runs_values(comparator=comparator, mode=mode, mapper=gene_mapper, tar_id="symbol",
+                                         runs=150, replace=50, seed=7, workers=2)[0]
+    pd.testing.assert_frame_equal(serial, parallel)
+
+
+def test_random_runs_not_forked_with_threads(gene_mapper, monkeypatch):
+    comparator = create_comparator(mapper=gene_mapper, mode="set")
+    serial = sv.get_random_runs_values(comparator=comparator, mode="set", mapper=gene_mapper, tar_id="symbol",
+                                       runs=50, seed=7)[0]
+    methods, get_context = list(), sv.mp.get_context
+    monkeypatch.setattr(sv.mp, "get_context", lambda method: methods.append(method) or get_context(method))
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    thread.start()
+    try:
+        values = sv.get_random_runs_values(comparator=comparator, mode="set", mapper=gene_mapper, tar_id="symbol",
+                                           runs=50, seed=7, workers=2)[0]
+    finally:
+        stop.set()
+        thread.join()
+    assert len(methods) == 1 and methods[0] != 'fork'
+    pd.testing.assert_frame_equal(serial, values)
@@ -0,0 +1,57 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sp
+
+pytest.importorskip("graph_tool", reason="the evaluation package imports graph_tool")
+
+from evaluation.mappers import store_utils as su
+from evaluation.mappers.mapper import FileMapper
+
+
+def assert_same_matrix(matrix: sp.csr_matrix, expected: sp.spmatrix):
+    assert matrix.shape == expected.shape
+    assert (matrix != expected.tocsr()).nnz == 0
+
+
+def test_npz_converts_to_memory_mapped_store(tmp_path):
+    matrix = sp.random(6, 6, density=0.3, format='coo', random_state=0)
+    sp.save_npz(str(tmp_path / "distances.npz"), matrix)
+    su.convert_npz(npz_file=str(tmp_path / "distances.npz"), path=str(tmp_path / "distances"))
+    assert not os.path.exists(tmp_path / "distances.npz")
+    assert su.is_sparse_store(str(tmp_path / "distances"))
+    loaded = su.load_sparse(path=str(tmp_path / "distances"))
+    assert isinstance(su.load_arrays(path=str(tmp_path / "distances"), names=['data'])['data'], np.memmap)
+    assert not loaded.data.flags.writeable
+    assert_same_matrix(matrix=loaded, expected=matrix)
+    assert_same_matrix(matrix=su.load_sparse(path=str(tmp_path / "distances"), mmap=False), expected=matrix)
+    ids = pd.Index(["1", "10", "100"], dtype=object)
+    su.save_index(index=ids, file=str(tmp_path / "ids.npy"))
+    assert su.load_index(file=str(tmp_path / "ids.npy")).equals(ids)
+
+
+def test_convert_distances_of_file_mapper(tmp_path):
+    mapper = FileMapper(files_dir=str(tmp_path))
+    ids = {str(index): index for index in [3, 0, 4, 1, 2]}
+    matrices = dict()
+    for index, distance_measure in enumerate(['jaccard', 'overlap']):
+        os.makedirs(tmp_path / distance_measure)
+        with open(tmp_path / distance_measure / mapper.file_names['gene_mat_ids'], 'wb') as f:
+            pickle.dump(ids, f)
+        matrices[distance_measure] = sp.random(5, 5, density=0.4, format='csr', random_state=index)
+        sp.save_npz(str(tmp_path / distance_measure / mapper.file_names['go_BP']), matrices[distance_measure])
+    mapper.convert_distances()
+    # ===== the .npz and .pkl files are replaced by stores and one index =====
+    assert sorted(os.listdir(tmp_path / 'jaccard')) == ["gene_dist_go_BP"]
+    assert su.load_index(file=mapper.get_index_path(key='gene_mat_ids')).tolist() == ["0", "1", "2", "3", "4"]
+    for distance_measure, matrix in matrices.items():
+        assert_same_matrix(matrix=mapper.get_distance_matrix(key='go_BP', distance_measure=distance_measure).tocsr(),
+                           expected=matrix)
+    stamps = {os.path.join(root, name): os.stat(os.path.join(root, name)).st_mtime_ns
+              for root, _, names in os.walk(tmp_path) for name in names}
+    # ===== converting again finds nothing to convert =====
+    mapper.convert_distances()
+    assert {os.path.join(root, name): os.stat(os.path.join(root, name)).st_mtime_ns
+            for root, _, names in os.walk(tmp_path) for name in names} == stamps